@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__      = "Roger Truchero Visa"
+__copyright__   = "Copyright 2020"
+__credits__     = []
+__license__     = "GPL"
+__version__     = "1.0.0"
+__maintainer__  = "Roger Truchero Visa"
+__email__       = "truchero.roger@gmail.com"
+__status__      = "Development"
+
+
+from module import LOG_PATH, ALERT_QUEUE_SIZE, ALERT_BATCH_SIZE, ALERT_INTERVAL, ALERT_TIMEOUT, ALERT_RETRY_DELAY, ALERT_RETRY_MAX_DELAY, ALERT_OUT_OF_STOCK, ALERT_RESTOCKED, ALERT_CHANGED
+from Logger import Logger
+
+from collections import OrderedDict
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+
+
+class WebhookSink():
+    """Post every alerts batch as a json { "alerts" : [...] } body to an url.
+    """
+
+    def __init__(self, url, timeout=ALERT_TIMEOUT, headers=None):
+        """Initialize object.
+
+        Args:
+            url (string): webhook url.
+            timeout (float, optional): request timeout in seconds. Defaults to ALERT_TIMEOUT.
+            headers (dictionary, optional): extra request headers, e.g. an authorization token. Defaults to None.
+        """
+        self.name = "webhook"
+        self.url = url
+        self.timeout = timeout
+        self.headers = dict(headers or {}, **{ "Content-Type" : "application/json" })
+
+
+    def send(self, alerts):
+        """Post an alerts batch.
+
+        Args:
+            alerts (list): alerts to send.
+
+        Raises:
+            urllib.error.URLError: if the request fails or the response status is not 2xx.
+        """
+        body = json.dumps({ "alerts" : alerts }).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, headers=self.headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class FileSink():
+    """Append every alert as a json line to a file.
+    """
+
+    def __init__(self, path):
+        """Initialize object.
+
+        Args:
+            path (string): json lines file path, its directory is created if needed.
+        """
+        self.name = "file"
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+
+    def send(self, alerts):
+        """Append an alerts batch.
+
+        Args:
+            alerts (list): alerts to send.
+        """
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(alert) + "\n" for alert in alerts))
+
+
+class AlertDispatcher():
+    """Notify the empty holes transitions of every camera through pluggable sinks.
+    The last notified empty holes of every camera and color are kept, and an alert is only raised when the confirmed
+    count of a frame differs from it (it only changes when a frame confirms or clears holes, see HoleTracker), so
+    repeated frames never notify again. An alert dropped because the queue is full doesn't move the notified count,
+    so the next frame of the camera raises it again.
+    Raising an alert only queues it: a background thread sends the queued alerts in batches of up to batch_size,
+    at most one batch every interval seconds, merging the alerts of the same camera and color meanwhile (a hole
+    that appears and clears within the interval is not notified). Every sink is an object with a name and a
+    send(alerts) method, see WebhookSink and FileSink. A batch that a sink fails to send is retried, only to the
+    failed sinks, after retry_delay seconds doubled on every failure up to ALERT_RETRY_MAX_DELAY, before any newer
+    batch, so a sink outage delays the notifications but doesn't lose them.
+    The counts live as long as the HoleTracker tracks of the camera: the tracker calls forget when it evicts
+    them, so a camera that comes back starts again from no empty holes, as its tracks do.
+    """
+
+    def __init__(self, sinks, maxsize=ALERT_QUEUE_SIZE, batch_size=ALERT_BATCH_SIZE, interval=ALERT_INTERVAL, retry_delay=ALERT_RETRY_DELAY):
+        """Initialize object and start the sender thread.
+
+        Args:
+            sinks (list): alert sinks, empty to disable the alerts.
+            maxsize (int, optional): maximum queued alerts. Defaults to ALERT_QUEUE_SIZE.
+            batch_size (int, optional): maximum alerts per notification. Defaults to ALERT_BATCH_SIZE.
+            interval (float, optional): minimum seconds between notifications. Defaults to ALERT_INTERVAL.
+            retry_delay (float, optional): seconds before retrying a failed batch, doubled after every failure. Defaults to ALERT_RETRY_DELAY.
+        """
+        self.logger = Logger(LOG_PATH, "AlertDispatcher.py")
+        self.sinks = list(sinks)
+        self.queue = queue.Queue(maxsize)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.states = {} # (camera id, color) to last confirmed empty holes, of the tracked cameras
+        self.sent = float("-inf") # Last notification monotonic time
+        self.lock = threading.Lock()
+        self.metrics = { "raised" : 0, "dropped" : 0, "merged" : 0, "sent" : 0, "retries" : 0, "errors" : 0 }
+        self.thread = threading.Thread(target=self.run, name="AlertDispatcher", daemon=True)
+        if self.sinks:
+            self.thread.start()
+            atexit.register(self.stop) # Send the pending alerts before the interpreter exits
+        self.logger.info(":__init__ sinks: {0} batch_size: {1} interval: {2} info: dispatcher started", [sink.name for sink in self.sinks], batch_size, interval)
+
+
+    def update(self, camera_id, tracking, id=None, now=None):
+        """Raise the alerts of the tracked empty holes of a camera frame, without waiting for them to be sent.
+
+        Args:
+            camera_id (string): camera id.
+            tracking (dictionary): color to HoleTracker result, with the confirmed "empty_holes" and the "appeared" and "cleared" holes.
+            id (string, optional): request id of the frame. Defaults to None.
+            now (float, optional): frame timestamp in seconds. Defaults to None, the current time.
+
+        Returns:
+            int: number of raised (queued) alerts.
+        """
+        if not self.sinks:
+            return 0
+
+        now = time.time() if now is None else now
+        raised = 0
+        dropped = []
+        with self.lock:
+            for color, result in tracking.items():
+                key = (camera_id, color)
+                previous = self.states.get(key, 0)
+                if result["empty_holes"] == previous:
+                    continue
+
+                alert = {
+                    "camera_id" : camera_id,
+                    "color" : color,
+                    "event" : self.get_event(previous, result["empty_holes"]),
+                    "empty_holes" : result["empty_holes"],
+                    "previous" : previous,
+                    "appeared" : result["appeared"],
+                    "cleared" : result["cleared"],
+                    "id" : id,
+                    "timestamp" : now,
+                }
+                # The state only moves with a queued alert, a dropped one is raised again by the next frame
+                try:
+                    self.queue.put_nowait(alert)
+                except queue.Full:
+                    self.metrics["dropped"] += 1
+                    dropped.append(color)
+                    continue
+                self.states[key] = result["empty_holes"]
+                self.metrics["raised"] += 1
+                raised += 1
+
+        for color in dropped:
+            self.logger.warning(":update camera_id: {0} color: {1} error: alerts queue full, alert dropped!", camera_id, color)
+
+        return raised
+
+
+    def forget(self, keys):
+        """Forget the last confirmed empty holes of some cameras, e.g. evicted by the HoleTracker.
+
+        Args:
+            keys (list): (camera id, color) keys.
+        """
+        with self.lock:
+            for key in keys:
+                self.states.pop(key, None)
+
+
+    @staticmethod
+    def get_event(previous, empty_holes):
+        """Name an empty holes transition.
+
+        Args:
+            previous (int): previous confirmed empty holes.
+            empty_holes (int): current confirmed empty holes.
+
+        Returns:
+            string: ALERT_OUT_OF_STOCK, ALERT_RESTOCKED or ALERT_CHANGED.
+        """
+        if empty_holes == 0:
+            return ALERT_RESTOCKED
+
+        return ALERT_OUT_OF_STOCK if previous == 0 else ALERT_CHANGED
+
+
+    def run(self):
+        """Sender thread loop, a None item sends the pending alerts and stops it.
+        """
+        pending = OrderedDict() # (camera id, color) to merged alert, oldest first
+        failed = None # (alerts, sinks) batch not sent yet to some sinks, retried before the pending alerts
+        failures = 0
+        retry = 0.0 # Monotonic time of the next retry
+        while True:
+            due = retry if failed is not None else self.sent + self.interval
+            wait = max(due - time.monotonic(), 0.0) if pending or failed is not None else None
+            try:
+                alert = self.queue.get(timeout=wait)
+            except queue.Empty:
+                alert = False
+
+            if alert is None:
+                # Last attempt, what still fails is lost
+                if failed is not None:
+                    self.flush(*failed)
+                while pending:
+                    self.flush(self.take(pending), self.sinks)
+                return
+
+            if alert:
+                self.merge(pending, alert)
+            if (pending or failed is not None) and time.monotonic() >= due:
+                if failed is None:
+                    failed = (self.take(pending), self.sinks)
+                else:
+                    self.count("retries")
+                sinks = self.flush(*failed)
+                if sinks:
+                    failed = (failed[0], sinks)
+                    retry = time.monotonic() + min(self.retry_delay * 2 ** failures, ALERT_RETRY_MAX_DELAY)
+                    failures += 1
+                else:
+                    failed = None
+                    failures = 0
+
+
+    def merge(self, pending, alert):
+        """Merge an alert with the pending alert of the same camera and color, if any.
+        The merged alert goes from the first previous count to the last count, and it is discarded if both are the same.
+
+        Args:
+            pending (OrderedDict): pending alerts by (camera id, color).
+            alert (dictionary): new alert.
+        """
+        key = (alert["camera_id"], alert["color"])
+        first = pending.pop(key, None)
+        if first is not None:
+            self.count("merged")
+            alert = dict(alert, previous=first["previous"], appeared=first["appeared"] + alert["appeared"], cleared=first["cleared"] + alert["cleared"])
+            alert["event"] = self.get_event(alert["previous"], alert["empty_holes"])
+            if alert["previous"] == alert["empty_holes"]:
+                return
+
+        pending[key] = alert
+
+
+    def take(self, pending):
+        """Remove the oldest batch_size pending alerts.
+
+        Args:
+            pending (OrderedDict): pending alerts by (camera id, color).
+
+        Returns:
+            list: alerts batch.
+        """
+        return [pending.popitem(last=False)[1] for _ in range(min(self.batch_size, len(pending)))]
+
+
+    def flush(self, alerts, sinks):
+        """Send an alerts batch through some sinks.
+        A failing sink is logged and doesn't prevent the others from sending. The alerts are counted as sent
+        once every sink has sent them.
+
+        Args:
+            alerts (list): alerts batch.
+            sinks (list): sinks to send the batch through.
+
+        Returns:
+            list: sinks that failed to send the batch.
+        """
+        failed = []
+        for sink in sinks:
+            try:
+                sink.send(alerts)
+            except Exception as e:
+                failed.append(sink)
+                self.count("errors")
+                self.logger.error(":flush sink: {0} alerts: {1} e: {2} error: unable to send the alerts!", sink.name, len(alerts), e)
+
+        if not failed:
+            self.count("sent", len(alerts))
+        self.sent = time.monotonic()
+        self.logger.info(":flush alerts: {0} failed: {1} info: alerts sent", len(alerts), [sink.name for sink in failed])
+
+        return failed
+
+
+    def count(self, metric, value=1):
+        """Increment a metric.
+
+        Args:
+            metric (string): metric name.
+            value (int, optional): increment. Defaults to 1.
+        """
+        with self.lock:
+            self.metrics[metric] += value
+
+
+    def stats(self):
+        """Obtain the dispatcher metrics.
+
+        Returns:
+            dictionary: raised, dropped, merged, sent (by every sink), retries and errors counters plus the current queue depth.
+        """
+        with self.lock:
+            stats = dict(self.metrics)
+        stats["depth"] = self.queue.qsize()
+
+        return stats
+
+
+    def stop(self):
+        """Send the pending alerts and stop the sender thread.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
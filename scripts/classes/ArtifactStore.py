@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__      = "Roger Truchero Visa"
+__copyright__   = "Copyright 2020"
+__credits__     = []
+__license__     = "GPL"
+__version__     = "1.0.0"
+__maintainer__  = "Roger Truchero Visa"
+__email__       = "truchero.roger@gmail.com"
+__status__      = "Development"
+
+
+from module import LOG_PATH, STORE_PATH, STORE_INDEX_PATH, STORE_TTL, STORE_MAX_BYTES, STORE_PRUNE_INTERVAL, STORE_PRUNE_BATCH, get_shard
+from Logger import Logger
+
+import atexit
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+
+
+class ArtifactStore():
+    """Index and retention of the localstore request artifacts.
+    Artifacts live in sharded directories (see module.get_shard) and every request is indexed in SQLite
+    with its camera id, timestamp, empty holes, directory, files and size, so lookups and pruning never
+    scan the localstore. The requests and bytes totals are kept up to date by triggers, so they are read
+    without scanning the index and are shared by every process using it. A background thread prunes the requests older than ttl seconds and then the
+    oldest ones while the artifacts exceed max_bytes.
+    The index also keeps the asynchronous detection jobs, so any server process can answer for a job accepted by
+    another one, see JobQueue.
+    """
+
+    def __init__(self, store_path=STORE_PATH, index_path=STORE_INDEX_PATH, ttl=STORE_TTL, max_bytes=STORE_MAX_BYTES, interval=STORE_PRUNE_INTERVAL, start=True):
+        """Initialize object, open the index and start the pruning thread.
+
+        Args:
+            store_path (string, optional): localstore path. Defaults to STORE_PATH.
+            index_path (string, optional): SQLite index path. Defaults to STORE_INDEX_PATH.
+            ttl (float, optional): seconds the artifacts of a request are kept. Defaults to STORE_TTL.
+            max_bytes (int, optional): maximum artifacts size. Defaults to STORE_MAX_BYTES.
+            interval (float, optional): seconds between prunings. Defaults to STORE_PRUNE_INTERVAL.
+            start (boolean, optional): start the pruning thread. Defaults to True.
+        """
+        self.logger = Logger(LOG_PATH, "ArtifactStore.py")
+        self.store_path = store_path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA auto_vacuum = INCREMENTAL") # Before the tables are created, free pages are released on pruning
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS artifacts (
+            id TEXT PRIMARY KEY,
+            camera_id TEXT,
+            timestamp REAL NOT NULL,
+            empty_holes TEXT,
+            path TEXT NOT NULL,
+            files TEXT NOT NULL DEFAULT '{}',
+            bytes INTEGER NOT NULL DEFAULT 0
+        )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS artifacts_timestamp ON artifacts (timestamp)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS artifacts_camera ON artifacts (camera_id, timestamp)")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            submitted REAL NOT NULL,
+            finished REAL,
+            bytes INTEGER NOT NULL DEFAULT 0
+        )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished)")
+        self.create_totals()
+
+        self.thread = threading.Thread(target=self.run, name="ArtifactStore", daemon=True)
+        if start:
+            self.thread.start()
+            atexit.register(self.stop)
+        self.logger.info(":__init__ index_path: {0} ttl: {1} max_bytes: {2} info: store opened", index_path, ttl, max_bytes)
+
+
+    def create_totals(self):
+        """Create the running totals of the index and the triggers updating them, counting the existing requests once.
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), requests INTEGER NOT NULL, bytes INTEGER NOT NULL)")
+            self.connection.execute("INSERT OR IGNORE INTO totals SELECT 0, COUNT(*), COALESCE(SUM(bytes), 0) FROM artifacts")
+            self.connection.execute("""CREATE TRIGGER IF NOT EXISTS artifacts_insert AFTER INSERT ON artifacts BEGIN
+                UPDATE totals SET requests = requests + 1, bytes = bytes + NEW.bytes; END""")
+            self.connection.execute("""CREATE TRIGGER IF NOT EXISTS artifacts_update AFTER UPDATE OF bytes ON artifacts BEGIN
+                UPDATE totals SET bytes = bytes + NEW.bytes - OLD.bytes; END""")
+            self.connection.execute("""CREATE TRIGGER IF NOT EXISTS artifacts_delete AFTER DELETE ON artifacts BEGIN
+                UPDATE totals SET requests = requests - 1, bytes = bytes - OLD.bytes; END""")
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+
+    def execute(self, sql, parameters=()):
+        """Run a query on the index.
+
+        Args:
+            sql (string): SQL query.
+            parameters (tuple, optional): query parameters. Defaults to ().
+
+        Returns:
+            list: result rows.
+        """
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+
+    def add_files(self, id, files, size, now=None):
+        """Index files written into the directory of a request.
+
+        Args:
+            id (string): request id.
+            files (dictionary): artifact name to file name, e.g. { "frame" : "frame.jpg" }.
+            size (int): written bytes.
+            now (float, optional): request timestamp if it is not indexed yet. Defaults to None, the current time.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute("SELECT files FROM artifacts WHERE id = ?", (id,)).fetchone()
+                if row is None:
+                    self.connection.execute("INSERT INTO artifacts (id, timestamp, path, files, bytes) VALUES (?, ?, ?, ?, ?)", (id, now, get_shard(id) + "/" + id, json.dumps(files), size))
+                else:
+                    self.connection.execute("UPDATE artifacts SET files = ?, bytes = bytes + ? WHERE id = ?", (json.dumps(dict(json.loads(row[0]), **files)), size, id))
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+
+    def record(self, id, camera_id, empty_holes, now=None):
+        """Index the detection result of a request.
+
+        Args:
+            id (string): request id.
+            camera_id (string): camera id, None if unknown.
+            empty_holes (int|dictionary): empty holes, or empty holes by color.
+            now (float, optional): request timestamp if it is not indexed yet. Defaults to None, the current time.
+        """
+        now = time.time() if now is None else now
+        self.execute("""INSERT INTO artifacts (id, camera_id, timestamp, empty_holes, path) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET camera_id = excluded.camera_id, empty_holes = excluded.empty_holes""",
+            (id, camera_id, now, json.dumps(empty_holes), get_shard(id) + "/" + id))
+
+
+    def get(self, id):
+        """Obtain the index entry of a request.
+
+        Args:
+            id (string): request id.
+
+        Returns:
+            dictionary: request entry, see to_entry, None if the request isn't indexed.
+        """
+        rows = self.execute("SELECT id, camera_id, timestamp, empty_holes, path, files, bytes FROM artifacts WHERE id = ?", (id,))
+        return self.to_entry(rows[0]) if rows else None
+
+
+    def get_file(self, id, name):
+        """Obtain the path of a request artifact.
+
+        Args:
+            id (string): request id.
+            name (string): artifact name, e.g. "frame", "mask" or "original".
+
+        Returns:
+            string: artifact path, None if the request or the artifact aren't indexed.
+        """
+        entry = self.get(id)
+        if entry is None or name not in entry["files"]:
+            return None
+
+        return os.path.join(self.store_path, entry["path"], entry["files"][name])
+
+
+    def query(self, camera_id=None, since=None, until=None, limit=100):
+        """Find the indexed requests, newest first.
+
+        Args:
+            camera_id (string, optional): camera id. Defaults to None, any camera.
+            since (float, optional): minimum timestamp. Defaults to None.
+            until (float, optional): maximum timestamp. Defaults to None.
+            limit (int, optional): maximum requests. Defaults to 100.
+
+        Returns:
+            list: request entries, see to_entry.
+        """
+        conditions, parameters = [], []
+        for condition, value in (("camera_id = ?", camera_id), ("timestamp >= ?", since), ("timestamp <= ?", until)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        rows = self.execute("SELECT id, camera_id, timestamp, empty_holes, path, files, bytes FROM artifacts {0} ORDER BY timestamp DESC LIMIT ?".format(where), tuple(parameters) + (limit,))
+
+        return [self.to_entry(row) for row in rows]
+
+
+    @staticmethod
+    def to_entry(row):
+        """Convert an index row to a request entry.
+
+        Args:
+            row (tuple): id, camera_id, timestamp, empty_holes, path, files and bytes columns.
+
+        Returns:
+            dictionary: request entry with the same keys.
+        """
+        id, camera_id, timestamp, empty_holes, path, files, size = row
+        return {
+            "id" : id,
+            "camera_id" : camera_id,
+            "timestamp" : timestamp,
+            "empty_holes" : json.loads(empty_holes) if empty_holes is not None else None,
+            "path" : path,
+            "files" : json.loads(files),
+            "bytes" : size,
+        }
+
+
+    def prune(self, now=None):
+        """Remove the requests older than ttl and then the oldest ones while the artifacts exceed max_bytes.
+
+        Args:
+            now (float, optional): current timestamp. Defaults to None, the current time.
+
+        Returns:
+            int: number of removed requests.
+        """
+        now = time.time() if now is None else now
+        removed = 0
+        while True:
+            rows = self.execute("SELECT id, path, bytes FROM artifacts WHERE timestamp < ? ORDER BY timestamp LIMIT ?", (now - self.ttl, STORE_PRUNE_BATCH))
+            if not rows:
+                break
+            removed += self.remove(rows)
+
+        total = self.stats()["bytes"]
+        while total > self.max_bytes:
+            rows = self.execute("SELECT id, path, bytes FROM artifacts ORDER BY timestamp LIMIT ?", (STORE_PRUNE_BATCH,))
+            if not rows:
+                break
+            oldest = []
+            for row in rows:
+                if total <= self.max_bytes:
+                    break
+                oldest.append(row)
+                total -= row[2]
+            removed += self.remove(oldest)
+
+        if removed:
+            self.execute("PRAGMA incremental_vacuum")
+            self.logger.info(":prune removed: {0} bytes: {1} info: store pruned", removed, total)
+
+        return removed
+
+
+    def remove(self, rows):
+        """Remove the artifacts and the index entries of some requests, and their emptied shard directories.
+
+        Args:
+            rows (list): id, path and bytes rows.
+
+        Returns:
+            int: number of removed requests.
+        """
+        for id, path, _ in rows:
+            directory = os.path.join(self.store_path, path)
+            shutil.rmtree(directory, ignore_errors=True)
+
+            # Compact the shards tree, removing the emptied shard directories
+            directory = os.path.dirname(directory)
+            while os.path.abspath(directory) != os.path.abspath(self.store_path):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+                directory = os.path.dirname(directory)
+
+        with self.lock:
+            self.connection.executemany("DELETE FROM artifacts WHERE id = ?", [(row[0],) for row in rows])
+
+        return len(rows)
+
+
+    def put_job(self, id, job, size=0):
+        """Save the state of an asynchronous job.
+
+        Args:
+            id (string): job id.
+            job (dictionary): job state, result, error, submitted and finished times, see JobQueue.get.
+            size (int, optional): result size in bytes, see JobQueue.get_size. Defaults to 0.
+        """
+        self.execute("INSERT OR REPLACE INTO jobs (id, state, result, error, submitted, finished, bytes) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (id, job["state"], json.dumps(job["result"]) if job["result"] is not None else None, job["error"], job["submitted"], job["finished"], size))
+
+
+    def get_job(self, id):
+        """Obtain the state of an asynchronous job.
+
+        Args:
+            id (string): job id.
+
+        Returns:
+            dictionary: job state, result, error, submitted and finished times, None if the job doesn't exist or has expired.
+        """
+        rows = self.execute("SELECT state, result, error, submitted, finished FROM jobs WHERE id = ?", (id,))
+        if not rows:
+            return None
+
+        state, result, error, submitted, finished = rows[0]
+        return { "state" : state, "result" : json.loads(result) if result is not None else None, "error" : error, "submitted" : submitted, "finished" : finished }
+
+
+    def remove_job(self, id):
+        """Forget an asynchronous job.
+
+        Args:
+            id (string): job id.
+        """
+        self.execute("DELETE FROM jobs WHERE id = ?", (id,))
+
+
+    def expire_jobs(self, now, ttl, max_results, max_bytes):
+        """Forget the finished jobs past their ttl, and then the oldest ones beyond max_results or max_bytes.
+        Queued and running jobs are never forgotten.
+
+        Args:
+            now (float): current timestamp in seconds.
+            ttl (float): seconds a finished job is kept.
+            max_results (int): maximum kept finished jobs.
+            max_bytes (int): maximum kept finished jobs results size.
+
+        Returns:
+            int: number of forgotten jobs.
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self.connection.execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished <= ?", (now - ttl,)).rowcount
+                rows = self.connection.execute("SELECT id, bytes FROM jobs WHERE finished IS NOT NULL ORDER BY finished DESC").fetchall()
+                kept, total, oldest = 0, 0, []
+                for id, size in rows:
+                    if not oldest and kept < max_results and total + size <= max_bytes:
+                        kept += 1
+                        total += size
+                    else:
+                        oldest.append((id,))
+                self.connection.executemany("DELETE FROM jobs WHERE id = ?", oldest)
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+        return expired + len(oldest)
+
+
+    def stats(self):
+        """Obtain the store metrics.
+
+        Returns:
+            dictionary: indexed requests and their artifacts bytes.
+        """
+        requests, size = self.execute("SELECT requests, bytes FROM totals")[0]
+        return { "requests" : requests, "bytes" : size }
+
+
+    def run(self):
+        """Pruning thread loop, until stop.
+        """
+        while not self.stopped.wait(self.interval):
+            try:
+                self.prune()
+            except Exception as e:
+                self.logger.error(":run e: {0} error: unable to prune the store!", e)
+
+
+    def stop(self):
+        """Stop the pruning thread.
+        """
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+
+    def migrate(self):
+        """Move the legacy unsharded localstore/<id>/ directories into their shard and index them.
+        This is the only operation scanning the localstore, it is run once.
+
+        Returns:
+            int: number of migrated requests.
+        """
+        migrated = 0
+        for id in sorted(os.listdir(self.store_path)):
+            source = os.path.join(self.store_path, id)
+            if not os.path.isdir(source):
+                continue
+
+            # Legacy request directories only hold files, shard directories only hold directories
+            names = os.listdir(source)
+            if not names or any(os.path.isdir(os.path.join(source, name)) for name in names):
+                continue
+
+            destination = os.path.join(self.store_path, get_shard(id), id)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.move(source, destination)
+
+            files = { name.rsplit(".", 1)[0] : name for name in names }
+            size = sum(os.path.getsize(os.path.join(destination, name)) for name in names)
+            prefix = id.split("_", 1)[0]
+            self.add_files(id, files, size, float(prefix) if prefix.isdigit() else os.path.getmtime(destination))
+            migrated += 1
+
+        self.logger.info(":migrate migrated: {0} info: legacy localstore migrated", migrated)
+        return migrated
+
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] in ("migrate", "prune", "stats"):
+        store = ArtifactStore(start=False)
+        result = getattr(store, sys.argv[1])()
+        print(json.dumps(result))
+    else:
+        print("Usage: python ArtifactStore.py <migrate|prune|stats>")
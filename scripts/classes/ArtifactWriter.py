@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__      = "Roger Truchero Visa"
+__copyright__   = "Copyright 2020"
+__credits__     = []
+__license__     = "GPL"
+__version__     = "1.0.0"
+__maintainer__  = "Roger Truchero Visa"
+__email__       = "truchero.roger@gmail.com"
+__status__      = "Development"
+
+
+from module import LOG_PATH, STORE_PATH, ARTIFACT_QUEUE_SIZE, ARTIFACT_QUEUE_TIMEOUT, get_path, get_shard
+from Logger import Logger
+
+import atexit
+import cv2
+import os
+import queue
+import shutil
+import threading
+import time
+
+
+class ArtifactWriter():
+    """Persist request artifacts (annotated frame, mask, ...) into the localstore from a background thread.
+    The queue depth is bounded: when it is full the writer waits up to ARTIFACT_QUEUE_TIMEOUT seconds
+    (backpressure) and then drops the artifacts, so the request path never waits on the disk.
+    Written artifacts and detection results are indexed in the ArtifactStore, if any, also from the
+    writer thread and in submission order, so a result is indexed after the artifacts of its request.
+    The artifacts of a request can also be shared with a later one (e.g. a cached duplicated frame), see link.
+    """
+
+    def __init__(self, maxsize=ARTIFACT_QUEUE_SIZE, timeout=ARTIFACT_QUEUE_TIMEOUT, store=None, observe=None):
+        """Initialize object and start the writer thread.
+
+        Args:
+            maxsize (int, optional): maximum pending requests. Defaults to ARTIFACT_QUEUE_SIZE.
+            timeout (float, optional): seconds to wait for a free slot before dropping. Defaults to ARTIFACT_QUEUE_TIMEOUT.
+            store (ArtifactStore, optional): artifacts index. Defaults to None, artifacts aren't indexed.
+            observe (function, optional): called with the image name and the seconds it took to encode and write every image. Defaults to None.
+        """
+        self.logger = Logger(LOG_PATH, "ArtifactWriter.py")
+        self.store = store
+        self.observe = observe
+        self.queue = queue.Queue(maxsize)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.metrics = { "queued" : 0, "written" : 0, "linked" : 0, "recorded" : 0, "dropped" : 0, "backpressure" : 0, "errors" : 0 }
+        self.thread = threading.Thread(target=self.run, name="ArtifactWriter", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop) # Never leave the thread writing while the interpreter exits
+        self.logger.info(":__init__ maxsize: {0} timeout: {1} info: writer started", maxsize, timeout)
+
+
+    def submit(self, id, images, ext="jpg"):
+        """Queue the artifacts of a request to be written.
+        Images must not be modified after being submitted.
+
+        Args:
+            id (string): request id.
+            images (dictionary): image name to cv2 image, e.g. { "frame" : image, "mask" : mask }.
+            ext (string, optional): images extension. Defaults to "jpg".
+
+        Returns:
+            boolean: True if the artifacts have been queued, False if they have been dropped.
+        """
+        if not self.put((id, images, ext, None, None)):
+            self.logger.warning(":submit id: {0} error: artifact queue full, artifacts dropped!", id)
+            return False
+
+        self.increment("queued")
+        return True
+
+
+    def record(self, id, camera_id, empty_holes):
+        """Queue the detection result of a request to be indexed, see ArtifactStore.record.
+
+        Args:
+            id (string): request id.
+            camera_id (string): camera id, None if unknown.
+            empty_holes (int|dictionary): empty holes, or empty holes by color.
+
+        Returns:
+            boolean: True if the result has been queued, False if it has been dropped or there is no store.
+        """
+        if self.store is None:
+            return False
+
+        if not self.put((id, {}, None, (camera_id, empty_holes, time.time()), None)):
+            self.logger.warning(":record id: {0} error: artifact queue full, result not indexed!", id)
+            return False
+
+        return True
+
+
+    def link(self, id, source):
+        """Queue the artifacts of a previous request to be shared with a request, see link_files.
+        They are linked after the pending artifacts of the previous request have been written.
+
+        Args:
+            id (string): request id.
+            source (string): previous request id.
+
+        Returns:
+            boolean: True if the link has been queued, False if it has been dropped.
+        """
+        if not self.put((id, {}, None, None, source)):
+            self.logger.warning(":link id: {0} source: {1} error: artifact queue full, artifacts not linked!", id, source)
+            return False
+
+        return True
+
+
+    def put(self, item):
+        """Queue an item, waiting up to timeout seconds for a free slot.
+
+        Args:
+            item (tuple): (id, images, ext, result, source) item, see run.
+
+        Returns:
+            boolean: True if the item has been queued, False if it has been dropped.
+        """
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            try:
+                if self.timeout <= 0:
+                    raise queue.Full
+                self.increment("backpressure")
+                self.queue.put(item, timeout=self.timeout)
+            except queue.Full:
+                self.increment("dropped")
+                return False
+
+        return True
+
+
+    def run(self):
+        """Writer thread loop, a None item stops it.
+        """
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+
+                id, images, ext, result, source = item
+                if result is not None:
+                    camera_id, empty_holes, now = result
+                    self.store.record(id, camera_id, empty_holes, now)
+                    self.increment("recorded")
+                    continue
+
+                if source is not None:
+                    self.link_files(id, source)
+                    self.increment("linked")
+                    continue
+
+                path = get_path(id)
+                files = {}
+                for name, image in images.items():
+                    files[name] = name + "." + ext
+                    start = time.perf_counter()
+                    if not cv2.imwrite(path + files[name], image):
+                        raise IOError("unable to write {0}".format(files[name]))
+                    if self.observe is not None:
+                        self.observe(name, time.perf_counter() - start)
+                if self.store is not None:
+                    self.store.add_files(id, files, sum(os.path.getsize(path + file) for file in files.values()))
+                self.increment("written")
+
+            except Exception as e:
+                self.increment("errors")
+                self.logger.error(":run item: {0} e: {1} error: unable to write artifacts!", item[0], e)
+
+            finally:
+                self.queue.task_done()
+
+
+    def link_files(self, id, source):
+        """Hard link (or copy, across file systems) the written artifacts of a previous request into the directory
+        of a request and index them. Only the files that exist are linked, the artifacts dropped or already pruned
+        are not, and neither is the previous request original frame.
+
+        Args:
+            id (string): request id.
+            source (string): previous request id.
+
+        Returns:
+            dictionary: linked artifact name to file name.
+        """
+        source_path = STORE_PATH + get_shard(source) + "/" + source + "/"
+        names = [name for name in sorted(os.listdir(source_path)) if not name.startswith("original.")] if os.path.isdir(source_path) else []
+        if not names:
+            return {}
+
+        path = get_path(id)
+        files = {}
+        for name in names:
+            try:
+                os.link(source_path + name, path + name)
+            except FileExistsError:
+                pass
+            except OSError:
+                shutil.copyfile(source_path + name, path + name)
+            files[name.rsplit(".", 1)[0]] = name
+        if self.store is not None:
+            self.store.add_files(id, files, sum(os.path.getsize(path + file) for file in files.values()))
+
+        return files
+
+
+    def increment(self, metric):
+        """Increment a writer metric.
+
+        Args:
+            metric (string): metric name.
+        """
+        with self.lock:
+            self.metrics[metric] += 1
+
+
+    def stats(self):
+        """Obtain the writer metrics.
+
+        Returns:
+            dictionary: queued, written, linked, recorded, dropped, backpressure and errors counters plus the current queue depth.
+        """
+        with self.lock:
+            stats = dict(self.metrics)
+        stats["depth"] = self.queue.qsize()
+
+        return stats
+
+
+    def join(self):
+        """Block until all the queued artifacts have been written and results indexed.
+        """
+        self.queue.join()
+
+
+    def stop(self):
+        """Write the pending artifacts and stop the writer thread.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__      = "Roger Truchero Visa"
+__copyright__   = "Copyright 2020"
+__credits__     = []
+__license__     = "GPL"
+__version__     = "1.0.0"
+__maintainer__  = "Roger Truchero Visa"
+__email__       = "truchero.roger@gmail.com"
+__status__      = "Development"
+
+
+from module import BUFFER_POOL_SIZE
+
+from collections import OrderedDict
+import numpy as np
+import threading
+
+
+class BufferPool():
+    """Per-thread reusable arrays, keyed by name, shape and type.
+    Frames of the same resolution get back the same mask and scratch arrays, filled through the OpenCV
+    dst arguments, instead of allocating them for every frame. Each thread has its own arrays, so a
+    detector shared between threads never sees them change underneath. An array is only valid until the
+    same thread asks for it again: anything kept longer (e.g. queued to the ArtifactWriter) must be copied.
+    """
+
+    def __init__(self, maxsize=BUFFER_POOL_SIZE):
+        """Initialize object.
+
+        Args:
+            maxsize (int, optional): maximum arrays per thread, the least recently used are released. Defaults to BUFFER_POOL_SIZE.
+        """
+        self.maxsize = maxsize
+        self.local = threading.local()
+
+
+    def get(self, name, shape, dtype=np.uint8):
+        """Obtain the array of the current thread, allocating it on first use.
+        Its contents are whatever the previous frame left.
+
+        Args:
+            name (string): array role, e.g. "mask".
+            shape (tuple): array shape.
+            dtype (numpy.dtype, optional): array type. Defaults to numpy.uint8.
+
+        Returns:
+            numpy.ndarray: reusable array.
+        """
+        buffers = getattr(self.local, "buffers", None)
+        if buffers is None:
+            buffers = self.local.buffers = OrderedDict()
+
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        buffer = buffers.get(key)
+        if buffer is None:
+            buffer = buffers[key] = np.empty(shape, dtype)
+            while len(buffers) > self.maxsize:
+                buffers.popitem(last=False)
+        else:
+            buffers.move_to_end(key)
+
+        return buffer
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__      = "Roger Truchero Visa"
+__copyright__   = "Copyright 2020"
+__credits__     = []
+__license__     = "GPL"
+__version__     = "1.0.0"
+__maintainer__  = "Roger Truchero Visa"
+__email__       = "truchero.roger@gmail.com"
+__status__      = "Development"
+
+
+from collections import OrderedDict
+import json
+import numpy as np
+import threading
+
+
+# Default profile, the fridge geometry known from the 1920x1080 t485 camera images
+DEFAULT_PROFILE = {
+    "colors" : {
+        # BGR
+        "blue" : [[50, 0, 0], [255, 50, 50]],
+        "green" : [[0, 50, 0], [50, 255, 50]],
+        "red" : [[0, 0, 50], [50, 50, 255]],
+    },
+    "min_area" : 300,
+    "max_x" : 0.5338,
+    "exclude" : [
+        [[0, 0], [0, 0.6481], [0.5338, 0]], # ABC triangle
+        [[0.5338, 0.3981], [0.5338, 1], [0.2344, 1]], # DEF triangle
+    ],
+    "resolutions" : [[1080, 1920]],
+}
+
+
+class CalibrationProfile():
+    """Camera calibration profile: color ranges, minimum area and fridge geometry.
+    The geometry is relative to the frame size: the valid area is at the left of max_x and outside
+    the exclude convex polygons, all given as (x, y) fractions of the frame width and height.
+    Profiles are compiled once: the region of interest of every declared resolution and the colors
+    lookup tables are built before serving, other resolutions are built on first use and kept in a
+    small LRU cache.
+    """
+
+    def __init__(self, name, colors, min_area, max_x, exclude, resolutions=(), cache_size=8):
+        """Initialize object.
+
+        Args:
+            name (string): profile name.
+            colors (dictionary): color name to ([B, G, R] lower, [B, G, R] upper) values.
+            min_area (float): minimum effective colored area of a valid contour.
+            max_x (float): valid area right limit, as a fraction of the frame width.
+            exclude (list): excluded convex polygons, lists of (x, y) fractions of the frame width and height.
+            resolutions (list, optional): (height, width) frame sizes compiled in advance. Defaults to ().
+            cache_size (int, optional): maximum cached regions of interest. Defaults to 8.
+        """
+        self.name = name
+        self.colors = { color : (list(lower), list(upper)) for color, (lower, upper) in colors.items() }
+        self.ranges = { color : np.array(values, dtype="uint8") for color, values in self.colors.items() }
+        self.min_area = min_area
+        self.max_x = max_x
+        self.exclude = [[tuple(point) for point in polygon] for polygon in exclude]
+        self.resolutions = [tuple(resolution) for resolution in resolutions]
+        self.cache_size = max(cache_size, len(self.resolutions))
+
+        # Region points cache by (height, width), region of interest LRU cache by (height, width) and colors lookup tables by colors tuple
+        self.regions = {}
+        self.rois = OrderedDict()
+        self.luts = {}
+        self.lock = threading.Lock()
+
+
+    @classmethod
+    def from_dict(cls, name, profile):
+        """Create a profile from its json definition, missing fields are taken from DEFAULT_PROFILE.
+
+        Args:
+            name (string): profile name.
+            profile (dictionary): profile definition.
+
+        Returns:
+            CalibrationProfile: profile object.
+        """
+        values = dict(DEFAULT_PROFILE, **profile)
+        return cls(name, values["colors"], values["min_area"], values["max_x"], values["exclude"], values["resolutions"])
+
+
+    def compile(self):
+        """Build the regions of interest of the declared resolutions and the lookup table of all the colors.
+
+        Returns:
+            CalibrationProfile: the profile itself.
+        """
+        for height, width in self.resolutions:
+            self.get_roi(height, width)
+        if 0 < len(self.colors) <= 8:
+            self.get_colors_lut(tuple(self.colors))
+
+        return self
+
+
+    def get_region_points(self, height, width):
+        """Obtain the ponderate fridge region points for a frame size.
+        Points are computed once per (height, width) and cached.
+
+        Args:
+            height (int): frame height.
+            width (int): frame width.
+
+        Returns:
+            dictionary: "exclude" integer polygons as (N, 2) arrays and "C" valid area right limit x coordinate.
+        """
+        key = (height, width)
+        points = self.regions.get(key)
+        if points is None:
+            points = {
+                "exclude" : [np.array([(int(width*x), int(height*y)) for x, y in polygon], dtype=np.int64) for polygon in self.exclude],
+                "C" : int(width*self.max_x),
+            }
+            self.regions[key] = points
+
+        return points
+
+
+    def get_roi(self, height, width):
+        """Obtain the region of interest for a frame size.
+        Contours touching the columns at the right of C are never valid, so only the columns
+        until C are processed, plus two guard columns: findContours clears the image border and
+        a blob crossing C must still reach past it to be discarded as it is on the full frame.
+        The validity of every possible bounding rectangle bottom-right corner P (exclude polygons
+        and right of C tests) is precomputed in a lookup mask.
+
+        Args:
+            height (int): frame height.
+            width (int): frame width.
+
+        Returns:
+            dictionary: "width" of the processed region, "valid" (height+1, width+1) boolean corner lookup mask and profile "min_area".
+        """
+        key = (height, width)
+        with self.lock:
+            roi = self.rois.get(key)
+            if roi is not None:
+                self.rois.move_to_end(key)
+                return roi
+
+        points = self.get_region_points(height, width)
+        crop = min(width, points["C"] + 2)
+        py, px = np.mgrid[0:height+1, 0:crop+1]
+        valid = px <= points["C"]
+        for polygon in points["exclude"]:
+            valid &= ~self.in_polygon(polygon, px, py)
+        roi = { "width" : crop, "valid" : valid, "min_area" : self.min_area }
+
+        with self.lock:
+            self.rois[key] = roi
+            if len(self.rois) > self.cache_size:
+                self.rois.popitem(last=False)
+
+        return roi
+
+
+    def get_colors_lut(self, colors):
+        """Obtain the per-channel lookup table labeling pixels with a bit per color.
+        Bit i of the blue, green and red channel values is set if the value is within the i-th color range of that channel,
+        so a pixel is within the i-th color range if the bit i is set in the three channels.
+
+        Args:
+            colors (tuple): up to 8 colors to label.
+
+        Returns:
+            numpy.ndarray: (1, 256, 3) uint8 lookup table for cv2.LUT.
+        """
+        lut = self.luts.get(colors)
+        if lut is None:
+            values = np.arange(256)
+            lut = np.zeros((1, 256, 3), dtype=np.uint8)
+            for bit, color in enumerate(colors):
+                lower, upper = self.colors[color]
+                for channel in range(3):
+                    lut[0, :, channel] |= (((values >= lower[channel]) & (values <= upper[channel])) << bit).astype(np.uint8)
+            self.luts[colors] = lut
+
+        return lut
+
+
+    def is_valid_box(self, height, width, areas, boxes):
+        """Vectorized contour validity check computed from the region points, without the lookup mask.
+
+        Args:
+            height (int): frame height.
+            width (int): frame width.
+            areas (numpy.ndarray): (N,) effective colored areas.
+            boxes (numpy.ndarray): (N, 4) integer x, y, w, h bounding rectangles.
+
+        Returns:
+            numpy.ndarray: (N,) boolean array, True if the contour is within the valid area.
+        """
+        points = self.get_region_points(height, width)
+        px = boxes[:, 0] + boxes[:, 2]
+        py = boxes[:, 1] + boxes[:, 3]
+        valid = (areas >= self.min_area) & (px <= points["C"])
+        for polygon in points["exclude"]:
+            valid &= ~self.in_polygon(polygon, px, py)
+
+        return valid
+
+
+    @staticmethod
+    def in_polygon(polygon, x, y):
+        """Check if the P(x, y) points are inside (or on the border of) a convex polygon.
+        Uses exact integer half-plane tests: P is inside if it is not strictly on both sides of the polygon edges.
+
+        Args:
+            polygon (numpy.ndarray): (N, 2) integer convex polygon vertices.
+            x (numpy.ndarray): P.x integer coordinates.
+            y (numpy.ndarray): P.y integer coordinates.
+
+        Returns:
+            numpy.ndarray: boolean array, True if the point is inside the polygon.
+        """
+        vertices = polygon.tolist()
+        has_neg = has_pos = False
+        for (x1, y1), (x2, y2) in zip(vertices, vertices[1:] + vertices[:1]):
+            d = (x2 - x1) * (y - y1) - (y2 - y1) * (x - x1)
+            has_neg = has_neg | (d < 0)
+            has_pos = has_pos | (d > 0)
+
+        return ~(has_neg & has_pos)
+
+
+
+def load_profiles(path):
+    """Load and compile the calibration profiles of a json file.
+    The file has a "profiles" dictionary of name to profile definition (see DEFAULT_PROFILE) and an
+    optional "cameras" dictionary of camera id to profile name. A "default" profile always exists.
+
+    Args:
+        path (string): profiles json file path, None to only use DEFAULT_PROFILE.
+
+    Returns:
+        tuple: (dictionary of name to compiled CalibrationProfile, dictionary of camera id to profile name).
+    """
+    config = { "profiles" : {}, "cameras" : {} }
+    if path is not None:
+        with open(path) as f:
+            config.update(json.load(f))
+
+    definitions = dict({ "default" : DEFAULT_PROFILE }, **config["profiles"])
+    profiles = { name : CalibrationProfile.from_dict(name, profile).compile() for name, profile in definitions.items() }
+    for camera_id, name in config["cameras"].items():
+        if name not in profiles:
+            raise ValueError("camera {0} profile {1} not found".format(camera_id, name))
+
+    return profiles, dict(config["cameras"])
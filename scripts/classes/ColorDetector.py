@@ -11,38 +11,98 @@ __email__       = "truchero.roger@gmail.com"
 __status__      = "Development"
 
 
-from module import LOG_PATH, get_lineno, get_path
+from module import LOG_PATH, STORE_PATH, PROFILES_PATH, PYRAMID_COLORS, IMAGE_FULL, IMAGE_THUMBNAIL, IMAGE_URL, THUMBNAIL_WIDTH, THUMBNAIL_QUALITY, get_path, decode_image, encode_image
 from Logger import Logger
+from CalibrationProfile import CalibrationProfile, load_profiles
+from BufferPool import BufferPool
 
 import cv2
 import numpy as np
 import sys
-import base64
+import time
 
 
 class ColorDetector():
-
-    def __init__(self):
+    """Detect empty holes of a color within the fridge region.
+    The detector is reentrant: the frame state lives in each call, so a single object can be
+    shared between threads. Only the calibration profiles caches are shared, guarded by a lock, the
+    mask and scratch arrays are reused per thread, see BufferPool.
+    The color ranges, minimum area and fridge geometry come from the calibration profile selected
+    per call, by name or by camera id, see CalibrationProfile.
+    """
+
+    def __init__(self, writer=None, profiles_path=PROFILES_PATH, profiles=None, store_path=STORE_PATH):
         """Initialize object.
+
+        Args:
+            writer (ArtifactWriter, optional): background artifacts writer. Defaults to None, artifacts are written inline.
+            profiles_path (string, optional): calibration profiles json path, None to only use the default profile. Defaults to PROFILES_PATH.
+            profiles (tuple, optional): already compiled (profiles, cameras), see load_profiles. Defaults to None, loaded from profiles_path.
+            store_path (string, optional): localstore path of the artifacts written inline. Defaults to STORE_PATH.
         """
         self.logger = Logger(LOG_PATH, "ColorDetector.py")
-        self.logger.info(":__init__ info: Initializing logger object", get_lineno())
-        self.colors = {
-            # BGR
-            "blue" : ([50, 0, 0], [255, 50, 50]),
-            "green" : ([0, 50, 0], [50, 255, 50]),
-            "red" : ([0, 0, 50], [50, 50, 255])
-        }
-
-        # Coordinates coefficients
-        self.B_COEFF = 0.6481
-        self.C_COEFF = 0.5338
-        self.D_COEFF_W = self.C_COEFF
-        self.D_COEFF_H = 0.3981
-        self.F_COEFF = 0.2344
-
-
-    def identify_color_contours(self, id, image_path, color="green"):
+        self.logger.info(":__init__ info: Initializing logger object")
+        self.writer = writer
+        self.store_path = store_path
+
+        # Compiled calibration profiles by name and profile name by camera id
+        self.profiles, self.cameras = profiles if profiles is not None else load_profiles(profiles_path)
+        self.profile = self.profiles["default"]
+        self.colors = self.profile.colors
+        self.logger.info(":__init__ profiles: {0} cameras: {1}", sorted(self.profiles), len(self.cameras))
+
+        # Per thread mask and scratch arrays, reused by the frames of the same resolution
+        self.buffers = BufferPool()
+
+
+    def get_profile(self, profile=None, camera_id=None):
+        """Obtain a calibration profile by name or by camera id.
+
+        Args:
+            profile (string|CalibrationProfile, optional): profile name or object. Defaults to None, the camera profile.
+            camera_id (string, optional): camera id, cameras without an assigned profile use the default one. Defaults to None.
+
+        Raises:
+            ValueError: if the profile name doesn't exist.
+
+        Returns:
+            CalibrationProfile: compiled calibration profile.
+        """
+        if isinstance(profile, CalibrationProfile):
+            return profile
+
+        name = profile if profile is not None else self.cameras.get(camera_id, "default")
+        if name not in self.profiles:
+            raise ValueError("unknown profile {0}".format(name))
+
+        return self.profiles[name]
+
+
+    def load_image(self, image):
+        """Obtain a cv2 image from a path, an encoded buffer or an already decoded image.
+
+        Args:
+            image (string|bytes-like|numpy.ndarray): image path, encoded image bytes or decoded BGR image.
+
+        Raises:
+            ValueError: if the image can't be read or decoded.
+
+        Returns:
+            numpy.ndarray: decoded BGR image.
+        """
+        if isinstance(image, np.ndarray):
+            return image
+
+        if isinstance(image, str):
+            decoded = cv2.imread(image)
+            if decoded is None:
+                raise ValueError("unable to read image {0}".format(image))
+            return decoded
+
+        return decode_image(image)
+
+
+    def identify_color_contours(self, id, image, color="green", ext=None, image_mode=IMAGE_FULL, thumbnail_width=THUMBNAIL_WIDTH, quality=THUMBNAIL_QUALITY, save=True, timings=None, scale=1, profile=None, holes=None, counts=None):
         """Identify regions between lower and upper color intervals.
         Estimate the empty area using the color.
         Based on this value send fill alarm.
@@ -50,88 +110,347 @@ class ColorDetector():
 
         Args:
             id (string): Request id.
-            image_path (string): Image path.
+            image (string|bytes-like|numpy.ndarray): Image path, encoded image bytes or decoded BGR image (annotated in place).
             color (string, optional): Color to detect. Defaults to "green".
+            ext (string, optional): Extension used to save and encode the output images. Defaults to the image path extension or "jpg".
+            image_mode (string, optional): Response image mode, one of IMAGE_MODES. The image is only encoded when it is asked for. Defaults to IMAGE_FULL.
+            thumbnail_width (int, optional): IMAGE_THUMBNAIL maximum width. Defaults to THUMBNAIL_WIDTH.
+            quality (int, optional): IMAGE_THUMBNAIL JPEG quality. Defaults to THUMBNAIL_QUALITY.
+            save (boolean, optional): Save the annotated image and the mask into the localstore. Defaults to True.
+            timings (dictionary, optional): Filled with each pipeline stage duration in seconds, see get_lap. Defaults to None.
+            scale (int, optional): Fast mode downscale factor (e.g. 2) of the PYRAMID_COLORS, see find_contours. Defaults to 1, full resolution.
+            profile (string|CalibrationProfile, optional): Calibration profile name or object, see get_profile. Defaults to None, the default profile.
+            holes (list, optional): Filled with the (x, y, w, h) bounding rectangles of the empty holes, see HoleTracker. Defaults to None.
+            counts (dictionary, optional): Filled with the (found, valid) contours of the color, before and after filter_contours. Defaults to None.
 
         Returns:
             dictionary: structure with the timestamp id, images path and number of empty holes.
         """
         response = { "base64image" : "", "empty_holes" :  0 }
-        self.logger.info(":identify_color_contours id:{0} color: {1}".format(id, color), get_lineno())
+        lap = self.get_lap(timings)
+        profile = self.get_profile(profile)
+        self.logger.info(":identify_color_contours id:{0} color: {1} profile: {2}", id, color, profile.name)
 
-        if color not in self.colors:
-            self.logger.error(":identify_color_contours id: {0} color: {1} error: Invalid color!".format(id, color), get_lineno())
+        if color not in profile.colors:
+            self.logger.error(":identify_color_contours id: {0} color: {1} error: Invalid color!", id, color)
             return ""
 
-        lower, upper = np.array(self.colors[color], dtype="uint8") # Obtain corresponding lower and upper color values
-        image = cv2.imread(image_path) # Read image
-        self.HEIGHT, self.WIDTH, _ = image.shape # Obtain height and widht sizes
-        self.logger.info(":identify_color_contours id: {0} height: {1} width: {2}".format(id, self.HEIGHT, self.WIDTH), get_lineno())
-
-        mask = cv2.inRange(image, lower, upper) # Find the color specified and apply the mask
-        contours = cv2.findContours(mask.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2] # Find all contours
+        lower, upper = profile.ranges[color] # Obtain corresponding lower and upper color values
+        if ext is None:
+            ext = image.split(".")[-1] if isinstance(image, str) else "jpg"
+        image = self.load_image(image) # Read or decode image
+        lap("decode")
+        height, width, _ = image.shape # Obtain height and widht sizes
+        self.logger.info(":identify_color_contours id: {0} height: {1} width: {2}", id, height, width)
+
+        roi = profile.get_roi(height, width) # Obtain the region of interest for this frame size
+        scale = scale if color in PYRAMID_COLORS else 1
+        padded = self.get_mask(height, roi["width"], scale)
+        mask = cv2.inRange(image[:, :roi["width"]], lower, upper, dst=padded[:height, :roi["width"]]) # Find the color specified within the region of interest and apply the mask
+        lap("threshold")
+        contours = self.find_contours(padded, mask.shape, roi["min_area"], scale) # Find all contours, the mask is left untouched
+        lap("contours")
+        if counts is not None:
+            counts[color] = (len(contours), 0)
 
         if len(contours) > 0:
-            #red_area = max(contours, key=cv2.contourArea)
-            for contour in contours:
-                x, y, w, h = cv2.boundingRect(contour)
-                contour_area = cv2.contourArea(contour)
-                if self.is_valid_contour(contour_area, x, y, w, h):
-                    cv2.rectangle(image, (x, y), (x+w, y+h), (0, 0, 255), 2)
-                    response["empty_holes"] += 1
-                    self.logger.info(":identify_color_contours id: {0} contour_area: {1} empty_holes: {2} values: {3}".format(id, contour_area, response["empty_holes"], (x, y, w, h)), get_lineno())
+            boxes, areas, valid = self.filter_contours(contours, roi)
+            lap("filter")
+            draw = save or image_mode in (IMAGE_FULL, IMAGE_THUMBNAIL) # Annotate only if the image is used
+            response["empty_holes"] = self.draw_contours(id, image if draw else None, boxes, areas, valid)
+            if holes is not None:
+                holes.extend(boxes[valid].tolist())
+            if counts is not None:
+                counts[color] = (len(contours), response["empty_holes"])
+            lap("draw")
+
+            queued = save and self.writer is not None # The pooled mask is reused by the next frame, the writer keeps a copy
+            self.output_images(id, response, image, { "mask" : mask.copy() if queued else mask }, ext, image_mode, thumbnail_width, quality, save, lap)
+            return response
 
-            # Make request directory
-            ext = image_path.split(".")[-1]
-            path = get_path(id)
-            save_image_path = path + "frame." + ext
-            save_mask_path = path + "mask." + ext
-            self.logger.info(":identify_color_contours id: {0} ext: {1} save_image_path: {2} save_mask_path: {3}".format(id, ext, save_image_path, save_mask_path), get_lineno())
+        self.logger.info(":identify_color_contours id: {0} color: {1} len(contours): {2} info: empty contours", id, color, len(contours))
+        return response
 
-            cv2.imwrite(save_image_path, image) # Save image with rectangle areas
-            self.logger.info(":identify_color_contours id: {0} save_image_path: {1} info: Image saved OK!".format(id,save_mask_path), get_lineno())
 
-            cv2.imwrite(save_mask_path, mask) # Save image mask
-            self.logger.info(":identify_color_contours id: {0} save_mask_path: {1} info: Mask saved OK!".format(id, save_mask_path), get_lineno())
+    def identify_colors_contours(self, id, image, colors=None, ext=None, image_mode=IMAGE_FULL, thumbnail_width=THUMBNAIL_WIDTH, quality=THUMBNAIL_QUALITY, save=True, timings=None, scale=1, profile=None, holes=None, counts=None):
+        """Identify the regions of several colors decoding and thresholding the image only once.
+        Every pixel is labeled with a bit per color through a per-channel lookup table, so the
+        thresholding cost doesn't grow with the number of colors. Then the contours of each color are
+        found and filtered as in identify_color_contours.
 
-            # Encode image to base64
-            _, buffer = cv2.imencode("." + ext, image)
-            response["base64image"] = base64.b64encode(buffer).decode("utf-8")
-            return response
+        Args:
+            id (string): Request id.
+            image (string|bytes-like|numpy.ndarray): Image path, encoded image bytes or decoded BGR image (annotated in place).
+            colors (list, optional): Colors to detect. Defaults to None, all the colors.
+            ext (string, optional): Extension used to save and encode the output images. Defaults to the image path extension or "jpg".
+            image_mode (string, optional): Response image mode, one of IMAGE_MODES. The image is only encoded when it is asked for. Defaults to IMAGE_FULL.
+            thumbnail_width (int, optional): IMAGE_THUMBNAIL maximum width. Defaults to THUMBNAIL_WIDTH.
+            quality (int, optional): IMAGE_THUMBNAIL JPEG quality. Defaults to THUMBNAIL_QUALITY.
+            save (boolean, optional): Save the annotated image and a mask per color into the localstore. Defaults to True.
+            timings (dictionary, optional): Filled with each pipeline stage duration in seconds, see get_lap. Defaults to None.
+            scale (int, optional): Fast mode downscale factor (e.g. 2) of the PYRAMID_COLORS, see find_contours. Defaults to 1, full resolution.
+            profile (string|CalibrationProfile, optional): Calibration profile name or object, see get_profile. Defaults to None, the default profile.
+            holes (dictionary, optional): Filled with the (x, y, w, h) bounding rectangles of the empty holes by color, see HoleTracker. Defaults to None.
+            counts (dictionary, optional): Filled with the (found, valid) contours by color, before and after filter_contours. Defaults to None.
+
+        Returns:
+            dictionary: structure with the base64 image and the number of empty holes by color.
+        """
+        profile = self.get_profile(profile)
+        colors = list(profile.colors) if colors is None else list(colors)
+        response = { "base64image" : "", "empty_holes" : dict.fromkeys(colors, 0) }
+        lap = self.get_lap(timings)
+        self.logger.info(":identify_colors_contours id:{0} colors: {1} profile: {2}", id, colors, profile.name)
+
+        if not colors or len(colors) > 8 or any(color not in profile.colors for color in colors):
+            self.logger.error(":identify_colors_contours id: {0} colors: {1} error: Invalid colors!", id, colors)
+            return ""
+
+        if ext is None:
+            ext = image.split(".")[-1] if isinstance(image, str) else "jpg"
+        image = self.load_image(image) # Read or decode image
+        lap("decode")
+        height, width, _ = image.shape # Obtain height and widht sizes
+        self.logger.info(":identify_colors_contours id: {0} height: {1} width: {2}", id, height, width)
+
+        # Label every pixel of the region of interest with a bit per color
+        roi = profile.get_roi(height, width)
+        roi_image = image[:, :roi["width"]]
+        shape = roi_image.shape[:2]
+        lut = cv2.LUT(roi_image, profile.get_colors_lut(tuple(colors)), dst=self.buffers.get("lut", roi_image.shape))
+        labels = cv2.extractChannel(lut, 0, dst=self.buffers.get("labels", shape))
+        channel = self.buffers.get("channel", shape)
+        for coi in (1, 2):
+            cv2.bitwise_and(labels, cv2.extractChannel(lut, coi, dst=channel), dst=labels)
+        lap("threshold")
+
+        masks = {}
+        found = False
+        draw = save or image_mode in (IMAGE_FULL, IMAGE_THUMBNAIL) # Annotate only if the image is used
+        for bit, color in enumerate(colors):
+            color_scale = scale if color in PYRAMID_COLORS else 1
+            padded = self.get_mask(*shape, color_scale)
+            mask = cv2.bitwise_and(labels, 1 << bit, dst=padded[:shape[0], :shape[1]]) # Non zero where the pixel is within the color range
+            if color_scale > 1:
+                cv2.compare(mask, 0, cv2.CMP_GT, dst=mask) # 255 where the pixel is within the color range, see find_contours
+            contours = self.find_contours(padded, shape, roi["min_area"], color_scale)
+            lap("contours")
+            if counts is not None:
+                counts[color] = (len(contours), 0)
+            if len(contours) > 0:
+                found = True
+                boxes, areas, valid = self.filter_contours(contours, roi)
+                lap("filter")
+                response["empty_holes"][color] = self.draw_contours(id, image if draw else None, boxes, areas, valid)
+                if holes is not None:
+                    holes[color] = boxes[valid].tolist()
+                if counts is not None:
+                    counts[color] = (len(contours), response["empty_holes"][color])
+                lap("draw")
+                if save:
+                    masks["mask_" + color] = cv2.threshold(mask, 0, 255, cv2.THRESH_BINARY)[1] # A new array, the writer may keep it
+
+        if found:
+            self.output_images(id, response, image, masks, ext, image_mode, thumbnail_width, quality, save, lap)
+        else:
+            self.logger.info(":identify_colors_contours id: {0} colors: {1} info: empty contours", id, colors)
 
-        self.logger.info(":identify_color_contours image_path: {0} color: {1} len(contours): {2} info: empty contours".format(image_path, color, len(contours)), get_lineno())
         return response
 
 
-    def print_triangle_lines(self, image):
-        """Print triangle lines in the canvas.
+    def draw_contours(self, id, image, boxes, areas, valid):
+        """Count, and draw within a rectangle, the valid contours.
+
+        Args:
+            id (string): Request id.
+            image (numpy.ndarray): cv2 image to annotate, None to only count.
+            boxes (numpy.ndarray): (N, 4) bounding rectangles.
+            areas (numpy.ndarray): (N,) contour areas.
+            valid (numpy.ndarray): (N,) contour validity.
+
+        Returns:
+            int: number of valid contours (empty holes).
+        """
+        empty_holes = 0
+        for (x, y, w, h), contour_area in zip(boxes[valid].tolist(), areas[valid].tolist()):
+            if image is not None:
+                cv2.rectangle(image, (x, y), (x+w, y+h), (0, 0, 255), 2)
+            empty_holes += 1
+            self.logger.debug(":draw_contours id: {0} contour_area: {1} empty_holes: {2} values: {3}", id, contour_area, empty_holes, (x, y, w, h))
+
+        return empty_holes
+
+
+    def output_images(self, id, response, image, masks, ext, image_mode, thumbnail_width, quality, save, lap):
+        """Save the annotated image and the masks, then add the requested image to the response.
+
+        Args:
+            id (string): Request id.
+            response (dictionary): detection response to complete.
+            image (numpy.ndarray): annotated cv2 image.
+            masks (dictionary): mask name to cv2 mask image.
+            ext (string): Extension used to save and encode the output images.
+            image_mode (string): Response image mode, one of IMAGE_MODES.
+            thumbnail_width (int): IMAGE_THUMBNAIL maximum width.
+            quality (int): IMAGE_THUMBNAIL JPEG quality.
+            save (boolean): Save the annotated image and the masks into the localstore.
+            lap (function): stage timing function, see get_lap.
+        """
+        images = dict(masks, frame=image)
+        if save and self.writer is not None:
+            # Save image with rectangle areas and image masks in background
+            self.writer.submit(id, images, ext)
+            self.logger.info(":output_images id: {0} ext: {1} info: Image and masks queued!", id, ext)
+        elif save:
+            # Make request directory
+            path = get_path(id, self.store_path)
+            for name, output in images.items():
+                save_path = path + name + "." + ext
+                cv2.imwrite(save_path, output) # Save image with rectangle areas or image mask
+                self.logger.info(":output_images id: {0} save_path: {1} info: Image saved OK!", id, save_path)
+
+        lap("save")
+
+        # Encode image to base64 or link the stored image
+        if image_mode == IMAGE_FULL:
+            response["base64image"] = encode_image(image, ext)
+        elif image_mode == IMAGE_THUMBNAIL:
+            response["base64image"] = encode_image(image, ext, thumbnail_width, quality)
+        elif image_mode == IMAGE_URL and save:
+            response["image_url"] = "/frames/{0}".format(id)
+        lap("encode")
+
+
+    @staticmethod
+    def get_lap(timings):
+        """Obtain a stage timing function.
+        Each lap(stage) call adds to timings the seconds elapsed since the previous lap (or since get_lap),
+        the stages repeated per color add up. The pipeline stages are decode, threshold, contours, filter,
+        draw, save and encode.
+
+        Args:
+            timings (dictionary): stage durations to fill, None to not measure anything.
+
+        Returns:
+            function: lap(stage) function, a no-op if timings is None.
+        """
+        if timings is None:
+            return lambda stage: None
+
+        last = [time.perf_counter()]
+        def lap(stage):
+            now = time.perf_counter()
+            timings[stage] = timings.get(stage, 0.0) + now - last[0]
+            last[0] = now
+
+        return lap
+
+
+    def print_triangle_lines(self, image, profile=None):
+        """Print the calibration profile region lines in the canvas.
 
         Args:
             image (object): cv2 image object.
+            profile (string|CalibrationProfile, optional): Calibration profile name or object, see get_profile. Defaults to None, the default profile.
 
         Returns:
             object: Modified image canvas object with lines addition.
         """
-        A = (0, 0)
-        B = tuple(map(int, (0, self.HEIGHT*self.B_COEFF)))
-        C = tuple(map(int, (self.WIDTH*self.C_COEFF, 0)))
-        D = tuple(map(int, (self.WIDTH*self.D_COEFF_W, self.HEIGHT*self.D_COEFF_H)))
-        E = tuple(map(int, (self.WIDTH*self.C_COEFF, self.HEIGHT)))
-        F = tuple(map(int, (self.WIDTH*self.F_COEFF, self.HEIGHT)))
-
-        cv2.line(image, A, B, (0, 0, 255), 3) # Segment AB
-        cv2.line(image, B, C, (0, 0, 255), 3) # Segment BC
-        cv2.line(image, C, A, (0, 0, 255), 3) # Segment CA
-        cv2.line(image, D, E, (0, 0, 255), 3) # Segment DE
-        cv2.line(image, E, F, (0, 0, 255), 3) # Segment EF
-        cv2.line(image, F, D, (0, 0, 255), 3) # Segment FD
-        cv2.line(image, C, D, (0, 255, 0), 3) # Segment CD
+        height = image.shape[0]
+        points = self.get_profile(profile).get_region_points(*image.shape[:2])
+
+        cv2.polylines(image, [polygon.astype(np.int32) for polygon in points["exclude"]], True, (0, 0, 255), 3) # Excluded polygons
+        cv2.line(image, (points["C"], 0), (points["C"], height), (0, 255, 0), 3) # Valid area right limit
 
         return image
 
 
-    def is_valid_contour(self, contour_area, x, y, w, h):
-        """Check if contour is valid.
+    def get_mask(self, height, width, scale=1):
+        """Obtain a pooled mask array padded to a multiple of scale, see find_contours.
+        The padding is cleared, the mask itself is left to be overwritten.
+
+        Args:
+            height (int): mask height.
+            width (int): mask width.
+            scale (int, optional): downscale factor. Defaults to 1, no padding.
+
+        Returns:
+            numpy.ndarray: padded mask array, the mask is its [:height, :width] view.
+        """
+        padded = self.buffers.get("mask", (-(-height // scale) * scale, -(-width // scale) * scale))
+        padded[height:] = 0
+        padded[:, width:] = 0
+        return padded
+
+
+    def find_contours(self, padded, shape, min_area, scale=1):
+        """Find all the contours of a mask, in fast mode only where a valid hole may be.
+        In fast mode the mask is downscaled keeping every cell with a masked pixel, so every connected region of the
+        mask lies within a single connected region of the downscaled mask. The regions whose bounding rectangle is
+        smaller than the minimum area at full resolution can't hold a valid contour and are cleared, and the contours
+        are found on what remains of the full resolution mask. They are the same valid contours as without fast mode,
+        only the tracing and filtering of the small regions is skipped.
+
+        Args:
+            padded (numpy.ndarray): 0 or 255 mask padded to a multiple of scale, see get_mask. It is left untouched.
+            shape (tuple): (height, width) of the mask within padded.
+            min_area (float): minimum valid contour area.
+            scale (int, optional): downscale factor. Defaults to 1, all the contours.
+
+        Returns:
+            list: cv2 contours of the mask.
+        """
+        height, width = shape
+        if scale <= 1:
+            return cv2.findContours(padded[:height, :width], cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+        size = (padded.shape[1] // scale, padded.shape[0] // scale)
+        pooled = cv2.resize(padded, size, dst=self.buffers.get("pooled", size[::-1]), interpolation=cv2.INTER_AREA) # Non zero if any cell pixel is
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(pooled, connectivity=8)
+        keep = np.zeros(count, dtype=np.uint8)
+        keep[1:][stats[1:, cv2.CC_STAT_WIDTH] * stats[1:, cv2.CC_STAT_HEIGHT] * (scale * scale) >= min_area] = 255
+        if not keep.any():
+            return []
+
+        selected = cv2.resize(keep[labels], padded.shape[::-1], dst=self.buffers.get("selected", padded.shape), interpolation=cv2.INTER_NEAREST)
+        cv2.bitwise_and(padded, selected, dst=selected)
+        return cv2.findContours(selected[:height, :width], cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+
+    def filter_contours(self, contours, roi):
+        """Check all the contours validity in a single pass.
+
+        Args:
+            contours (list): cv2 contours found within the frame region of interest.
+            roi (dictionary): region of interest from CalibrationProfile.get_roi.
+
+        Returns:
+            tuple: (N, 4) bounding rectangles array, (N,) contour areas array and (N,) boolean validity array.
+        """
+        boxes = np.array([cv2.boundingRect(contour) for contour in contours], dtype=np.int64).reshape(-1, 4)
+        areas = np.array([cv2.contourArea(contour) for contour in contours], dtype=np.float64)
+        valid = self.is_valid_corner(roi, boxes[:, 0] + boxes[:, 2], boxes[:, 1] + boxes[:, 3])
+        return boxes, areas, valid & (areas >= roi["min_area"])
+
+
+    @staticmethod
+    def is_valid_corner(roi, px, py):
+        """Look up the validity of bounding rectangle bottom-right corners.
+
+        Args:
+            roi (dictionary): region of interest from CalibrationProfile.get_roi.
+            px (numpy.ndarray): P.x integer coordinates, clipped to the region of interest.
+            py (numpy.ndarray): P.y integer coordinates, clipped to the region of interest.
+
+        Returns:
+            numpy.ndarray: boolean array, True if the corner is within the valid area.
+        """
+        valid = roi["valid"]
+        return valid[np.clip(py, 0, valid.shape[0] - 1), np.clip(px, 0, valid.shape[1] - 1)]
+
+
+    def is_valid_contour(self, contour_area, x, y, w, h, height, width):
+        """Check if contour is valid within the default profile region.
 
         Args:
             contour_area (float): effective colored area.
@@ -139,20 +458,12 @@ class ColorDetector():
             y (int): top-left rectangle y coordinate.
             w (int): rectangle width.
             h (int): rectangle height.
+            height (int): frame height.
+            width (int): frame width.
 
         Returns:
             boolean: True if point is within the valid area, False otherwise.
         """
-        # Compute the ponderate point coordinates
-        A = (0, 0)
-        B = tuple(map(int, (0, self.HEIGHT*self.B_COEFF)))
-        C = tuple(map(int, (self.WIDTH*self.C_COEFF, 0)))
-        D = tuple(map(int, (self.WIDTH*self.D_COEFF_W, self.HEIGHT*self.D_COEFF_H)))
-        E = tuple(map(int, (self.WIDTH*self.C_COEFF, self.HEIGHT)))
-        F = tuple(map(int, (self.WIDTH*self.F_COEFF, self.HEIGHT)))
-        P = (x+w, y+h)
-        #self.logger.info(":is_valid_contour contour_area: {0} A: {1} B: {2} C: {3} D: {4} E: {5} F: {6} P: {7}".format(contour_area, A, B, C, D, E, F, P), get_lineno())
-
         """
             We only are interested in x parts so, we exclude the following vectorial points:
                 * Points within ABC triangle
@@ -171,58 +482,7 @@ class ColorDetector():
             |xxxxxxxF___________E______________________|
         """
 
-        return not self.is_inside(A[0], A[1], B[0], B[1], C[0], C[1], P[0], P[1]) and not self.is_inside(D[0], D[1], E[0], E[1], F[0], F[1], P[0], P[1]) and x+w <= C[0] and contour_area >= 300
-
-
-    # A utility function to calculate area of triangle formed by (x1, y1), (x2, y2) and (x3, y3)
-    def area(self, x1, y1, x2, y2, x3, y3):
-        """Calculates the are of a triangle using their vectorials coordinates.
-
-        Args:
-            x1 (int): vertex A.x triangle coordinate.
-            y1 (int): vertex A.y triangle coordinate.
-            x2 (int): vertex B.x triangle coordinate.
-            y2 (int): vertex B.y triangle coordinate.
-            x3 (int): vertex C.x triangle coordinate.
-            y3 (int): vertex C.y triangle coordinate.
-
-        Returns:
-            float: triangle area value.
-        """
-        return abs((x1 * (y2 - y3) + x2 * (y3 - y1) + x3 * (y1 - y2)) / 2.0)
-
-
-    # A function to check whether point P(x, y) lies inside the triangle formed by A(x1, y1), B(x2, y2) and C(x3, y3)
-    def is_inside(self, x1, y1, x2, y2, x3, y3, x, y):
-        """Check if a P(x, y) coordinate is inside ABC triangle.
-
-        Args:
-            x1 (int): vertex A.x triangle coordinate.
-            y1 (int): vertex A.y triangle coordinate.
-            x2 (int): vertex B.x triangle coordinate.
-            y2 (int): vertex B.y triangle coordinate.
-            x3 (int): vertex C.x triangle coordinate.
-            y3 (int): vertex C.y triangle coordinate.
-            x (int): vertex P.x triangle coordinate.
-            y (int): vertex P.y triangle coordinate.
-
-        Returns:
-            boolean: True if the coordinate P(x, y) is inside the ABC triangle, False otherwise.
-        """
-        # Calculate area of triangle ABC
-        A = self.area(x1, y1, x2, y2, x3, y3)
-
-        # Calculate area of triangle PBC
-        A1 = self.area(x, y, x2, y2, x3, y3)
-
-        # Calculate area of triangle PAC
-        A2 = self.area(x1, y1, x, y, x3, y3)
-
-        # Calculate area of triangle PAB
-        A3 = self.area(x1, y1, x2, y2, x, y)
-
-        # Check if sum of A1, A2 and A3 is same as A
-        return True if A == A1 + A2 + A3 else False
+        return bool(self.profile.is_valid_box(height, width, np.array([contour_area]), np.array([[x, y, w, h]], dtype=np.int64))[0])
 
 
 
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__      = "Roger Truchero Visa"
+__copyright__   = "Copyright 2020"
+__credits__     = []
+__license__     = "GPL"
+__version__     = "1.0.0"
+__maintainer__  = "Roger Truchero Visa"
+__email__       = "truchero.roger@gmail.com"
+__status__      = "Development"
+
+
+from module import LOG_PATH, TRACK_WINDOW, TRACK_MIN_FRAMES, TRACK_MIN_SECONDS, TRACK_IOU, TRACK_MAX_HOLES, TRACK_MAX_CAMERAS, TRACK_IDLE_SECONDS
+from Logger import Logger
+
+from collections import OrderedDict
+import numpy as np
+import threading
+import time
+
+
+class CameraTracks():
+    """Holes tracked across the consecutive frames of a camera color.
+    Every track is a slot of fixed size arrays: its last bounding rectangle, a ring buffer with the
+    frames of the window where it was seen and its first and last seen times. Frame holes are matched
+    with the tracks by intersection over union.
+    A track is confirmed (an empty hole) once it is seen in min_frames frames of the window, or across
+    min_seconds in at least two frames, and it is cleared (restocked) once it is missed in min_frames
+    consecutive frames, or for min_seconds in at least two frames, so a single occluded or reflective
+    frame never changes the result.
+    """
+
+    def __init__(self, window, min_frames, min_seconds, iou, max_holes):
+        """Initialize object.
+
+        Args:
+            window (int): frames remembered by the seen ring buffer.
+            min_frames (int): frames to confirm or clear a hole.
+            min_seconds (float): seconds to confirm or clear a hole.
+            iou (float): minimum intersection over union to match a hole with a track.
+            max_holes (int): maximum tracked holes, new holes are ignored when all the slots are used.
+        """
+        self.min_frames = min_frames
+        self.min_seconds = min_seconds
+        self.iou = iou
+        self.head = 0 # Current frame column of the seen ring buffer
+        self.updated = 0.0 # Last update time
+
+        self.used = np.zeros(max_holes, dtype=bool)
+        self.confirmed = np.zeros(max_holes, dtype=bool)
+        self.boxes = np.zeros((max_holes, 4), dtype=np.int64)
+        self.seen = np.zeros((max_holes, window), dtype=bool)
+        self.misses = np.zeros(max_holes, dtype=np.int32) # Consecutive missed frames
+        self.first = np.zeros(max_holes, dtype=np.float64)
+        self.last = np.zeros(max_holes, dtype=np.float64)
+
+
+    def update(self, boxes, now):
+        """Match the holes of a new frame with the tracks and update their state.
+
+        Args:
+            boxes (list): (x, y, w, h) bounding rectangles of the frame holes.
+            now (float): frame timestamp in seconds.
+
+        Returns:
+            dictionary: confirmed "empty_holes", "pending" tracks that may still change, and the "appeared" and "cleared" holes of this frame.
+        """
+        boxes = np.array(boxes, dtype=np.int64).reshape(-1, 4)
+        tracks = np.flatnonzero(self.used)
+        matches = self.match(boxes, self.boxes[tracks]) # (box, track) index pairs
+
+        # Advance the ring buffer and record the matched tracks
+        self.head = (self.head + 1) % self.seen.shape[1]
+        self.seen[:, self.head] = False
+        matched = tracks[[track for _, track in matches]]
+        self.seen[matched, self.head] = True
+        self.boxes[matched] = boxes[[box for box, _ in matches]]
+        self.last[matched] = now
+        self.misses[self.used] += 1
+        self.misses[matched] = 0
+
+        # Start a track for every new hole while there are free slots
+        new = np.ones(len(boxes), dtype=bool)
+        new[[box for box, _ in matches]] = False
+        new = np.flatnonzero(new)
+        slots = np.flatnonzero(~self.used)[:len(new)]
+        new = new[:len(slots)]
+        self.used[slots] = True
+        self.confirmed[slots] = False
+        self.boxes[slots] = boxes[new]
+        self.seen[slots] = False
+        self.seen[slots, self.head] = True
+        self.misses[slots] = 0
+        self.first[slots] = now
+        self.last[slots] = now
+
+        # Confirm the persistent holes and clear the persistently missed ones
+        hits = self.seen.sum(axis=1)
+        appeared = self.used & ~self.confirmed & ((hits >= self.min_frames) | ((hits >= 2) & (self.last - self.first >= self.min_seconds)))
+        gone = self.used & ((self.misses >= self.min_frames) | ((self.misses >= 2) & (now - self.last >= self.min_seconds)))
+        cleared = gone & self.confirmed
+        self.confirmed |= appeared
+        self.used &= ~(gone | (hits == 0))
+        self.confirmed &= self.used
+        self.updated = now
+
+        return {
+            "empty_holes" : int(self.confirmed.sum()),
+            "pending" : int((self.used & (~self.confirmed | (self.misses > 0))).sum()),
+            "appeared" : int(appeared.sum()),
+            "cleared" : int(cleared.sum()),
+        }
+
+
+    def match(self, boxes, tracks):
+        """Greedily match the frame holes with the tracks by decreasing intersection over union.
+
+        Args:
+            boxes (numpy.ndarray): (M, 4) frame holes bounding rectangles.
+            tracks (numpy.ndarray): (T, 4) tracks bounding rectangles.
+
+        Returns:
+            list: (box index, track index) pairs with an intersection over union of at least iou.
+        """
+        if len(boxes) == 0 or len(tracks) == 0:
+            return []
+
+        # (M, T) intersection over union of every frame hole and track
+        b, t = boxes[:, None, :], tracks[None, :, :]
+        overlap_w = np.clip(np.minimum(b[..., 0] + b[..., 2], t[..., 0] + t[..., 2]) - np.maximum(b[..., 0], t[..., 0]), 0, None)
+        overlap_h = np.clip(np.minimum(b[..., 1] + b[..., 3], t[..., 1] + t[..., 3]) - np.maximum(b[..., 1], t[..., 1]), 0, None)
+        overlap = overlap_w * overlap_h
+        iou = overlap / np.maximum(b[..., 2] * b[..., 3] + t[..., 2] * t[..., 3] - overlap, 1)
+
+        matches = []
+        used_boxes, used_tracks = set(), set()
+        for flat in np.argsort(iou, axis=None)[::-1].tolist():
+            box, track = divmod(flat, len(tracks))
+            if iou[box, track] < self.iou:
+                break
+            if box not in used_boxes and track not in used_tracks:
+                matches.append((box, track))
+                used_boxes.add(box)
+                used_tracks.add(track)
+
+        return matches
+
+
+
+class HoleTracker():
+    """Temporal smoothing of the detected empty holes per camera.
+    Keeps the CameraTracks of every camera color, in least recently updated order: cameras idle for
+    idle_seconds, and the least recently updated ones beyond max_cameras, are evicted, so memory stays
+    bounded, and the on_evict callback forgets them elsewhere too (see AlertDispatcher.forget). Updates
+    are serialized by a lock, they only touch a few small arrays.
+    """
+
+    def __init__(self, window=TRACK_WINDOW, min_frames=TRACK_MIN_FRAMES, min_seconds=TRACK_MIN_SECONDS, iou=TRACK_IOU, max_holes=TRACK_MAX_HOLES, max_cameras=TRACK_MAX_CAMERAS, idle_seconds=TRACK_IDLE_SECONDS, on_evict=None):
+        """Initialize object.
+
+        Args:
+            window (int, optional): frames remembered per hole. Defaults to TRACK_WINDOW.
+            min_frames (int, optional): frames to confirm or clear a hole. Defaults to TRACK_MIN_FRAMES.
+            min_seconds (float, optional): seconds to confirm or clear a hole. Defaults to TRACK_MIN_SECONDS.
+            iou (float, optional): minimum intersection over union to match a hole across frames. Defaults to TRACK_IOU.
+            max_holes (int, optional): maximum tracked holes per camera color. Defaults to TRACK_MAX_HOLES.
+            max_cameras (int, optional): maximum tracked camera colors. Defaults to TRACK_MAX_CAMERAS.
+            idle_seconds (float, optional): seconds without frames to evict a camera. Defaults to TRACK_IDLE_SECONDS.
+            on_evict (function, optional): called, with the lock held, with the list of evicted or reset (camera id, color) keys. Defaults to None.
+        """
+        self.logger = Logger(LOG_PATH, "HoleTracker.py")
+        self.window = max(window, min_frames)
+        self.min_frames = min_frames
+        self.min_seconds = min_seconds
+        self.iou = iou
+        self.max_holes = max_holes
+        self.max_cameras = max_cameras
+        self.idle_seconds = idle_seconds
+        self.on_evict = on_evict
+        self.cameras = OrderedDict() # (camera id, color) to CameraTracks, least recently updated first
+        self.lock = threading.Lock()
+
+
+    def update(self, camera_id, holes, now=None):
+        """Update the tracks of a camera with the holes of a new frame.
+
+        Args:
+            camera_id (string): camera id.
+            holes (dictionary): color to list of (x, y, w, h) frame holes bounding rectangles.
+            now (float, optional): frame timestamp in seconds. Defaults to None, the current time.
+
+        Returns:
+            dictionary: color to CameraTracks.update result.
+        """
+        now = time.time() if now is None else now
+        results = {}
+        with self.lock:
+            for color, boxes in holes.items():
+                key = (camera_id, color)
+                tracks = self.cameras.pop(key, None)
+                if tracks is None:
+                    tracks = CameraTracks(self.window, self.min_frames, self.min_seconds, self.iou, self.max_holes)
+                self.cameras[key] = tracks
+                results[color] = tracks.update(boxes, now)
+            evicted = self.evict(now)
+
+        if evicted:
+            self.logger.info(":update camera_id: {0} evicted: {1} cameras: {2} info: idle cameras evicted", camera_id, len(evicted), len(self.cameras))
+        self.logger.debug(":update camera_id: {0} results: {1}", camera_id, results)
+
+        return results
+
+
+    def evict(self, now):
+        """Evict the idle cameras and the least recently updated ones beyond max_cameras, the lock must be held.
+
+        Args:
+            now (float): current timestamp in seconds.
+
+        Returns:
+            list: evicted (camera id, color) keys.
+        """
+        evicted = []
+        while self.cameras:
+            tracks = next(iter(self.cameras.values()))
+            if len(self.cameras) <= self.max_cameras and now - tracks.updated < self.idle_seconds:
+                break
+            evicted.append(self.cameras.popitem(last=False)[0])
+
+        if evicted and self.on_evict is not None:
+            self.on_evict(evicted)
+        return evicted
+
+
+    def reset(self, camera_id):
+        """Forget the tracks of a camera.
+
+        Args:
+            camera_id (string): camera id.
+        """
+        with self.lock:
+            keys = [key for key in self.cameras if key[0] == camera_id]
+            for key in keys:
+                del self.cameras[key]
+            if keys and self.on_evict is not None:
+                self.on_evict(keys)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__      = "Roger Truchero Visa"
+__copyright__   = "Copyright 2020"
+__credits__     = []
+__license__     = "GPL"
+__version__     = "1.0.0"
+__maintainer__  = "Roger Truchero Visa"
+__email__       = "truchero.roger@gmail.com"
+__status__      = "Development"
+
+
+from module import LOG_PATH, JOB_WORKERS, JOB_QUEUE_SIZE, JOB_RESULT_TTL, JOB_MAX_RESULTS, JOB_MAX_RESULT_BYTES, JOB_POLL_INTERVAL, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+from Logger import Logger
+
+from collections import OrderedDict, deque
+import atexit
+import queue
+import threading
+import time
+
+
+class JobQueue():
+    """Run detection jobs on a bounded worker pool.
+    Jobs are rejected right away when JOB_QUEUE_SIZE jobs are already waiting, instead of making every
+    request wait longer. Finished jobs are kept JOB_RESULT_TTL seconds, up to JOB_MAX_RESULTS jobs and
+    JOB_MAX_RESULT_BYTES of results, so their result can be fetched (or long-polled) by id.
+    With an ArtifactStore every job state change is also saved into its index, so the processes sharing it
+    (e.g. several Gunicorn workers) can fetch the jobs accepted by any of them, polling the index every
+    JOB_POLL_INTERVAL seconds to long-poll them.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, maxsize=JOB_QUEUE_SIZE, ttl=JOB_RESULT_TTL, max_results=JOB_MAX_RESULTS, max_bytes=JOB_MAX_RESULT_BYTES, store=None, poll=JOB_POLL_INTERVAL):
+        """Initialize object and start the worker threads.
+
+        Args:
+            workers (int, optional): worker threads. Defaults to JOB_WORKERS.
+            maxsize (int, optional): maximum queued jobs. Defaults to JOB_QUEUE_SIZE.
+            ttl (float, optional): seconds a finished job is kept. Defaults to JOB_RESULT_TTL.
+            max_results (int, optional): maximum kept finished jobs. Defaults to JOB_MAX_RESULTS.
+            max_bytes (int, optional): maximum kept finished jobs results size, see get_size. Defaults to JOB_MAX_RESULT_BYTES.
+            store (ArtifactStore, optional): index shared by the processes. Defaults to None, the jobs are only kept by this process.
+            poll (float, optional): seconds between the index reads of a long-polled job of another process. Defaults to JOB_POLL_INTERVAL.
+        """
+        self.logger = Logger(LOG_PATH, "JobQueue.py")
+        self.store = store
+        self.poll = poll
+        self.queue = queue.Queue(maxsize)
+        self.ttl = ttl
+        self.max_results = max_results
+        self.max_bytes = max_bytes
+        self.jobs = OrderedDict() # Job id to job, in submission order
+        self.finished = deque() # (finished time, job id, result size) of the kept finished jobs, oldest first
+        self.bytes = 0 # Kept finished jobs results size
+        self.lock = threading.Lock()
+        self.metrics = { "submitted" : 0, "rejected" : 0, "done" : 0, "failed" : 0, "expired" : 0 }
+        self.threads = [threading.Thread(target=self.run, name="JobQueue-{0}".format(i), daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+        atexit.register(self.stop) # Finish the running jobs before the interpreter exits
+        self.logger.info(":__init__ workers: {0} maxsize: {1} ttl: {2} info: job queue started", workers, maxsize, ttl)
+
+
+    def submit(self, id, function, *args):
+        """Queue a job, function(*args) result is the job result.
+
+        Args:
+            id (string): job id, unique.
+            function (function): job function.
+            *args: job function arguments.
+
+        Returns:
+            boolean: True if the job has been queued, False if the queue is full.
+        """
+        job = { "state" : JOB_QUEUED, "result" : None, "error" : None, "submitted" : time.time(), "finished" : None, "event" : threading.Event() }
+        with self.lock:
+            self.expire(job["submitted"])
+            self.jobs[id] = job
+        self.save(id, job) # Before a worker thread may update it
+
+        try:
+            self.queue.put_nowait((id, job, function, args))
+        except queue.Full:
+            with self.lock:
+                del self.jobs[id]
+                self.metrics["rejected"] += 1
+            if self.store is not None:
+                self.store.remove_job(id)
+            self.logger.warning(":submit id: {0} error: job queue full, job rejected!", id)
+            return False
+
+        with self.lock:
+            self.metrics["submitted"] += 1
+        return True
+
+
+    def run(self):
+        """Worker thread loop, a None item stops it.
+        """
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+
+                id, job, function, args = item
+                job["state"] = JOB_RUNNING
+                self.save(id, job)
+                try:
+                    job["result"] = function(*args)
+                    job["state"] = JOB_DONE
+                except Exception as e:
+                    job["error"] = str(e)
+                    job["state"] = JOB_FAILED
+                    self.logger.error(":run id: {0} e: {1} error: job failed!", id, e)
+
+                job["finished"] = time.time()
+                with self.lock:
+                    self.metrics[job["state"]] += 1
+                    size = self.get_size(job["result"])
+                    self.finished.append((job["finished"], id, size))
+                    self.bytes += size
+                    self.expire(job["finished"])
+                self.save(id, job, size)
+                if self.store is not None:
+                    self.store.expire_jobs(job["finished"], self.ttl, self.max_results, self.max_bytes)
+                job["event"].set()
+
+            finally:
+                self.queue.task_done()
+
+
+    def get(self, id, wait=0):
+        """Obtain a job, waiting up to wait seconds for it to finish.
+
+        Args:
+            id (string): job id.
+            wait (float, optional): maximum seconds to wait for the job to finish. Defaults to 0, don't wait.
+
+        Returns:
+            dictionary: job state, result, error, submitted and finished times, None if the job doesn't exist or has expired.
+        """
+        with self.lock:
+            job = self.jobs.get(id)
+        if job is None:
+            return self.get_shared(id, wait)
+
+        if wait > 0:
+            job["event"].wait(wait)
+
+        return { key : value for key, value in job.items() if key != "event" }
+
+
+    def get_shared(self, id, wait=0):
+        """Obtain a job accepted by another process from the index, polling it up to wait seconds for the job to finish.
+
+        Args:
+            id (string): job id.
+            wait (float, optional): maximum seconds to wait for the job to finish. Defaults to 0, don't wait.
+
+        Returns:
+            dictionary: job state, result, error, submitted and finished times, None if there is no index, or the job doesn't exist or has expired.
+        """
+        if self.store is None:
+            return None
+
+        deadline = time.monotonic() + wait
+        while True:
+            job = self.store.get_job(id)
+            if job is None or job["state"] in (JOB_DONE, JOB_FAILED) or time.monotonic() >= deadline:
+                return job
+            time.sleep(min(self.poll, max(deadline - time.monotonic(), 0)))
+
+
+    def save(self, id, job, size=0):
+        """Save a job state into the index, if any. A failure is logged, the job still runs.
+
+        Args:
+            id (string): job id.
+            job (dictionary): job, see submit.
+            size (int, optional): result size in bytes, see get_size. Defaults to 0.
+        """
+        if self.store is None:
+            return
+
+        try:
+            self.store.put_job(id, job, size)
+        except Exception as e:
+            self.logger.error(":save id: {0} e: {1} error: unable to save the job state!", id, e)
+
+
+    def expire(self, now):
+        """Forget the oldest finished jobs past their ttl, or beyond max_results or max_bytes, the lock must be held.
+        Queued and running jobs are never forgotten, they are bounded by the queue size and the workers.
+
+        Args:
+            now (float): current timestamp in seconds.
+        """
+        while self.finished:
+            finished, id, size = self.finished[0]
+            if now - finished < self.ttl and len(self.finished) <= self.max_results and self.bytes <= self.max_bytes:
+                break
+            self.finished.popleft()
+            self.bytes -= size
+            self.jobs.pop(id, None)
+            self.metrics["expired"] += 1
+
+
+    @staticmethod
+    def get_size(result):
+        """Estimate the kept size of a job result, its string and bytes values such as the base64 image.
+
+        Args:
+            result (object): job result, a dictionary response or any other value.
+
+        Returns:
+            int: estimated size in bytes.
+        """
+        if isinstance(result, (str, bytes)):
+            return len(result)
+        if isinstance(result, dict):
+            return sum(len(value) for value in result.values() if isinstance(value, (str, bytes)))
+
+        return 0
+
+
+    def stats(self):
+        """Obtain the job queue metrics.
+
+        Returns:
+            dictionary: submitted, rejected, done, failed and expired counters plus the current queue depth, kept jobs and kept results size.
+        """
+        with self.lock:
+            stats = dict(self.metrics)
+            stats["jobs"] = len(self.jobs)
+            stats["bytes"] = self.bytes
+        stats["depth"] = self.queue.qsize()
+
+        return stats
+
+
+    def join(self):
+        """Block until all the queued jobs have finished.
+        """
+        self.queue.join()
+
+
+    def stop(self):
+        """Finish the queued jobs and stop the worker threads.
+        """
+        alive = [thread for thread in self.threads if thread.is_alive()]
+        for _ in alive:
+            self.queue.put(None)
+        for thread in alive:
+            thread.join()
@@ -11,11 +11,94 @@ __email__       = "rtruchero@lleida.net"
 __status__      = "Development"
 
 
+from module import LOG_LEVEL, LOG_QUEUED, LOG_MAX_LENGTH
+
+from logging.handlers import QueueHandler, QueueListener
+import atexit
 import logging
-import time
+import queue
+import threading
 import uuid
 
 
+# Log record format, the caller line comes from the logging record instead of inspecting frames in every call
+LOG_FORMAT = '%(asctime)s,%(msecs)d %(levelname)s %(prefix)s:%(lineno)d time:%(created)d %(message)s'
+
+# Queue listeners by log path, shared by all the Logger objects writing to the same file
+listeners = {}
+listeners_lock = threading.Lock()
+
+
+class LogMessage():
+    """Lazy log message.
+    The message is only formatted with str.format when a handler emits the record, so disabled levels
+    never pay for it and queued records are formatted in the listener thread. Arguments longer than
+    max_length characters are truncated to avoid dumping large payloads (e.g. base64 images).
+    Arguments must not be modified after being logged.
+    """
+
+    __slots__ = ("msg", "args", "max_length")
+
+    def __init__(self, msg, args, max_length):
+        """Initialize LogMessage object.
+
+        Args:
+            msg (string): str.format message.
+            args (tuple): message arguments.
+            max_length (int): maximum argument length, 0 to never truncate.
+        """
+        self.msg = msg
+        self.args = args
+        self.max_length = max_length
+
+
+    def __str__(self):
+        """Format the message.
+
+        Returns:
+            string: formatted message.
+        """
+        if not self.args:
+            return self.msg
+
+        return self.msg.format(*[self.shorten(arg) for arg in self.args])
+
+
+    def shorten(self, arg):
+        """Truncate a long argument.
+
+        Args:
+            arg (object): message argument.
+
+        Returns:
+            object: the argument itself for numbers, its string representation truncated to max_length characters otherwise.
+        """
+        if isinstance(arg, (int, float)):
+            return arg
+
+        text = str(arg)
+        if self.max_length and len(text) > self.max_length:
+            return "{0}...({1} chars)".format(text[:self.max_length], len(text))
+
+        return text
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue handler that leaves the record formatting to the listener thread.
+    """
+
+    def prepare(self, record):
+        """Enqueue the record as is, the queue never leaves the process.
+
+        Args:
+            record (logging.LogRecord): log record.
+
+        Returns:
+            logging.LogRecord: the same record.
+        """
+        return record
+
+
 class Logger():
     """Generic class to do log.
     The defined levels, in order of increasignly severity, are the following:
@@ -24,76 +107,134 @@ class Logger():
         - warning: An indication that something unexpected happened, or indicative of some problem in the near future (e.g. ‘disk space low’). The software is still working as expected.
         - error: Due to a more serious problem, the software has not been able to perform some function.
         - critical: A serious error, indicating that the program itself may be unable to continue running.
+
+    Messages use str.format placeholders and are formatted lazily, e.g. logger.info(":detect id: {0}", id).
+    The level is checked before any argument work. In queued mode the file is written by a background
+    QueueListener thread, so the caller never waits on the disk.
     """
 
-    def __init__(self, logpath, name, level=logging.INFO):
+    def __init__(self, logpath, name, level=LOG_LEVEL, queued=LOG_QUEUED, max_length=LOG_MAX_LENGTH):
         """Initialize Logger object.
 
         Args:
             logpath (string): Log path file.
             name (string) : Class that instantiates the current Logger object.
-            level (object, optional): Sets the logging level. Defaults to logging.INFO.
+            level (object, optional): Sets the logging level. Defaults to LOG_LEVEL.
+            queued (boolean, optional): Write the log file from a background listener thread. Defaults to LOG_QUEUED.
+            max_length (int, optional): Maximum logged argument length, 0 to never truncate. Defaults to LOG_MAX_LENGTH.
         """
         # get logger for 'name'
         self.logger = logging.getLogger(name)
+        self.extra = { "prefix" : "{0} {1}".format(uuid.uuid4().hex, name) }
+        self.max_length = max_length
 
-        # define format
-        formatter = logging.Formatter('%(asctime)s,%(msecs)d %(levelname)s {0} {1}:%(message)s'.format(uuid.uuid4().hex, name))
+        # set the logging level and add the file handler, once per logger name
+        self.logger.setLevel(level)
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            self.logger.addHandler(DeferredQueueHandler(get_listener(logpath).queue) if queued else get_file_handler(logpath))
 
-        # define the file handler to the specified logpath
-        file_handler = logging.FileHandler(logpath)
-        file_handler.setFormatter(formatter)
 
-        # set the logging level and add the file handler
-        self.logger.setLevel(level)
-        self.logger.addHandler(file_handler)
+    def log(self, level, msg, args):
+        """Log a lazy message if the level is enabled.
 
+        Args:
+            level (int): logging level.
+            msg (string): str.format message.
+            args (tuple): message arguments.
+        """
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, LogMessage(msg, args, self.max_length), extra=self.extra, stacklevel=3)
 
-    def debug(self, msg, line):
+
+    def debug(self, msg, *args):
         """Debug function.
 
         Args:
             msg (string): message to log.
-            line (integer): log corresponding line of file.
+            args (object): message format arguments.
         """
-        self.logger.debug("{0} time:{1} {2}".format(line, int(time.time()), msg))
+        self.log(logging.DEBUG, msg, args)
 
 
-    def info(self, msg, line):
+    def info(self, msg, *args):
         """Info function.
 
         Args:
             msg (string): message to log.
-            line (integer): log corresponding line of file.
+            args (object): message format arguments.
         """
-        self.logger.info("{0} time:{1} {2}".format(line, int(time.time()), msg))
+        self.log(logging.INFO, msg, args)
 
 
-    def warning(self, msg, line):
+    def warning(self, msg, *args):
         """Warning function.
 
         Args:
             msg (string): message to log.
-            line (integer): log corresponding line of file.
+            args (object): message format arguments.
         """
-        self.logger.warning("{0} time:{1} {2}".format(line, int(time.time()), msg))
+        self.log(logging.WARNING, msg, args)
 
 
-    def error(self, msg, line):
+    def error(self, msg, *args):
         """Error function.
 
         Args:
             msg (string): message to log.
-            line (integer): log corresponding line of file.
+            args (object): message format arguments.
         """
-        self.logger.error("{0} time:{1} {2}".format(line, int(time.time()), msg))
+        self.log(logging.ERROR, msg, args)
 
 
-    def critical(self, msg, line):
+    def critical(self, msg, *args):
         """Critical function.
 
         Args:
             msg (string): message to log.
-            line (integer): log corresponding line of file.
+            args (object): message format arguments.
         """
-        self.logger.critical("{0} time:{1} {2}".format(line, int(time.time()), msg))
\ No newline at end of file
+        self.log(logging.CRITICAL, msg, args)
+
+
+def get_file_handler(logpath):
+    """Create a formatted file handler.
+
+    Args:
+        logpath (string): Log path file.
+
+    Returns:
+        logging.FileHandler: file handler.
+    """
+    file_handler = logging.FileHandler(logpath)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    return file_handler
+
+
+def get_listener(logpath):
+    """Obtain the started queue listener writing to a log file.
+
+    Args:
+        logpath (string): Log path file.
+
+    Returns:
+        logging.handlers.QueueListener: queue listener.
+    """
+    with listeners_lock:
+        if logpath not in listeners:
+            listener = QueueListener(queue.SimpleQueue(), get_file_handler(logpath))
+            listener.start()
+            listeners[logpath] = listener
+
+        return listeners[logpath]
+
+
+@atexit.register
+def stop_listeners():
+    """Flush the queued records and stop all the queue listeners.
+    """
+    with listeners_lock:
+        for listener in listeners.values():
+            listener.stop()
+        listeners.clear()
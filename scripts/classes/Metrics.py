@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__      = "Roger Truchero Visa"
+__copyright__   = "Copyright 2020"
+__credits__     = []
+__license__     = "GPL"
+__version__     = "1.0.0"
+__maintainer__  = "Roger Truchero Visa"
+__email__       = "truchero.roger@gmail.com"
+__status__      = "Development"
+
+
+from module import LOG_PATH, METRICS_PREFIX, METRICS_FLUSH_INTERVAL
+from Logger import Logger
+
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+
+
+class Metrics():
+    """Counters, histograms and collected values exported in the Prometheus text format.
+    Counters and histograms are updated by the request path, under a lock, with a few dictionary
+    operations. Collected values (queue depths, cache sizes, ...) are read from their owner only when
+    the metrics are rendered.
+    In multiprocess mode (e.g. several Gunicorn workers) every process also writes a snapshot of its metrics
+    into a shared directory, every interval seconds and when it renders them, and any process renders the
+    metrics of all of them: counters and histograms are added up and collected values are labelled with
+    the worker pid. The other processes metrics are at most interval seconds old.
+    """
+
+    def __init__(self, prefix=METRICS_PREFIX, directory=None, interval=METRICS_FLUSH_INTERVAL):
+        """Initialize object and, in multiprocess mode, start the snapshot thread.
+
+        Args:
+            prefix (string, optional): metric names prefix. Defaults to METRICS_PREFIX.
+            directory (string, optional): directory shared by the processes, see mark_process_dead. Defaults to None, single process.
+            interval (float, optional): seconds between the snapshots of this process. Defaults to METRICS_FLUSH_INTERVAL.
+        """
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.families = {} # Metric name to (type, help, buckets or collect function)
+        self.values = {} # Metric name to labels to counter value or histogram [bucket counts, sum, count]
+
+        # Multiprocess mode snapshot of this process
+        self.logger = Logger(LOG_PATH, "Metrics.py")
+        self.directory = directory
+        self.interval = interval
+        self.pid = os.getpid()
+        self.flush_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="Metrics", daemon=True)
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.thread.start()
+            atexit.register(self.stop) # The last counts survive the process
+
+
+    def counter(self, name, help):
+        """Declare a counter.
+
+        Args:
+            name (string): metric name, without the prefix.
+            help (string): metric description.
+        """
+        self.families[name] = ("counter", help, None)
+        self.values[name] = {}
+
+
+    def histogram(self, name, help, buckets):
+        """Declare a histogram.
+
+        Args:
+            name (string): metric name, without the prefix.
+            help (string): metric description.
+            buckets (tuple): sorted bucket upper bounds, +Inf is implicit.
+        """
+        self.families[name] = ("histogram", help, tuple(buckets))
+        self.values[name] = {}
+
+
+    def collect(self, name, type, help, function, label=None):
+        """Declare a metric read from its owner when rendering.
+
+        Args:
+            name (string): metric name, without the prefix.
+            type (string): "counter" or "gauge".
+            help (string): metric description.
+            function (function): returns the value, or a dictionary of label value to value if label is set.
+            label (string, optional): label name of the function dictionary keys. Defaults to None.
+        """
+        self.families[name] = (type, help, (function, label))
+
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter.
+
+        Args:
+            name (string): counter name.
+            value (float, optional): increment. Defaults to 1.
+            **labels: metric labels.
+        """
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.values[name]
+            values[key] = values.get(key, 0) + value
+
+
+    def observe(self, name, value, **labels):
+        """Record a histogram observation.
+
+        Args:
+            name (string): histogram name.
+            value (float): observed value.
+            **labels: metric labels.
+        """
+        key = tuple(sorted(labels.items()))
+        buckets = self.families[name][2]
+        with self.lock:
+            values = self.values[name]
+            histogram = values.get(key)
+            if histogram is None:
+                histogram = values[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+
+    def snapshot(self):
+        """Copy the counters and histograms and read the collected values of this process.
+
+        Returns:
+            tuple: (metric name to labels to value, metric name to (labels, value) samples list) dictionaries.
+        """
+        with self.lock:
+            values = { name : { key : [list(value[0]), value[1], value[2]] if isinstance(value, list) else value for key, value in series.items() } for name, series in self.values.items() }
+
+        collected = {}
+        for name, (type, help, extra) in list(self.families.items()):
+            if type == "histogram" or name in values:
+                continue
+            function, label = extra
+            value = function()
+            collected[name] = [((), value)] if label is None else [(((label, label_value),), sample) for label_value, sample in sorted(value.items())]
+
+        return values, collected
+
+
+    def render(self):
+        """Render all the metrics in the Prometheus text exposition format, of every process in multiprocess mode.
+
+        Returns:
+            string: metrics text.
+        """
+        values, collected = self.snapshot()
+        if self.directory is not None:
+            self.flush(values, collected)
+            values, collected = self.merge(values, collected)
+
+        lines = []
+        for name, (type, help, extra) in self.families.items():
+            metric = self.prefix + "_" + name
+            lines.append("# HELP {0} {1}".format(metric, help))
+            lines.append("# TYPE {0} {1}".format(metric, type))
+            if type == "histogram":
+                for key, (counts, total, count) in sorted(values[name].items()):
+                    cumulative = 0
+                    for bound, bucket in zip(extra + (float("inf"),), counts):
+                        cumulative += bucket
+                        lines.append(self.format_sample(metric + "_bucket", key + (("le", self.format_value(bound)),), cumulative))
+                    lines.append(self.format_sample(metric + "_sum", key, total))
+                    lines.append(self.format_sample(metric + "_count", key, count))
+            elif name in values:
+                for key, value in sorted(values[name].items()):
+                    lines.append(self.format_sample(metric, key, value))
+            else:
+                for key, value in collected.get(name, []):
+                    lines.append(self.format_sample(metric, key, value))
+
+        return "\n".join(lines) + "\n"
+
+
+    def flush(self, values=None, collected=None):
+        """Write the snapshot of this process into the shared directory, replacing the previous one at once.
+
+        Args:
+            values (dictionary, optional): counters and histograms, see snapshot. Defaults to None, taken now.
+            collected (dictionary, optional): collected values, see snapshot. Defaults to None, taken now.
+        """
+        if values is None:
+            values, collected = self.snapshot()
+
+        path = os.path.join(self.directory, "metrics_{0}.json".format(self.pid))
+        data = {
+            "values" : { name : [[list(key), value] for key, value in series.items()] for name, series in values.items() },
+            "collected" : { name : [[list(key), value] for key, value in samples] for name, samples in collected.items() },
+        }
+        with self.flush_lock:
+            with open(path + ".tmp", "w") as f:
+                json.dump(data, f)
+            os.replace(path + ".tmp", path)
+
+
+    def merge(self, values, collected):
+        """Add up the counters and histograms of every process snapshot and label their collected values with the worker pid.
+
+        Args:
+            values (dictionary): counters and histograms of this process, see snapshot. They are updated in place.
+            collected (dictionary): collected values of this process, see snapshot.
+
+        Returns:
+            tuple: merged (values, collected) dictionaries.
+        """
+        merged = { name : [(key + (("worker", str(self.pid)),), value) for key, value in samples] for name, samples in collected.items() }
+        for path in sorted(glob.glob(os.path.join(self.directory, "metrics_*.json"))):
+            pid = os.path.basename(path)[len("metrics_"):-len(".json")]
+            if pid == str(self.pid):
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue # Removed meanwhile
+
+            for name, series in data["values"].items():
+                if name not in values:
+                    continue
+                for key, value in series:
+                    key = tuple(tuple(pair) for pair in key)
+                    current = values[name].get(key)
+                    if isinstance(value, list):
+                        if current is None:
+                            values[name][key] = value
+                        else:
+                            current[0] = [mine + theirs for mine, theirs in zip(current[0], value[0])]
+                            current[1] += value[1]
+                            current[2] += value[2]
+                    else:
+                        values[name][key] = (current or 0) + value
+            for name, samples in data.get("collected", {}).items():
+                merged.setdefault(name, []).extend((tuple(tuple(pair) for pair in key) + (("worker", pid),), value) for key, value in samples)
+
+        return values, { name : sorted(samples) for name, samples in merged.items() }
+
+
+    @staticmethod
+    def mark_process_dead(directory, pid):
+        """Drop the collected values of a dead process from its snapshot, its counters and histograms keep adding up.
+        Called by the Gunicorn master when a worker exits, see gunicorn.conf.py.
+
+        Args:
+            directory (string): multiprocess mode shared directory.
+            pid (int): dead process id.
+        """
+        path = os.path.join(directory, "metrics_{0}.json".format(pid))
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        data["collected"] = {}
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+
+    def run(self):
+        """Snapshot thread loop, until stop.
+        """
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error(":run directory: {0} e: {1} error: unable to write the metrics snapshot!", self.directory, e)
+
+
+    def stop(self):
+        """Write the last snapshot and stop the snapshot thread.
+        """
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error(":stop directory: {0} e: {1} error: unable to write the metrics snapshot!", self.directory, e)
+
+
+    @classmethod
+    def format_sample(cls, metric, labels, value):
+        """Format a metric sample line.
+
+        Args:
+            metric (string): metric name.
+            labels (tuple): (name, value) label pairs.
+            value (float): sample value.
+
+        Returns:
+            string: sample line.
+        """
+        if not labels:
+            return "{0} {1}".format(metric, cls.format_value(value))
+
+        escaped = ",".join('{0}="{1}"'.format(name, str(label).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, label in labels)
+        return "{0}{{{1}}} {2}".format(metric, escaped, cls.format_value(value))
+
+
+    @staticmethod
+    def format_value(value):
+        """Format a sample value.
+
+        Args:
+            value (float): sample value.
+
+        Returns:
+            string: Prometheus value.
+        """
+        if value == float("inf"):
+            return "+Inf"
+
+        return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__      = "Roger Truchero Visa"
+__copyright__   = "Copyright 2020"
+__credits__     = []
+__license__     = "GPL"
+__version__     = "1.0.0"
+__maintainer__  = "Roger Truchero Visa"
+__email__       = "truchero.roger@gmail.com"
+__status__      = "Development"
+
+
+from module import LOG_PATH, RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_DHASH, RESULT_CACHE_DHASH_DISTANCE
+from Logger import Logger
+
+from collections import OrderedDict
+import cv2
+import hashlib
+import numpy as np
+import threading
+import time
+
+
+class ResultCache():
+    """LRU and TTL cache of detection results keyed by frame content.
+    Byte-identical frames are found by a blake2b hash of the encoded frame. Optionally, near-identical
+    frames (e.g. recompressed ones) are also found by a 64 bit difference hash (dHash) of a reduced
+    grayscale decoding, within RESULT_CACHE_DHASH_DISTANCE differing bits.
+    Results are only shared between requests with the same context (detection options and colors).
+    The cache is bounded by results and by their total size, the responses with a full image are large.
+    """
+
+    def __init__(self, maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL, dhash=RESULT_CACHE_DHASH, distance=RESULT_CACHE_DHASH_DISTANCE, max_bytes=RESULT_CACHE_MAX_BYTES):
+        """Initialize object.
+
+        Args:
+            maxsize (int, optional): maximum cached results, 0 disables the cache. Defaults to RESULT_CACHE_SIZE.
+            ttl (float, optional): seconds a result is kept. Defaults to RESULT_CACHE_TTL.
+            dhash (boolean, optional): also find near-identical frames by their difference hash. Defaults to RESULT_CACHE_DHASH.
+            distance (int, optional): maximum differing dHash bits of near-identical frames. Defaults to RESULT_CACHE_DHASH_DISTANCE.
+            max_bytes (int, optional): maximum cached results size. Defaults to RESULT_CACHE_MAX_BYTES.
+        """
+        self.logger = Logger(LOG_PATH, "ResultCache.py")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.dhash = dhash
+        self.distance = distance
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # (context, digest) to (expiration time, dhash, value, size), least recently used first
+        self.bytes = 0 # Cached results size
+        self.lock = threading.Lock()
+        self.metrics = { "hits" : 0, "near_hits" : 0, "misses" : 0, "expired" : 0, "evicted" : 0 }
+
+
+    def key(self, buffer, context):
+        """Obtain the cache key of a frame.
+
+        Args:
+            buffer (bytes-like): encoded frame.
+            context (tuple): hashable detection context, results are only shared within the same context.
+
+        Returns:
+            tuple: (context, content digest, dhash or None) cache key.
+        """
+        digest = hashlib.blake2b(buffer, digest_size=16).digest()
+        return context, digest, self.get_dhash(buffer) if self.dhash and self.maxsize > 0 else None
+
+
+    @staticmethod
+    def get_dhash(buffer):
+        """Compute the 64 bit difference hash of an encoded frame.
+        The frame is decoded at 1/8 of its size in grayscale, reduced to 9x8 pixels and every bit tells if a
+        pixel is brighter than its left neighbour.
+
+        Args:
+            buffer (bytes-like): encoded frame.
+
+        Returns:
+            int: difference hash, None if the frame can't be decoded.
+        """
+        gray = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if gray is None:
+            return None
+
+        small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+        return int.from_bytes(np.packbits(small[:, 1:] > small[:, :-1]).tobytes(), "big")
+
+
+    def get(self, key):
+        """Obtain the cached result of a frame.
+
+        Args:
+            key (tuple): frame cache key, see key.
+
+        Returns:
+            object: cached value, None if there is none.
+        """
+        if self.maxsize <= 0:
+            return None
+
+        context, digest, dhash = key
+        now = time.time()
+        with self.lock:
+            self.expire(now)
+            entry = self.entries.get((context, digest))
+            metric = "hits"
+            if entry is None and dhash is not None:
+                # Nearest near-identical frame of the same context
+                near = [(bin(dhash ^ other[1]).count("1"), cached) for cached, other in self.entries.items() if cached[0] == context and other[1] is not None]
+                distance, cached = min(near, default=(self.distance + 1, None), key=lambda item: item[0])
+                if distance <= self.distance:
+                    digest, entry, metric = cached[1], self.entries[cached], "near_hits"
+
+            if entry is None:
+                self.metrics["misses"] += 1
+                return None
+
+            self.entries.move_to_end((context, digest))
+            self.metrics[metric] += 1
+
+        return entry[2]
+
+
+    def put(self, key, value, size=0):
+        """Cache the result of a frame, evicting the least recently used results beyond maxsize or max_bytes.
+
+        Args:
+            key (tuple): frame cache key, see key.
+            value (object): result to cache, it must not be modified afterwards.
+            size (int, optional): result size in bytes, a result larger than max_bytes is not cached. Defaults to 0.
+        """
+        if self.maxsize <= 0 or size > self.max_bytes:
+            return
+
+        context, digest, dhash = key
+        now = time.time()
+        with self.lock:
+            self.remove((context, digest))
+            self.entries[(context, digest)] = (now + self.ttl, dhash, value, size)
+            self.bytes += size
+            while len(self.entries) > self.maxsize or self.bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.metrics["evicted"] += 1
+
+
+    def remove(self, cached):
+        """Remove a result if it is cached, the lock must be held.
+
+        Args:
+            cached (tuple): (context, digest) entry key.
+        """
+        entry = self.entries.pop(cached, None)
+        if entry is not None:
+            self.bytes -= entry[3]
+
+
+    def expire(self, now):
+        """Remove the expired results, the lock must be held.
+        Every result lives ttl seconds since it was put, so the least recently used results are not
+        always the first to expire: the whole cache is checked, it is small.
+
+        Args:
+            now (float): current timestamp in seconds.
+        """
+        expired = [cached for cached, entry in self.entries.items() if entry[0] <= now]
+        for cached in expired:
+            self.remove(cached)
+        self.metrics["expired"] += len(expired)
+
+
+    def stats(self):
+        """Obtain the cache metrics.
+
+        Returns:
+            dictionary: hits, near_hits, misses, expired and evicted counters plus the current size and bytes.
+        """
+        with self.lock:
+            stats = dict(self.metrics)
+            stats["size"] = len(self.entries)
+            stats["bytes"] = self.bytes
+
+        return stats
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__      = "Roger Truchero Visa"
+__copyright__   = "Copyright 2020"
+__credits__     = []
+__license__     = "GPL"
+__version__     = "1.0.0"
+__maintainer__  = "Roger Truchero Visa"
+__email__       = "truchero.roger@gmail.com"
+__status__      = "Development"
+
+
+from module import LOG_PATH, IMAGE_NONE, STREAM_FRAME_SKIP, STREAM_DIFF_SIZE, STREAM_CHANGE_THRESHOLD
+from ColorDetector import ColorDetector
+from HoleTracker import HoleTracker
+from Logger import Logger
+
+import cv2
+import json
+import sys
+import time
+
+
+class StreamProcessor():
+    """Detect empty holes on a continuous video stream (camera, file or RTSP url).
+    Shelf state changes on the scale of minutes, so most frames are skipped without being decoded and
+    the detection only runs when a cheap downsampled difference against the last detected frame shows
+    a meaningful change. An event is emitted only when the number of empty holes changes.
+    With a HoleTracker the empty holes are smoothed across frames: every frame is detected while some
+    hole is pending confirmation, and events are only emitted when the persistent empty holes change.
+    The first event is held back while holes are pending during the tracker min_frames warm-up
+    detections, so the stream doesn't start by reporting the holes not confirmed yet as 0.
+    """
+
+    def __init__(self, detector, source, color="green", frame_skip=STREAM_FRAME_SKIP, diff_size=STREAM_DIFF_SIZE, threshold=STREAM_CHANGE_THRESHOLD, save=False, on_event=None, profile=None, tracker=None):
+        """Initialize object.
+
+        Args:
+            detector (ColorDetector): color detector.
+            source (string|int): cv2.VideoCapture source, a video path, a stream url or a camera index.
+            color (string, optional): Color to detect. Defaults to "green".
+            frame_skip (int, optional): frames skipped between checked frames. Defaults to STREAM_FRAME_SKIP.
+            diff_size (tuple, optional): downsampled (width, height) to compare frames. Defaults to STREAM_DIFF_SIZE.
+            threshold (float, optional): mean absolute gray level difference to consider a frame changed. Defaults to STREAM_CHANGE_THRESHOLD.
+            save (boolean, optional): save the detected frames artifacts into the localstore. Defaults to False.
+            on_event (function, optional): called with each event dictionary. Defaults to None, events are printed as json lines.
+            profile (string, optional): camera calibration profile name. Defaults to None, the default profile.
+            tracker (HoleTracker, optional): empty holes temporal smoothing. Defaults to None, every detection counts.
+
+        Raises:
+            ValueError: if the profile or the color of the profile don't exist.
+        """
+        self.logger = Logger(LOG_PATH, "StreamProcessor.py")
+        self.detector = detector
+        self.source = source
+        self.color = color
+        self.profile = detector.get_profile(profile)
+        if color not in self.profile.colors:
+            raise ValueError("unknown color {0}, profile {1} colors: {2}".format(color, self.profile.name, ", ".join(self.profile.colors)))
+        self.tracker = tracker
+        self.pending = 0 # Tracked holes pending confirmation or clearing
+        self.warmup = tracker.min_frames if tracker is not None else 0 # Detections before a first event with pending holes
+        self.frame_skip = frame_skip
+        self.diff_size = diff_size
+        self.threshold = threshold
+        self.save = save
+        self.on_event = on_event or (lambda event: print(json.dumps(event), flush=True))
+        self.reference = None # Downsampled gray last detected frame
+        self.empty_holes = None # Last detected empty holes
+        self.stats = { "frames" : 0, "skipped" : 0, "unchanged" : 0, "detected" : 0, "events" : 0 }
+
+
+    def changed(self, frame):
+        """Check if the frame has changed meaningfully since the last detected frame.
+
+        Args:
+            frame (numpy.ndarray): cv2 BGR frame.
+
+        Returns:
+            tuple: (boolean changed, downsampled gray frame).
+        """
+        small = cv2.cvtColor(cv2.resize(frame, self.diff_size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        if self.reference is None:
+            return True, small
+
+        return cv2.absdiff(small, self.reference).mean() > self.threshold, small
+
+
+    def process(self, index, frame):
+        """Detect the empty holes of a frame if it has changed and emit an event if they have changed.
+
+        Args:
+            index (int): stream frame index.
+            frame (numpy.ndarray): cv2 BGR frame.
+
+        Returns:
+            dictionary: emitted event, None if the frame was unchanged or the empty holes didn't change.
+        """
+        changed, small = self.changed(frame)
+        if not changed and not self.pending:
+            self.stats["unchanged"] += 1
+            return None
+
+        id = "{0}_{1}".format(int(time.time()), index)
+        holes = []
+        response = self.detector.identify_color_contours(id, frame, self.color, ext="jpg", image_mode=IMAGE_NONE, save=self.save, profile=self.profile, holes=holes)
+        self.reference = small
+        self.stats["detected"] += 1
+
+        empty_holes = response["empty_holes"]
+        if self.tracker is not None:
+            tracking = self.tracker.update(str(self.source), { self.color : holes })[self.color]
+            empty_holes, self.pending = tracking["empty_holes"], tracking["pending"]
+
+        if empty_holes == self.empty_holes or (self.empty_holes is None and self.pending and self.stats["detected"] < self.warmup):
+            return None
+
+        event = { "id" : id, "frame" : index, "timestamp" : time.time(), "empty_holes" : empty_holes, "previous_empty_holes" : self.empty_holes }
+        self.empty_holes = empty_holes
+        self.stats["events"] += 1
+        self.logger.info(":process id: {0} frame: {1} empty_holes: {2} previous_empty_holes: {3} info: empty holes changed", id, index, event["empty_holes"], event["previous_empty_holes"])
+        self.on_event(event)
+
+        return event
+
+
+    def run(self, max_frames=None):
+        """Read the stream until it ends, processing one of every frame_skip + 1 frames.
+        Skipped frames are only grabbed, never decoded.
+
+        Args:
+            max_frames (int, optional): maximum frames to read. Defaults to None, until the stream ends.
+
+        Returns:
+            dictionary: frames, skipped, unchanged, detected and events counters.
+        """
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            self.logger.error(":run source: {0} error: unable to open stream!", self.source)
+            raise IOError("unable to open stream {0}".format(self.source))
+
+        self.logger.info(":run source: {0} color: {1} frame_skip: {2} threshold: {3} info: stream opened", self.source, self.color, self.frame_skip, self.threshold)
+        try:
+            index = 0
+            while max_frames is None or index < max_frames:
+                if index % (self.frame_skip + 1):
+                    if not capture.grab():
+                        break
+                    self.stats["skipped"] += 1
+                else:
+                    ok, frame = capture.read()
+                    if not ok:
+                        break
+                    self.process(index, frame)
+
+                self.stats["frames"] += 1
+                index += 1
+        finally:
+            capture.release()
+
+        self.logger.info(":run source: {0} stats: {1} info: stream finished", self.source, self.stats)
+        return self.stats
+
+
+
+if __name__ == "__main__":
+    if len(sys.argv) in (2, 3):
+        source = int(sys.argv[1]) if sys.argv[1].isdigit() else sys.argv[1]
+        processor = StreamProcessor(ColorDetector(), source, *sys.argv[2:], tracker=HoleTracker())
+        print(json.dumps(processor.run()), file=sys.stderr)
+    else:
+        print("Usage: python StreamProcessor.py <video_path|stream_url|camera_index> [color]")
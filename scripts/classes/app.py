@@ -12,20 +12,258 @@ __status__      = "Development"
 
 
 # Flask imports
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, g, request, jsonify, send_file
 from flask_httpauth import HTTPTokenAuth
 
 # Module imports
 from Logger import Logger
 from ColorDetector import ColorDetector
+from ArtifactWriter import ArtifactWriter
+from ArtifactStore import ArtifactStore
+from AlertDispatcher import AlertDispatcher, FileSink, WebhookSink
+from CalibrationProfile import load_profiles
+from HoleTracker import HoleTracker
+from JobQueue import JobQueue
+from ResultCache import ResultCache
+from Metrics import Metrics
 from module import *
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import cv2
+import numpy as np
+import os
+import re
 import time
 
 
-app = Flask(__name__) # Initialize Flask app
+api = Blueprint("api", __name__) # Detection API routes, registered by create_app
 auth = HTTPTokenAuth(scheme='Bearer') # Initialize bearer authentication token
-logger = Logger(LOG_PATH, "app.py") # Logger object
-detector = ColorDetector() # ColorDetector object
+
+# Process wide components, created by create_app
+logger = None # Logger object
+store = None # Localstore artifacts index and retention
+writer = None # Background localstore artifacts writer
+detector = None # ColorDetector object
+tracker = None # Per camera temporal smoothing of the empty holes
+alerts = None # Empty holes transitions notifications
+executor = None # Batch detection worker pool
+jobs = None # Asynchronous detection jobs
+cache = None # Detection results of recent frames
+metrics = None # Prometheus metrics
+
+# Compiled calibration profiles by profiles path, see preload
+preloaded = {}
+
+# Settings overridable by COLORDETECTOR_<NAME> environment variables, see get_config
+APP_CONFIG = {
+    "PROFILES_PATH" : PROFILES_PATH,
+    "BATCH_WORKERS" : BATCH_WORKERS,
+    "JOB_WORKERS" : JOB_WORKERS,
+    "JOB_QUEUE_SIZE" : JOB_QUEUE_SIZE,
+    "JOB_MAX_RESULT_BYTES" : JOB_MAX_RESULT_BYTES,
+    "RESULT_CACHE_SIZE" : RESULT_CACHE_SIZE,
+    "RESULT_CACHE_TTL" : RESULT_CACHE_TTL,
+    "RESULT_CACHE_MAX_BYTES" : RESULT_CACHE_MAX_BYTES,
+    "STORE_TTL" : STORE_TTL,
+    "STORE_MAX_BYTES" : STORE_MAX_BYTES,
+    "WARMUP" : APP_WARMUP,
+    "ALERT_WEBHOOK_URL" : ALERT_WEBHOOK_URL,
+    "ALERT_FILE_PATH" : ALERT_FILE_PATH,
+    "ALERT_INTERVAL" : ALERT_INTERVAL,
+    "METRICS_DIR" : METRICS_DIR,
+}
+
+
+def get_config(config=None):
+    """Obtain the application settings: APP_CONFIG defaults, overridden by the COLORDETECTOR_<NAME> environment
+    variables and then by config.
+
+    Args:
+        config (dictionary, optional): explicit settings. Defaults to None.
+
+    Raises:
+        ValueError: if an environment variable value is not valid.
+
+    Returns:
+        dictionary: settings by name.
+    """
+    settings = dict(APP_CONFIG)
+    for name, default in APP_CONFIG.items():
+        value = os.environ.get(APP_ENV_PREFIX + name)
+        if value is None:
+            continue
+        if isinstance(default, bool):
+            settings[name] = value.lower() in ("1", "true", "yes", "on")
+        elif isinstance(default, (int, float)):
+            settings[name] = type(default)(value)
+        else:
+            settings[name] = value
+    settings.update(config or {})
+
+    return settings
+
+
+def preload(profiles_path=PROFILES_PATH):
+    """Load and compile the calibration profiles (regions of interest and lookup tables) once per process.
+    Nothing here starts threads or opens files, so it can run in a pre-fork server master and the workers
+    share the compiled profiles, OpenCV and NumPy copy-on-write.
+
+    Args:
+        profiles_path (string, optional): calibration profiles json path. Defaults to PROFILES_PATH.
+
+    Returns:
+        tuple: compiled (profiles, cameras), see load_profiles.
+    """
+    if profiles_path not in preloaded:
+        cv2.setUseOptimized(True)
+        preloaded[profiles_path] = load_profiles(profiles_path)
+
+    return preloaded[profiles_path]
+
+
+def create_app(config=None):
+    """Create the Flask application and its process wide components (logger, store, writer, detector, tracker,
+    alerts, worker pools, cache and metrics), once per process. Worker threads and the index connection are created here,
+    in the serving process, after any fork.
+
+    Args:
+        config (dictionary, optional): settings overriding APP_CONFIG and the environment, see get_config. Defaults to None.
+
+    Returns:
+        flask.Flask: application.
+    """
+    global logger, store, writer, detector, tracker, alerts, executor, jobs, cache, metrics
+
+    config = get_config(config)
+    logger = Logger(LOG_PATH, "app.py")
+    metrics = create_metrics(config["METRICS_DIR"])
+    store = ArtifactStore(ttl=config["STORE_TTL"], max_bytes=config["STORE_MAX_BYTES"])
+    writer = ArtifactWriter(store=store, observe=lambda image, seconds: metrics.observe("write_seconds", seconds, image=image))
+    detector = ColorDetector(writer, config["PROFILES_PATH"], preload(config["PROFILES_PATH"]))
+    alerts = AlertDispatcher(get_alert_sinks(config), interval=config["ALERT_INTERVAL"])
+    tracker = HoleTracker(on_evict=alerts.forget) # The alert counts are forgotten with the tracks
+    executor = ThreadPoolExecutor(max_workers=config["BATCH_WORKERS"])
+    jobs = JobQueue(config["JOB_WORKERS"], config["JOB_QUEUE_SIZE"], max_bytes=config["JOB_MAX_RESULT_BYTES"], store=store) # Shared by the server processes
+    cache = ResultCache(config["RESULT_CACHE_SIZE"], config["RESULT_CACHE_TTL"], max_bytes=config["RESULT_CACHE_MAX_BYTES"])
+
+    app = Flask(__name__)
+    app.config.update(config)
+    app.register_blueprint(api)
+    if config["WARMUP"]:
+        warm_up()
+    logger.info(":create_app pid: {0} config: {1} info: app created", os.getpid(), config)
+
+    return app
+
+
+def get_alert_sinks(config):
+    """Obtain the configured alert sinks.
+
+    Args:
+        config (dictionary): settings, see get_config.
+
+    Returns:
+        list: webhook and file sinks, empty if the alerts are disabled.
+    """
+    sinks = []
+    if config["ALERT_WEBHOOK_URL"]:
+        sinks.append(WebhookSink(config["ALERT_WEBHOOK_URL"]))
+    if config["ALERT_FILE_PATH"]:
+        sinks.append(FileSink(config["ALERT_FILE_PATH"]))
+
+    return sinks
+
+
+def create_metrics(directory=None):
+    """Declare the application metrics.
+
+    Args:
+        directory (string, optional): multiprocess mode directory shared by the server processes, see Metrics. Defaults to None, single process.
+
+    Returns:
+        Metrics: metrics object.
+    """
+    metrics = Metrics(directory=directory)
+    metrics.counter("requests_total", "Json responses by endpoint and status code.")
+    metrics.histogram("request_seconds", "Request latency by endpoint in seconds.", METRICS_LATENCY_BUCKETS)
+    metrics.histogram("stage_seconds", "Detection pipeline stage latency in seconds.", METRICS_LATENCY_BUCKETS)
+    metrics.histogram("holes_per_frame", "Empty holes per detected frame and color.", METRICS_HOLES_BUCKETS)
+    metrics.histogram("contours_per_frame", "Contours per detected frame and color, found and valid after filtering.", METRICS_CONTOURS_BUCKETS)
+    metrics.histogram("write_seconds", "Artifact image encoding and writing latency by image in seconds.", METRICS_LATENCY_BUCKETS)
+    metrics.collect("artifact_queue_depth", "gauge", "Requests waiting for their artifacts to be written.", lambda: writer.stats()["depth"])
+    metrics.collect("artifacts_total", "counter", "Artifact writer requests by event.", lambda: { event : value for event, value in writer.stats().items() if event != "depth" }, "event")
+    metrics.collect("job_queue_depth", "gauge", "Asynchronous jobs waiting for a worker.", lambda: jobs.stats()["depth"])
+    metrics.collect("jobs_kept", "gauge", "Asynchronous jobs kept with their state or result.", lambda: jobs.stats()["jobs"])
+    metrics.collect("job_results_bytes", "gauge", "Size of the kept asynchronous jobs results.", lambda: jobs.stats()["bytes"])
+    metrics.collect("jobs_total", "counter", "Asynchronous jobs by event.", lambda: { event : value for event, value in jobs.stats().items() if event not in ("depth", "jobs", "bytes") }, "event")
+    metrics.collect("cache_size", "gauge", "Cached detection results.", lambda: cache.stats()["size"])
+    metrics.collect("cache_bytes", "gauge", "Size of the cached detection results.", lambda: cache.stats()["bytes"])
+    metrics.collect("cache_total", "counter", "Detection results cache lookups and removals by event.", lambda: { event : value for event, value in cache.stats().items() if event not in ("size", "bytes") }, "event")
+    metrics.collect("store_requests", "gauge", "Indexed localstore requests.", lambda: store.stats()["requests"])
+    metrics.collect("store_bytes", "gauge", "Indexed localstore artifacts bytes.", lambda: store.stats()["bytes"])
+    metrics.collect("tracked_cameras", "gauge", "Tracked camera colors.", lambda: len(tracker.cameras))
+    metrics.collect("alert_queue_depth", "gauge", "Alerts waiting to be sent.", lambda: alerts.stats()["depth"])
+    metrics.collect("alerts_total", "counter", "Empty holes transition alerts by event.", lambda: { event : value for event, value in alerts.stats().items() if event != "depth" }, "event")
+
+    return metrics
+
+
+def warm_up():
+    """Run a synthetic frame of every calibration profile resolution through the detector, so OpenCV lazy
+    initialization, its thread pool and the first-touch allocations are paid before the first request.
+    Nothing is saved, cached, tracked or measured.
+    """
+    start = time.perf_counter()
+    frames = 0
+    for profile in detector.profiles.values():
+        for height, width in profile.resolutions:
+            # Gray frame with a square of every profile color in the middle of the valid area
+            frame = np.full((height, width, 3), 128, dtype=np.uint8)
+            side = max(height, width) // 20
+            for index, (lower, upper) in enumerate(profile.ranges.values()):
+                x, y = int(width * 0.3), int(height * 0.3) + index * 2 * side
+                frame[y:y + side, x:x + side] = (lower.astype(np.int32) + upper) // 2
+            buffer = cv2.imencode(".jpg", frame)[1].tobytes()
+
+            detector.identify_color_contours("warmup", buffer, next(iter(profile.colors)), ext="jpg", image_mode=IMAGE_FULL, save=False, profile=profile)
+            for scale in sorted(PYRAMID_SCALES):
+                detector.identify_colors_contours("warmup", buffer, list(profile.colors), ext="jpg", image_mode=IMAGE_THUMBNAIL, save=False, scale=scale, profile=profile)
+            frames += 1
+
+    logger.info(":warm_up frames: {0} seconds: {1} info: detector warmed up", frames, time.perf_counter() - start)
+
+
+def get_endpoint():
+    """Obtain the current request endpoint name, without the blueprint.
+
+    Returns:
+        string: endpoint name, "unknown" if no route matched.
+    """
+    return request.endpoint.rsplit(".", 1)[-1] if request.endpoint else "unknown"
+
+
+@api.before_app_request
+def start_request():
+    """Record the request start time.
+    """
+    g.start = time.perf_counter()
+
+
+@api.after_app_request
+def finish_request(response):
+    """Record the request latency.
+
+    Args:
+        response (flask.wrappers.Response): request response.
+
+    Returns:
+        flask.wrappers.Response: the same response.
+    """
+    if "start" in g:
+        metrics.observe("request_seconds", time.perf_counter() - g.start, endpoint=get_endpoint())
+
+    return response
+
 
 @auth.verify_token
 def verify_token(token):
@@ -41,11 +279,12 @@ def verify_token(token):
         return AUTHENTICATION_TOKENS[token]
 
 
-@app.route("/detect", methods=["POST"])
+@api.route("/detect", methods=["POST"])
 @auth.login_required
 def detect():
     """Detect API POST method.
     Validate ip and body. If information is valid generate id and detect empty holes.
+    The frame is sent base64 encoded in a json body, as a raw image body or as a multipart upload, see get_frame_request.
     If OK, returns a json response with the code, status, id, empty_holes and base64 image.
     Otherwise returns a json response with the code, status and the remote ip address.
 
@@ -57,41 +296,473 @@ def detect():
 
     # Validate ip
     remote_addr = request.remote_addr
-    logger.info(":detect user: {0} remote_addr: {1}".format(user, remote_addr), get_lineno())
+    logger.info(":detect user: {0} remote_addr: {1}", user, remote_addr)
+    if not validate_ip(remote_addr):
+        logger.warning(":detect user: user: {0} remote_addr: {1} error: invalid remote ip!", user, remote_addr)
+        return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+
+    try:
+        # Read the frame and the request fields
+        frame_request = get_frame_request()
+        if frame_request is None:
+            logger.error(":detect user: {0} remote_addr: {1} mimetype: {2} error: frame not found or unsupported content type!", user, remote_addr, request.mimetype)
+            return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+        frame, content = frame_request
+
+        # Obtain collision-free request id
+        id = new_id()
+
+        # Decode the frame and detect the empty holes
+        response = process_frame(id, frame, get_detect_options(content), content.get("colors"), content.get("camera_id"))
+
+        return get_json_response(REQUEST_OK, STATUS_TO_NAMES[REQUEST_OK], remote_addr, id, response)
+
+    except Exception as e:
+        logger.error(":detect user: {0} remote_addr: {1} e: {2} error: invalid content!", user, remote_addr, e)
+        return get_json_response(ERROR_INVALID_CONTENT, STATUS_TO_NAMES[ERROR_INVALID_CONTENT], remote_addr)
+
+
+@api.route("/detect/batch", methods=["POST"])
+@auth.login_required
+def detect_batch():
+    """Detect batch API POST method.
+    Validate ip and body. The body contains a "frames" list of { "id" : <frame id>, "frame" : <base64 image> } items,
+    each one with an optional "camera_id" or "profile" overriding the request ones, for the calibration profile and the tracking.
+    Frames are decoded and detected on the batch worker pool and their results are returned in the same order.
+    Each result has its own code and status, an invalid frame doesn't fail the whole batch.
+
+    Returns:
+       flask.wrappers.Response: represents the response json object to return.
+    """
+
+    user = auth.current_user()
+
+    # Validate ip
+    remote_addr = request.remote_addr
+    logger.info(":detect_batch user: {0} remote_addr: {1}", user, remote_addr)
     if not validate_ip(remote_addr):
-        logger.warning(":detect user: user: {0} remote_addr: {1} error: invalid remote ip!".format(user, remote_addr), get_lineno())
+        logger.warning(":detect_batch user: {0} remote_addr: {1} error: invalid remote ip!", user, remote_addr)
         return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
 
     # Validate json body
-    # Check if the mimetype indicates JSON data, either application/json or application/*+json
+    if not request.is_json:
+        logger.error(":detect_batch user: {0} remote_addr: {1} error: non json request!", user, remote_addr)
+        return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+
+    try:
+        content = request.get_json()
+        frames = content.get("frames") if isinstance(content, dict) else None
+
+        # Search for a non empty "frames" list request parameter
+        if not isinstance(frames, list) or not frames or len(frames) > BATCH_MAX_FRAMES:
+            logger.error(":detect_batch user: {0} remote_addr: {1} error: frames field not found, empty or too large!", user, remote_addr)
+            return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+
+        # Obtain collision-free request id, every frame is stored under <id>_<index>
+        id = new_id()
+        options = get_detect_options(content)
+        colors = content.get("colors")
+
+        # Fan out the frames over the worker pool and collect the results in order
+        futures = [executor.submit(detect_batch_frame, "{0}_{1}".format(id, index), frame, options, colors, content.get("camera_id")) for index, frame in enumerate(frames)]
+        results = [future.result() for future in futures]
+
+        return get_json_response(REQUEST_OK, STATUS_TO_NAMES[REQUEST_OK], remote_addr, id, { "results" : results })
+
+    except Exception as e:
+        logger.error(":detect_batch user: {0} remote_addr: {1} e: {2} error: invalid json content!", user, remote_addr, e)
+        return get_json_response(ERROR_INVALID_CONTENT, STATUS_TO_NAMES[ERROR_INVALID_CONTENT], remote_addr)
+
+
+@api.route("/detect/async", methods=["POST"])
+@auth.login_required
+def detect_async():
+    """Detect async API POST method.
+    Validate ip and body as /detect does, json, raw image or multipart, and queue the detection job. If OK, returns right away a json
+    response with the code, status and job id, the result is fetched from /jobs/<id>.
+    If the job queue is full returns a json response with the ERROR_TRY_AGAIN_LATER code.
+
+    Returns:
+       flask.wrappers.Response: represents the response json object to return.
+    """
+
+    user = auth.current_user()
+
+    # Validate ip
+    remote_addr = request.remote_addr
+    logger.info(":detect_async user: {0} remote_addr: {1}", user, remote_addr)
+    if not validate_ip(remote_addr):
+        logger.warning(":detect_async user: {0} remote_addr: {1} error: invalid remote ip!", user, remote_addr)
+        return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+
+    try:
+        # Read the frame and the request fields
+        frame_request = get_frame_request()
+        if frame_request is None:
+            logger.error(":detect_async user: {0} remote_addr: {1} mimetype: {2} error: frame not found or unsupported content type!", user, remote_addr, request.mimetype)
+            return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+        frame, content = frame_request
+
+        # The job id is the request id
+        id = new_id()
+        options = get_detect_options(content)
+
+    except Exception as e:
+        logger.error(":detect_async user: {0} remote_addr: {1} e: {2} error: invalid json content!", user, remote_addr, e)
+        return get_json_response(ERROR_INVALID_CONTENT, STATUS_TO_NAMES[ERROR_INVALID_CONTENT], remote_addr)
+
+    # Queue the job, reject it right away if the queue is full
+    if not jobs.submit(id, process_frame, id, frame, options, content.get("colors"), content.get("camera_id")):
+        logger.warning(":detect_async user: {0} remote_addr: {1} id: {2} error: job queue full!", user, remote_addr, id)
+        return get_json_response(ERROR_TRY_AGAIN_LATER, STATUS_TO_NAMES[ERROR_TRY_AGAIN_LATER], remote_addr)
+
+    return get_json_response(REQUEST_OK, STATUS_TO_NAMES[REQUEST_OK], remote_addr, id, { "state" : JOB_QUEUED, "result_url" : "/jobs/{0}".format(id) })
+
+
+@api.route("/jobs/<id>", methods=["GET"])
+@auth.login_required
+def job(id):
+    """Jobs API GET method.
+    Returns the state of an asynchronous detection job and, once done, its /detect response attributes as "result".
+    With the "wait" query parameter waits up to that many seconds (at most JOB_MAX_WAIT) for the job to finish.
+    Otherwise returns a json response with the code, status and the remote ip address.
+
+    Args:
+        id (string): job id.
+
+    Returns:
+       flask.wrappers.Response: represents the response json object to return.
+    """
+
+    user = auth.current_user()
+
+    # Validate ip
+    remote_addr = request.remote_addr
+    if not validate_ip(remote_addr):
+        logger.warning(":job user: {0} remote_addr: {1} error: invalid remote ip!", user, remote_addr)
+        return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+
+    try:
+        wait = min(max(float(request.args.get("wait", 0)), 0), JOB_MAX_WAIT)
+    except ValueError:
+        logger.error(":job user: {0} id: {1} error: invalid wait!", user, id)
+        return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+
+    state = jobs.get(id, wait)
+    if state is None:
+        logger.error(":job user: {0} id: {1} error: job not found!", user, id)
+        return get_json_response(ERROR_NO_DATA, STATUS_TO_NAMES[ERROR_NO_DATA], remote_addr)
+
+    if state["state"] == JOB_FAILED:
+        return get_json_response(ERROR_INVALID_CONTENT, STATUS_TO_NAMES[ERROR_INVALID_CONTENT], remote_addr, id, { "state" : JOB_FAILED })
+
+    attributes = { "state" : state["state"] }
+    if state["state"] == JOB_DONE:
+        attributes["result"] = state["result"]
+
+    return get_json_response(REQUEST_OK, STATUS_TO_NAMES[REQUEST_OK], remote_addr, id, attributes)
+
+
+def detect_batch_frame(id, frame, options, colors=None, camera_id=None):
+    """Detect the empty holes of a single batch frame.
+
+    Args:
+        id (string): frame storage id.
+        frame (dictionary): batch item with the client frame "id", the base64 "frame" and the optional "camera_id" or "profile".
+        options (dictionary): detection and response image options, see get_detect_options.
+        colors (list, optional): colors to detect in a single pass. Defaults to None, only green.
+        camera_id (string, optional): request camera id, used when the frame has none. Defaults to None, no tracking.
+
+    Returns:
+        dictionary: frame result with the client id, code, status and, if OK, the detection attributes.
+    """
+    frame_id = frame.get("id") if isinstance(frame, dict) else None
+    if frame_id is None or "frame" not in frame:
+        logger.error(":detect_batch_frame id: {0} error: id or frame field not found!", id)
+        return { "id" : frame_id, "code" : ERROR_INVALID_REQUEST, "status" : STATUS_TO_NAMES[ERROR_INVALID_REQUEST] }
+
+    try:
+        if "profile" in frame or "camera_id" in frame:
+            options = dict(options, profile=detector.get_profile(frame.get("profile"), frame.get("camera_id", camera_id)))
+        attributes = process_frame(id, frame["frame"], options, colors, frame.get("camera_id", camera_id))
+        return { "id" : frame_id, "code" : REQUEST_OK, "status" : STATUS_TO_NAMES[REQUEST_OK], "attributes" : attributes }
+
+    except Exception as e:
+        logger.error(":detect_batch_frame id: {0} frame_id: {1} e: {2} error: invalid frame content!", id, frame_id, e)
+        return { "id" : frame_id, "code" : ERROR_INVALID_CONTENT, "status" : STATUS_TO_NAMES[ERROR_INVALID_CONTENT] }
+
+
+@api.route("/frames/<id>", methods=["GET"])
+@auth.login_required
+def frames(id):
+    """Frames API GET method.
+    Returns a stored request image, the annotated frame by default or the "kind" query parameter image (frame, mask, mask_<color> or original).
+    Otherwise returns a json response with the code, status and the remote ip address.
+
+    Args:
+        id (string): request id.
+
+    Returns:
+       flask.wrappers.Response: represents the image or the response json object to return.
+    """
+
+    user = auth.current_user()
+
+    # Validate ip
+    remote_addr = request.remote_addr
+    if not validate_ip(remote_addr):
+        logger.warning(":frames user: {0} remote_addr: {1} error: invalid remote ip!", user, remote_addr)
+        return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+
+    # Validate id and image kind, ids never leave the localstore
+    kind = request.args.get("kind", "frame")
+    if not re.fullmatch(r"[0-9A-Za-z_]+", id) or not re.fullmatch(r"frame|original|mask(_[a-z]+)?", kind):
+        logger.error(":frames user: {0} id: {1} kind: {2} error: invalid id or kind!", user, id, kind)
+        return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+
+    # Indexed artifacts, or legacy unsharded ones until they are migrated
+    path = store.get_file(id, kind) or STORE_PATH + id + "/" + kind + ".jpg"
+    if not os.path.isfile(path):
+        logger.error(":frames user: {0} id: {1} kind: {2} error: image not found!", user, id, kind)
+        return get_json_response(ERROR_NO_DATA, STATUS_TO_NAMES[ERROR_NO_DATA], remote_addr)
+
+    metrics.inc("requests_total", endpoint=get_endpoint(), code=REQUEST_OK, status=STATUS_TO_NAMES[REQUEST_OK])
+    return send_file(path, mimetype="image/jpeg")
+
+
+@api.route("/frames", methods=["GET"])
+@auth.login_required
+def frames_history():
+    """Frames history API GET method.
+    Returns the indexed requests, newest first, filtered by the optional "camera_id", "since" and "until" timestamps
+    query parameters, up to "limit" (default 100, at most 1000) requests. Each one has its id, camera_id, timestamp,
+    empty_holes, localstore path, stored files and their bytes.
+    Otherwise returns a json response with the code, status and the remote ip address.
+
+    Returns:
+       flask.wrappers.Response: represents the response json object to return.
+    """
+
+    user = auth.current_user()
+
+    # Validate ip
+    remote_addr = request.remote_addr
+    if not validate_ip(remote_addr):
+        logger.warning(":frames_history user: {0} remote_addr: {1} error: invalid remote ip!", user, remote_addr)
+        return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+
+    try:
+        since = request.args.get("since", type=float)
+        until = request.args.get("until", type=float)
+        limit = min(max(int(request.args.get("limit", 100)), 1), 1000)
+    except ValueError:
+        logger.error(":frames_history user: {0} error: invalid query parameters!", user)
+        return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+
+    entries = store.query(request.args.get("camera_id"), since, until, limit)
+    return get_json_response(REQUEST_OK, STATUS_TO_NAMES[REQUEST_OK], remote_addr, attributes={ "frames" : entries })
+
+
+@api.route("/metrics", methods=["GET"])
+@auth.login_required
+def metrics_text():
+    """Metrics API GET method.
+    Returns the request counts by status code, the request, detection stage and empty holes histograms and the
+    artifact writer, job queue, results cache, tracker and alerts metrics in the Prometheus text format.
+    Otherwise returns a json response with the code, status and the remote ip address.
+
+    Returns:
+       flask.wrappers.Response: represents the metrics text or the response json object to return.
+    """
+
+    user = auth.current_user()
+
+    # Validate ip
+    remote_addr = request.remote_addr
+    if not validate_ip(remote_addr):
+        logger.warning(":metrics_text user: {0} remote_addr: {1} error: invalid remote ip!", user, remote_addr)
+        return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def get_frame_request():
+    """Obtain the frame and the fields of a detect request, in one of these forms:
+    * json body with the base64 "frame" and the other fields.
+    * raw image body (e.g. image/jpeg) with the fields in the query string.
+    * multipart/form-data body with the "frame" file and the other fields in the form.
+    Raw image bodies are read straight from the request stream into the decode buffer. Multipart uploads are
+    spooled by Werkzeug while the form is parsed (in memory or in a temporary file) and then copied into the
+    decode buffer, so they stay buffered. "colors" is comma separated outside json.
+
+    Raises:
+        ValueError: if the image can't be read or is larger than FRAME_MAX_BYTES.
+
+    Returns:
+        tuple: (base64 string or encoded bytes frame, fields dictionary), None if there is no frame or the content type is not supported.
+    """
     if request.is_json:
-        try:
-            # Parse data as JSON
-            content = request.get_json()
+        content = request.get_json()
+        if not isinstance(content, dict) or "frame" not in content:
+            return None
+        return content["frame"], content
+
+    if request.mimetype.startswith("image/"):
+        content = request.args.to_dict()
+        frame = read_stream(request.stream, request.content_length)
+    elif request.mimetype == "multipart/form-data":
+        if request.content_length is not None and request.content_length > FRAME_MAX_BYTES:
+            raise ValueError("too large multipart request")
+        upload = request.files.get("frame")
+        if upload is None:
+            return None
+        content = request.form.to_dict()
+        frame = read_stream(upload.stream)
+    else:
+        return None
+
+    if "colors" in content:
+        content["colors"] = content["colors"].split(",")
+
+    return frame, content
+
 
-            # Search for "frame" request parameter
-            if "frame" not in content:
-                logger.error(":detect user: {0} remote_addr: {1} content: {2} error: frame field not found!".format(user, remote_addr, content), get_lineno())
-                return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+def get_detect_options(content):
+    """Obtain the detection and response image options of a request body.
 
-            # Obtain timestamp id and path
-            id = str(int(time.time()))
+    Args:
+        content (dictionary): request json body with the optional "image" mode, "thumbnail_width", "quality", fast mode "scale"
+            and calibration "profile" name or "camera_id" fields.
 
-            # Check if image is base64 and save it, save function returns the path
-            base64img = save_base64img(id, content["frame"])
-            logger.info(":detect user: {0} info: saved base64 img successful!".format(user), get_lineno())
+    Raises:
+        ValueError: if some option is not valid, or the fast mode "scale" is asked for colors (default green) other than the PYRAMID_COLORS.
 
-            # Call identify_color_contours method
-            response = detector.identify_color_contours(id, base64img)
+    Returns:
+        dictionary: identify_color_contours image_mode, thumbnail_width, quality, scale and profile arguments.
+    """
+    options = {
+        "image_mode" : content.get("image", IMAGE_FULL),
+        "thumbnail_width" : int(content.get("thumbnail_width", THUMBNAIL_WIDTH)),
+        "quality" : int(content.get("quality", THUMBNAIL_QUALITY)),
+        "scale" : int(content.get("scale", 1)),
+        "profile" : detector.get_profile(content.get("profile"), content.get("camera_id")), # Compiled at startup, nothing is built per request
+    }
+    if options["image_mode"] not in IMAGE_MODES or options["thumbnail_width"] <= 0 or not 0 <= options["quality"] <= 100 or options["scale"] not in PYRAMID_SCALES:
+        raise ValueError("invalid detect options")
+    if options["scale"] > 1 and not PYRAMID_COLORS.issuperset(content.get("colors") or ["green"]):
+        raise ValueError("fast mode scale only applies to the {0} colors".format(sorted(PYRAMID_COLORS)))
+
+    return options
+
+
+def process_frame(id, frame, options, colors=None, camera_id=None):
+    """Decode a frame in memory, optionally keep the original and detect the empty holes.
+    Duplicated frames (same content, options and colors) reuse the cached detection result, see ResultCache, and the
+    stored artifacts of its request are linked to this one, see ArtifactWriter.link.
+    The result is indexed in the ArtifactStore from the ArtifactWriter thread. Frames of a camera are also matched with its previous frames, the "tracking" response field has the
+    empty holes that persist across frames, see HoleTracker, and their transitions are notified, see AlertDispatcher.
 
-            return get_json_response(REQUEST_OK, STATUS_TO_NAMES[REQUEST_OK], remote_addr, id, response)
+    Args:
+        id (string): request id.
+        frame (string|bytes-like): base64 image encoded or encoded image bytes.
+        options (dictionary): detection and response image options, see get_detect_options.
+        colors (list, optional): colors to detect in a single pass, empty holes are returned by color. Defaults to None, only green.
+        camera_id (string, optional): camera id of the frame. Defaults to None, no tracking.
 
-        except Exception as e:
-            logger.error(":detect user: {0} remote_addr: {1} e: {2} error: invalid json content!".format(user, remote_addr, e), get_lineno())
-            return get_json_response(ERROR_INVALID_CONTENT, STATUS_TO_NAMES[ERROR_INVALID_CONTENT], remote_addr)
+    Raises:
+        ValueError: if the colors are not valid.
+
+    Returns:
+        dictionary: identify_color_contours or identify_colors_contours response.
+    """
+    buffer = base64.b64decode(frame) if isinstance(frame, str) else frame
+    if SAVE_ORIGINAL:
+        save_original(id, buffer)
+        store.add_files(id, { "original" : "original.jpg" }, len(buffer))
+        logger.info(":process_frame id: {0} info: saved original img successful!", id)
+
+    if colors is not None and not isinstance(colors, list):
+        raise ValueError("invalid colors")
+
+    # Reuse the result of a duplicated frame
+    key = cache.key(buffer, get_cache_context(options, colors))
+    cached = cache.get(key)
+    if cached is not None:
+        # The artifacts and the image url of the first request are shared with this one
+        response, holes, source = cached
+        logger.info(":process_frame id: {0} source: {1} info: cached result", id, source)
+        writer.link(id, source)
+        response = dict(response)
+        if "image_url" in response:
+            response["image_url"] = "/frames/{0}".format(id)
     else:
-        logger.error(":detect user: {0} remote_addr: {1} error: non json request!".format(user, remote_addr), get_lineno())
-        return get_json_response(ERROR_INVALID_REQUEST, STATUS_TO_NAMES[ERROR_INVALID_REQUEST], remote_addr)
+        response, holes = detect_frame(id, buffer, options, colors)
+        if not response:
+            return response
+        cache.put(key, (response, holes, id), len(response["base64image"]))
+        response = dict(response)
+
+    writer.record(id, camera_id, response["empty_holes"]) # Indexed by the writer thread, after the artifacts
+    if camera_id is not None:
+        tracking = tracker.update(camera_id, holes)
+        alerts.update(camera_id, tracking, id)
+        response["tracking"] = tracking["green"] if colors is None else tracking
+
+    return response
+
+
+def detect_frame(id, buffer, options, colors=None):
+    """Decode and detect the empty holes of a frame.
+
+    Args:
+        id (string): request id.
+        buffer (bytes-like): encoded frame.
+        options (dictionary): detection and response image options, see get_detect_options.
+        colors (list, optional): colors to detect in a single pass. Defaults to None, only green.
+
+    Raises:
+        ValueError: if the colors are not valid.
+
+    Returns:
+        tuple: (identify_color_contours or identify_colors_contours response, empty holes rectangles by color).
+    """
+    timings = {}
+    counts = {}
+    if colors is None:
+        holes = []
+        response = detector.identify_color_contours(id, decode_image(buffer), ext="jpg", timings=timings, holes=holes, counts=counts, **options)
+        holes = { "green" : holes }
+    else:
+        holes = {}
+        response = detector.identify_colors_contours(id, decode_image(buffer), colors, ext="jpg", timings=timings, holes=holes, counts=counts, **options)
+        if not response:
+            raise ValueError("invalid colors")
+        holes = { color : holes.get(color, []) for color in response["empty_holes"] }
+
+    for stage, seconds in timings.items():
+        metrics.observe("stage_seconds", seconds, stage=stage)
+    if response:
+        for color, boxes in holes.items():
+            metrics.observe("holes_per_frame", len(boxes), color=color)
+        for color, (found, valid) in counts.items():
+            metrics.observe("contours_per_frame", found, color=color, contours="found")
+            metrics.observe("contours_per_frame", valid, color=color, contours="valid")
+
+    return response, holes
+
+
+def get_cache_context(options, colors=None):
+    """Obtain the results cache context of a request, the detection options and colors.
+
+    Args:
+        options (dictionary): detection and response image options, see get_detect_options.
+        colors (list, optional): colors to detect. Defaults to None, only green.
+
+    Returns:
+        tuple: hashable context.
+    """
+    options = tuple(sorted((name, getattr(value, "name", value)) for name, value in options.items())) # Profiles by name
+    return options, tuple(colors) if colors is not None else None
 
 
 def validate_ip(ip):
@@ -121,26 +792,28 @@ def get_json_response(code, status, remote_addr, id=None, attributes=None):
     """
 
     response = ({ "code" : code, "status" : status })
+    metrics.inc("requests_total", endpoint=get_endpoint(), code=code, status=status)
 
     # Add id if we have it
     if id != None:
         response["id"] = id
-        logger.info(":get_json id: {0} info: added id to response".format(id), get_lineno())
+        logger.info(":get_json id: {0} info: added id to response", id)
 
     # Add attributes if we have it
     if attributes != None:
         response["attributes"] = attributes
-        logger.info(":get_json attributes: {0} info: added attributes to response".format(attributes), get_lineno())
+        logger.debug(":get_json attributes: {0} info: added attributes to response", attributes)
 
     # If request NOOK, add the remote_addr
     if code != REQUEST_OK:
         response["remote_addr"] = remote_addr
-        logger.info(":get_json remote_addr: {0} info: request code NOOK, added remote_addr to response".format(remote_addr), get_lineno())
+        logger.info(":get_json remote_addr: {0} info: request code NOOK, added remote_addr to response", remote_addr)
 
-    logger.info(":get_json_response response: {0}".format(response), get_lineno())
+    logger.info(":get_json_response code: {0} status: {1} id: {2}", code, status, id)
+    logger.debug(":get_json_response response: {0}", response)
 
     return jsonify(response)
 
 
 if __name__ == "__main__":
-    app.run(debug=True, host="localhost")
\ No newline at end of file
+    create_app().run(debug=True, host="localhost")
\ No newline at end of file
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__      = "Roger Truchero Visa"
+__copyright__   = "Copyright 2020"
+__credits__     = []
+__license__     = "GPL"
+__version__     = "1.0.0"
+__maintainer__  = "Roger Truchero Visa"
+__email__       = "truchero.roger@gmail.com"
+__status__      = "Development"
+
+
+from module import AUTHENTICATION_TOKENS, PYRAMID_SCALES, PYRAMID_COLORS
+from ColorDetector import ColorDetector
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import base64
+import cv2
+import glob
+import json
+import numpy as np
+import os
+import platform
+import sys
+import time
+
+
+# Repository root and bundled benchmark images
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+BENCHMARK_IMAGES = ["dataset/*.jpg", "images/tests/*.jpg"]
+
+# Recorded empty holes baseline
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# Reported percentiles
+PERCENTILES = (50, 95, 99)
+
+
+def load_images():
+    """Read the bundled benchmark images.
+
+    Returns:
+        list: (relative path, encoded image bytes) tuples sorted by path.
+    """
+    paths = sorted(path for pattern in BENCHMARK_IMAGES for path in glob.glob(os.path.join(ROOT_PATH, pattern)))
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append((os.path.relpath(path, ROOT_PATH), f.read()))
+
+    return images
+
+
+def summarize(samples, frames):
+    """Compute the latency percentiles and throughput of a stage.
+
+    Args:
+        samples (list): stage durations in seconds.
+        frames (int): number of processed frames.
+
+    Returns:
+        dictionary: count, mean and pXX latencies in milliseconds and throughput in frames per second.
+    """
+    values = np.array(samples, dtype=np.float64) * 1000.0
+    summary = { "count" : len(samples), "mean_ms" : float(values.mean()) }
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary["p{0}_ms".format(percentile)] = float(value)
+    summary["fps"] = frames / (values.sum() / 1000.0) if values.sum() > 0 else None
+
+    return summary
+
+
+def bench_detector(images, color, repeat, save, scale=1):
+    """Replay the images through ColorDetector measuring every pipeline stage.
+
+    Args:
+        images (list): (path, bytes) benchmark images.
+        color (string): color to detect.
+        repeat (int): times every image is replayed.
+        save (boolean): write the localstore artifacts inline, to measure imwrite.
+        scale (int, optional): fast mode downscale factor. Defaults to 1.
+
+    Returns:
+        tuple: (stages summary dictionary, empty holes by image path dictionary).
+    """
+    detector = ColorDetector()
+    stages = {}
+    empty_holes = {}
+    for _ in range(repeat):
+        for path, data in images:
+            timings = {}
+            start = time.perf_counter()
+            response = detector.identify_color_contours("benchmark", data, color, ext="jpg", save=save, timings=timings, scale=scale)
+            timings["total"] = time.perf_counter() - start
+            for stage, value in timings.items():
+                stages.setdefault(stage, []).append(value)
+            empty_holes[path] = response["empty_holes"]
+
+    frames = len(images) * repeat
+    return { stage : summarize(samples, frames) for stage, samples in stages.items() }, empty_holes
+
+
+def bench_concurrency(images, color, threads, expected, scale=1):
+    """Replay the images concurrently through a single shared ColorDetector and compare them with the sequential results.
+
+    Args:
+        images (list): (path, bytes) benchmark images.
+        color (string): color to detect.
+        threads (int): worker threads.
+        expected (dictionary): sequential empty holes by image path.
+        scale (int, optional): fast mode downscale factor. Defaults to 1.
+
+    Returns:
+        dictionary: total latency summary, throughput and concurrent mismatches.
+    """
+    detector = ColorDetector()
+    def detect(item):
+        path, data = item
+        start = time.perf_counter()
+        response = detector.identify_color_contours("benchmark", data, color, ext="jpg", save=False, scale=scale)
+        return path, response["empty_holes"], time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(detect, images * threads))
+    elapsed = time.perf_counter() - start
+
+    summary = summarize([latency for _, _, latency in results], len(results))
+    summary["fps"] = len(results) / elapsed
+    summary["threads"] = threads
+    summary["mismatches"] = sum(1 for path, holes, _ in results if holes != expected[path])
+
+    return summary
+
+
+def bench_route(images, repeat):
+    """Replay the images through the Flask /detect route with the test client.
+
+    Args:
+        images (list): (path, bytes) benchmark images.
+        repeat (int): times every image is replayed.
+
+    Returns:
+        dictionary: request latency summary.
+    """
+    import app
+
+    client = app.create_app({ "RESULT_CACHE_SIZE" : 0 }).test_client() # Replayed frames would be cached results, measure the detection
+    headers = { "Authorization" : "Bearer {0}".format(next(iter(AUTHENTICATION_TOKENS))) }
+    bodies = [{ "frame" : base64.b64encode(data).decode("utf-8") } for _, data in images]
+
+    samples = []
+    for _ in range(repeat):
+        for body in bodies:
+            start = time.perf_counter()
+            response = client.post("/detect", json=body, headers=headers)
+            samples.append(time.perf_counter() - start)
+            if response.get_json()["code"] != app.REQUEST_OK:
+                raise RuntimeError("benchmark request failed: {0}".format(response.get_json()))
+    app.writer.join()
+
+    return summarize(samples, len(samples))
+
+
+def main():
+    """Run the benchmark and write its json report.
+
+    Returns:
+        int: process exit code, 1 if the empty holes differ from the baseline.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the detection pipeline over the bundled images.")
+    parser.add_argument("--color", default="green", help="color to detect")
+    parser.add_argument("--repeat", type=int, default=3, help="times every image is replayed")
+    parser.add_argument("--no-save", action="store_true", help="don't write the localstore artifacts")
+    parser.add_argument("--scale", type=int, default=1, help="fast mode downscale factor")
+    parser.add_argument("--threads", type=int, default=0, help="also replay the images concurrently with this many threads")
+    parser.add_argument("--route", action="store_true", help="also replay the images through the Flask /detect route")
+    parser.add_argument("--output", help="json report path, printed to stdout if not set")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="recorded empty holes baseline path")
+    parser.add_argument("--record-baseline", action="store_true", help="record the empty holes as the new baseline")
+    args = parser.parse_args()
+    if args.scale not in PYRAMID_SCALES or (args.scale > 1 and args.color not in PYRAMID_COLORS):
+        parser.error("fast mode scales are {0} and only apply to the {1} colors".format(sorted(PYRAMID_SCALES), sorted(PYRAMID_COLORS)))
+
+    images = load_images()
+    stages, empty_holes = bench_detector(images, args.color, args.repeat, not args.no_save, args.scale)
+    report = {
+        "timestamp" : int(time.time()),
+        "python" : platform.python_version(),
+        "opencv" : cv2.__version__,
+        "color" : args.color,
+        "images" : len(images),
+        "repeat" : args.repeat,
+        "scale" : args.scale,
+        "stages" : stages,
+    }
+    if args.threads:
+        report["concurrency"] = bench_concurrency(images, args.color, args.threads, empty_holes, args.scale)
+    if args.route:
+        report["route"] = bench_route(images, args.repeat)
+
+    # Check the empty holes stability against the recorded baseline
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.record_baseline:
+        baselines[args.color] = empty_holes
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+    baseline = baselines.get(args.color)
+    report["changed"] = sorted(path for path in empty_holes if baseline is not None and baseline.get(path) != empty_holes[path])
+    report["absolute_error"] = sum(abs(baseline.get(path, 0) - holes) for path, holes in empty_holes.items()) if baseline is not None else None
+    report["stable"] = baseline is not None and not report["changed"] and report.get("concurrency", {}).get("mismatches", 0) == 0
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    return 0 if report["stable"] else 1
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__      = "Roger Truchero Visa"
+__copyright__   = "Copyright 2020"
+__credits__     = []
+__license__     = "GPL"
+__version__     = "1.0.0"
+__maintainer__  = "Roger Truchero Visa"
+__email__       = "truchero.roger@gmail.com"
+__status__      = "Development"
+
+
+# Gunicorn settings, run from this directory with: gunicorn -c gunicorn.conf.py
+# The master preloads OpenCV and the compiled calibration profiles before forking (see on_starting), every
+# worker then creates its own threads, index connection and logger and warms the detector up (see
+# app.create_app) before accepting requests.
+# Every worker keeps its own metrics: they are shared through the COLORDETECTOR_METRICS_DIR directory (a new
+# temporary one if it is not set), so /metrics renders those of all the workers whichever answers, see Metrics.
+
+import gc
+import glob
+import os
+import tempfile
+
+
+wsgi_app = "app:create_app()"
+bind = os.environ.get("COLORDETECTOR_BIND", "0.0.0.0:5000")
+# A single worker by default: the HoleTracker tracks and the AlertDispatcher counts of every camera live in the worker memory,
+# with several workers the frames of a camera would be tracked and notified apart. The jobs, results index and metrics are shared.
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+threads = int(os.environ.get("COLORDETECTOR_THREADS", (os.cpu_count() or 1) * 2)) # Concurrent requests per worker, OpenCV releases the GIL
+timeout = 60
+
+# The application is created in every worker: threads and SQLite connections don't survive a fork
+preload_app = False
+
+
+def on_starting(server):
+    """Import the application and compile the calibration profiles in the master, shared copy-on-write by the workers,
+    and prepare the workers metrics directory.
+
+    Args:
+        server (gunicorn.arbiter.Arbiter): gunicorn master.
+    """
+    import app
+
+    # Metrics directory shared by the workers, emptied of the previous runs snapshots
+    directory = os.environ.get("COLORDETECTOR_METRICS_DIR") or tempfile.mkdtemp(prefix="colordetector_metrics_")
+    os.environ["COLORDETECTOR_METRICS_DIR"] = directory # Inherited by the workers, see app.get_config
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "metrics_*.json")):
+        os.remove(path)
+    server.log.info("Metrics directory: {0}".format(directory))
+
+    app.preload(app.get_config()["PROFILES_PATH"])
+    gc.freeze() # Keep the preloaded objects out of the workers garbage collections, their pages stay shared
+    server.log.info("Preloaded calibration profiles: {0}".format(sorted(app.preloaded)))
+
+
+def child_exit(server, worker):
+    """Drop the collected values (queue depths, cache sizes, ...) of an exited worker from the shared metrics, its counters keep adding up.
+
+    Args:
+        server (gunicorn.arbiter.Arbiter): gunicorn master.
+        worker (gunicorn.workers.base.Worker): exited worker.
+    """
+    from Metrics import Metrics
+
+    Metrics.mark_process_dead(os.environ["COLORDETECTOR_METRICS_DIR"], worker.pid)
@@ -17,21 +17,139 @@ __status__      = "Development"
 # os operations
 import os
 
+# Log levels
+import logging
+
 # Base64 operations
 import base64
 
-# To obtain the line
-from inspect import currentframe
+# Localstore shards
+import hashlib
+
+# Image decoding
+import cv2
+import numpy as np
+
+# Request ids
+import time
+import uuid
+
+# Environment variables prefix of the deployment settings, e.g. COLORDETECTOR_MAIN_PATH
+APP_ENV_PREFIX = "COLORDETECTOR_"
 
-# Main path
-MAIN_PATH = "/home/local/LLEIDANET/rtruchero/Escritorio/gitprojs/EmptyMeatDetection/"
+# Main path, overridden by the COLORDETECTOR_MAIN_PATH environment variable
+MAIN_PATH = os.path.join(os.environ.get(APP_ENV_PREFIX + "MAIN_PATH", "/home/local/LLEIDANET/rtruchero/Escritorio/gitprojs/EmptyMeatDetection/"), "")
 
 # Log file
 LOG_PATH = MAIN_PATH + "logs/color_detector.log"
 
+# Log level, queued file writing and maximum logged argument length
+LOG_LEVEL = logging.INFO
+LOG_QUEUED = True
+LOG_MAX_LENGTH = 512
+
 # Local store path
 STORE_PATH = MAIN_PATH + "localstore/"
 
+# Localstore index, retention and pruning
+STORE_INDEX_PATH = STORE_PATH + "index.sqlite3" # Artifacts index
+STORE_TTL = 30 * 24 * 3600.0 # Seconds the artifacts of a request are kept
+STORE_MAX_BYTES = 50 * 1024 ** 3 # Maximum artifacts size, the oldest are pruned first
+STORE_PRUNE_INTERVAL = 600.0 # Seconds between background prunings
+STORE_PRUNE_BATCH = 1000 # Requests removed per pruning query
+
+# Persist the original request frame into localstore
+SAVE_ORIGINAL = False
+
+# Batch detection
+BATCH_MAX_FRAMES = 64 # Maximum frames per batch request
+BATCH_WORKERS = os.cpu_count() or 1 # Batch worker threads, OpenCV releases the GIL
+
+# Background artifact writer
+ARTIFACT_QUEUE_SIZE = 256 # Maximum pending frames to persist
+ARTIFACT_QUEUE_TIMEOUT = 0.0 # Seconds to wait for a free queue slot before dropping the frame artifacts
+
+# Asynchronous detection jobs
+JOB_WORKERS = os.cpu_count() or 1 # Job worker threads
+JOB_QUEUE_SIZE = 64 # Maximum queued jobs, new jobs are rejected with ERROR_TRY_AGAIN_LATER when full
+JOB_RESULT_TTL = 300.0 # Seconds a finished job result is kept
+JOB_MAX_RESULTS = 4096 # Maximum kept jobs
+JOB_MAX_RESULT_BYTES = 64 * 1024 * 1024 # Maximum kept finished jobs results size, mostly their base64 images
+JOB_MAX_WAIT = 30.0 # Maximum long-poll wait in seconds
+JOB_POLL_INTERVAL = 0.1 # Seconds between the index reads of a long-polled job accepted by another process
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Detection results cache by frame content
+RESULT_CACHE_SIZE = 256 # Maximum cached results, 0 disables the cache
+RESULT_CACHE_TTL = 60.0 # Seconds a result is kept
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024 # Maximum cached results size, mostly their base64 images
+RESULT_CACHE_DHASH = False # Also reuse the results of near-identical frames, by their perceptual difference hash
+RESULT_CACHE_DHASH_DISTANCE = 2 # Maximum differing bits (of 64) of near-identical frames
+
+# Prometheus metrics
+METRICS_PREFIX = "colordetector"
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0) # Seconds
+METRICS_HOLES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100) # Empty holes per frame
+METRICS_CONTOURS_BUCKETS = (0, 10, 50, 100, 500, 1000, 5000, 10000) # Contours per frame, before and after filtering
+METRICS_DIR = None # Directory shared by the processes of a multiprocess server (see gunicorn.conf.py), None for a single process
+METRICS_FLUSH_INTERVAL = 1.0 # Seconds between the metrics snapshots of every process in multiprocess mode
+
+# Maximum raw or multipart uploaded frame size in bytes
+FRAME_MAX_BYTES = 32 * 1024 * 1024
+FRAME_READ_SIZE = 64 * 1024 # Bytes read at once from an image stream
+
+# Detect response image modes
+IMAGE_FULL = "full" # Full resolution base64 annotated image
+IMAGE_THUMBNAIL = "thumbnail" # Downscaled base64 annotated image
+IMAGE_URL = "url" # Url to fetch the stored annotated image on demand
+IMAGE_NONE = "none" # No image
+IMAGE_MODES = frozenset([IMAGE_FULL, IMAGE_THUMBNAIL, IMAGE_URL, IMAGE_NONE])
+THUMBNAIL_WIDTH = 320 # Default thumbnail width
+THUMBNAIL_QUALITY = 70 # Default thumbnail JPEG quality
+
+# Stream ingestion
+STREAM_FRAME_SKIP = 4 # Frames skipped (grabbed, not decoded) between checked frames
+STREAM_DIFF_SIZE = (64, 36) # Downsampled (width, height) used to detect frame changes
+STREAM_CHANGE_THRESHOLD = 4.0 # Mean absolute gray level difference to consider a frame changed
+
+# Fast mode downscale factors, the contours are only traced where the downscaled mask may hold a valid hole
+PYRAMID_SCALES = frozenset([1, 2])
+PYRAMID_COLORS = frozenset(["blue"]) # Colors measured faster in fast mode, the others are always detected at full resolution
+
+# Maximum reused detection buffers per thread, a few per frame resolution
+BUFFER_POOL_SIZE = 16
+
+# Temporal smoothing of the empty holes per camera
+TRACK_WINDOW = 8 # Frames remembered per hole
+TRACK_MIN_FRAMES = 3 # Frames a hole must persist (or be missed) to be confirmed (or cleared)
+TRACK_MIN_SECONDS = 30.0 # Or seconds, across at least two frames
+TRACK_IOU = 0.3 # Minimum intersection over union to match a hole across frames
+TRACK_MAX_HOLES = 64 # Maximum tracked holes per camera and color
+TRACK_MAX_CAMERAS = 1024 # Maximum tracked cameras and colors
+TRACK_IDLE_SECONDS = 3600.0 # Seconds without frames to forget a camera
+
+# Alerts on the tracked empty holes transitions of every camera
+ALERT_WEBHOOK_URL = None # Url posted with every alerts batch, None to disable it
+ALERT_FILE_PATH = None # JSON lines file appended with every alerts batch, None to disable it
+ALERT_QUEUE_SIZE = 1024 # Maximum alerts waiting to be sent, new alerts are dropped when full
+ALERT_BATCH_SIZE = 100 # Maximum alerts per notification
+ALERT_INTERVAL = 10.0 # Minimum seconds between notifications, the alerts meanwhile are batched
+ALERT_TIMEOUT = 5.0 # Webhook request timeout in seconds
+ALERT_RETRY_DELAY = 5.0 # Seconds before retrying a failed notification, doubled after every failure
+ALERT_RETRY_MAX_DELAY = 300.0 # Maximum seconds between the retries of a failed notification
+ALERT_OUT_OF_STOCK = "out_of_stock" # No confirmed empty holes before, some now
+ALERT_RESTOCKED = "restocked" # No confirmed empty holes anymore
+ALERT_CHANGED = "changed" # Other confirmed empty holes count changes
+
+# Camera calibration profiles, loaded and compiled once at startup
+PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles.json")
+
+# Run a synthetic frame of every profile resolution through the detector before serving
+APP_WARMUP = True
+
 # Logger object
 #module_logger = Logger(LOG_PATH, "module.py")
 
@@ -68,45 +186,149 @@ AUTHENTICATION_TOKENS = {
 }
 
 
-def get_lineno():
-    """Gets the current call line number.
+def new_id():
+    """Generate a collision-free request id.
+    The id starts with the request timestamp, so localstore directories keep their time order.
 
     Returns:
-        integer: line number.
+        string: request id.
     """
-    cf = currentframe()
-    return cf.f_back.f_lineno
+    return "{0}_{1}".format(int(time.time()), uuid.uuid4().hex[:16])
 
 
-def get_path(id):
+def get_shard(id):
+    """Obtain the localstore shard directory of a request id.
+    Ids starting with a timestamp are sharded by UTC date and hour (YYYY/MM/DD/HH), so no directory grows
+    without bound. Other ids go to a "misc/xx" shard chosen by their hash.
+
+    Args:
+        id (string): frame request id.
+
+    Returns:
+        string: shard directory, relative to STORE_PATH.
+    """
+    prefix = id.split("_", 1)[0]
+    if prefix.isdigit():
+        try:
+            return time.strftime("%Y/%m/%d/%H", time.gmtime(int(prefix)))
+        except (OverflowError, OSError, ValueError):
+            pass
+
+    return "misc/" + hashlib.blake2b(id.encode("utf-8"), digest_size=1).hexdigest()
+
+
+def get_path(id, store_path=STORE_PATH):
     """Create id image path.
 
     Args:
-        id (string): frame request timestamp.
+        id (string): frame request id.
+        store_path (string, optional): localstore path. Defaults to STORE_PATH.
 
     Returns:
-        string: localstore path for specified id.
+        string: localstore path for specified id, within its shard.
     """
-    path = STORE_PATH + id + "/"
-    if not os.path.exists(path):
-        os.mkdir(path)
+    path = os.path.join(store_path, get_shard(id), id, "")
+    os.makedirs(path, exist_ok=True)
 
     return path
 
 
-def save_base64img(id, base64img, encoding="iso-8859-1"):
-    """Save base64 image into localstore.
+def read_stream(stream, length=None, max_length=FRAME_MAX_BYTES):
+    """Read an encoded image stream into a preallocated buffer, in FRAME_READ_SIZE chunks.
+
+    Args:
+        stream (file-like): binary stream, e.g. the request body or an uploaded file.
+        length (int, optional): stream length in bytes. Defaults to None, read until the end.
+        max_length (int, optional): maximum length in bytes. Defaults to FRAME_MAX_BYTES.
+
+    Raises:
+        ValueError: if the stream is empty, shorter than length or longer than max_length.
+
+    Returns:
+        memoryview: encoded image bytes.
+    """
+    if length is None and hasattr(stream, "seekable") and stream.seekable():
+        length = stream.seek(0, os.SEEK_END) - stream.seek(0)
+
+    if length is None:
+        buffer = bytearray()
+        for chunk in iter(lambda: stream.read(FRAME_READ_SIZE), b""):
+            buffer += chunk
+            if len(buffer) > max_length:
+                raise ValueError("too large image stream")
+        if not buffer:
+            raise ValueError("empty image stream")
+        return memoryview(buffer)
+
+    if not 0 < length <= max_length:
+        raise ValueError("empty or too large image stream")
+
+    # Only read() is portable, the WSGI input streams (e.g. Gunicorn or Werkzeug 1.0 request bodies) have no readinto()
+    buffer = memoryview(bytearray(length))
+    read = 0
+    while read < length:
+        chunk = stream.read(min(length - read, FRAME_READ_SIZE))
+        if not chunk:
+            raise ValueError("truncated image stream")
+        buffer[read:read + len(chunk)] = chunk
+        read += len(chunk)
+
+    return buffer
+
+
+def decode_image(buffer):
+    """Decode an encoded image buffer in memory, without touching the disk.
+
+    Args:
+        buffer (bytes-like): encoded image bytes (bytes, bytearray or memoryview).
+
+    Raises:
+        ValueError: if the buffer can't be decoded as an image.
+
+    Returns:
+        numpy.ndarray: decoded BGR image.
+    """
+    image = cv2.imdecode(np.frombuffer(memoryview(buffer), dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("invalid image buffer")
+
+    return image
+
+
+def encode_image(image, ext="jpg", width=None, quality=None):
+    """Encode an image to base64, optionally downscaled.
+
+    Args:
+        image (numpy.ndarray): cv2 image.
+        ext (string, optional): encoding format extension. Defaults to "jpg".
+        width (int, optional): maximum width, larger images are downscaled keeping the aspect ratio. Defaults to None.
+        quality (int, optional): JPEG quality between 0 and 100. Defaults to None, the OpenCV default.
+
+    Returns:
+        string: base64 encoded image.
+    """
+    height, image_width = image.shape[:2]
+    if width is not None and image_width > width:
+        image = cv2.resize(image, (width, max(1, height * width // image_width)), interpolation=cv2.INTER_AREA)
+
+    params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)] if quality is not None and ext.lower() in ("jpg", "jpeg") else []
+    _, buffer = cv2.imencode("." + ext, image, params)
+
+    return base64.b64encode(buffer).decode("utf-8")
+
+
+def save_original(id, buffer):
+    """Save the raw encoded image bytes into localstore.
 
     Args:
         id (string): Request id.
-        base64img (string): base64 image encoded.
-        encoding (string): base64 charset encoding.
+        buffer (bytes-like): encoded image bytes.
 
     Returns:
         string: image save path.
     """
     imgpath = get_path(id) + "original.jpg"
     with open(imgpath, "wb") as f:
-        f.write(base64.b64decode(base64img))
+        f.write(buffer)
 
     return imgpath
\ No newline at end of file
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__      = "Roger Truchero Visa"
+__copyright__   = "Copyright 2020"
+__credits__     = []
+__license__     = "GPL"
+__version__     = "1.0.0"
+__maintainer__  = "Roger Truchero Visa"
+__email__       = "truchero.roger@gmail.com"
+__status__      = "Development"
+
+
+from module import PROFILES_PATH, PYRAMID_SCALES, PYRAMID_COLORS, STORE_PATH, STORE_INDEX_PATH
+from CalibrationProfile import load_profiles
+from ColorDetector import ColorDetector
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import cv2
+import itertools
+import json
+import os
+import sys
+import time
+
+
+# Reprocessed image extensions
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# Images handed to a worker process at once
+CHUNK_SIZE = 16
+
+# Chunks submitted ahead per worker process, so the images are only read as fast as they are detected
+CHUNKS_AHEAD = 2
+
+# Worker process detector and detection arguments, see init_worker
+worker = {}
+
+
+def init_worker(colors, scale, profile, save, store_path):
+    """Initialize a worker process detector.
+    OpenCV runs single threaded in every worker, the parallelism comes from the processes.
+
+    Args:
+        colors (list): colors to detect.
+        scale (int): fast mode downscale factor.
+        profile (string): calibration profile name, None for the profile of every image camera.
+        save (boolean): save the localstore artifacts.
+        store_path (string): localstore path of the saved artifacts.
+    """
+    cv2.setNumThreads(1)
+    worker["detector"] = ColorDetector(store_path=store_path)
+    worker["colors"] = colors
+    worker["profile"] = profile
+    worker["options"] = { "image_mode" : "none", "save" : save, "scale" : scale }
+
+
+def detect(item):
+    """Detect the empty holes of an image, in a worker process.
+
+    Args:
+        item (tuple): (key, image path, id, camera id) to reprocess.
+
+    Returns:
+        dictionary: key, empty holes by color and error, None if the image was detected.
+    """
+    key, path, id, camera_id = item
+    try:
+        profile = worker["detector"].get_profile(worker["profile"], camera_id)
+        response = worker["detector"].identify_colors_contours(id, path, worker["colors"], profile=profile, **worker["options"])
+        return { "key" : key, "empty_holes" : response["empty_holes"], "error" : None }
+    except Exception as e:
+        return { "key" : key, "empty_holes" : None, "error" : str(e) }
+
+
+def detect_chunk(items):
+    """Detect the empty holes of some images, in a worker process.
+
+    Args:
+        items (list): (key, image path, id, camera id) items to reprocess.
+
+    Returns:
+        list: detect results, in the same order.
+    """
+    return [detect(item) for item in items]
+
+
+def walk_directory(directory):
+    """Find the images of a directory and its subdirectories.
+
+    Args:
+        directory (string): images directory.
+
+    Returns:
+        generator: (key, image path, id, camera id) items sorted by path, the key is the path relative to the directory
+            and there is no camera id.
+    """
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        for name in sorted(names):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, name)
+                key = os.path.relpath(path, directory)
+                yield key, path, "reprocess_" + os.path.splitext(key)[0].replace(os.sep, "_"), None
+
+
+def walk_index(index_path, store_path, kind, camera_id=None, since=None, until=None):
+    """Find the stored images of the localstore index.
+
+    Args:
+        index_path (string): SQLite index path.
+        store_path (string): localstore path.
+        kind (string): stored image to reprocess, e.g. "original".
+        camera_id (string, optional): camera id. Defaults to None, any camera.
+        since (float, optional): minimum timestamp. Defaults to None.
+        until (float, optional): maximum timestamp. Defaults to None.
+
+    Returns:
+        generator: (key, image path, id, camera id) items, oldest first. The key is the request id and the id is
+            "reprocess_<request id>", so the saved artifacts never overwrite the stored ones.
+    """
+    from ArtifactStore import ArtifactStore
+
+    store = ArtifactStore(store_path, index_path, start=False)
+    last = None
+    while True:
+        # Page through the index by timestamp, oldest first
+        conditions, parameters = ["json_extract(files, ?) IS NOT NULL"], ["$." + kind]
+        for condition, value in (("camera_id = ?", camera_id), ("timestamp >= ?", since), ("timestamp <= ?", until), ("(timestamp, id) > (?, ?)", last)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.extend(value if isinstance(value, tuple) else (value,))
+        rows = store.execute("SELECT id, timestamp, path, json_extract(files, ?), camera_id FROM artifacts WHERE {0} ORDER BY timestamp, id LIMIT 1000".format(" AND ".join(conditions)), tuple(["$." + kind] + parameters))
+        if not rows:
+            return
+
+        for id, timestamp, path, name, camera_id in rows:
+            yield id, os.path.join(store_path, path, name), "reprocess_" + id, camera_id
+        last = (rows[-1][1], rows[-1][0])
+
+
+def read_done(output, format):
+    """Read the keys and colors already written to an output file, to resume an interrupted run.
+    A partially written last line is removed.
+
+    Args:
+        output (string): output file path.
+        format (string): "csv" or "jsonl".
+
+    Returns:
+        tuple: written keys set and colors list, the csv header ones or those of the first detected jsonl image.
+            The colors are None when nothing tells them yet: no output, or no csv header or detected jsonl image.
+    """
+    if not os.path.exists(output):
+        return set(), None
+
+    with open(output, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+
+    with open(output, newline="") as f:
+        if format == "csv":
+            reader = csv.DictReader(f)
+            done = { row["key"] for row in reader }
+            return done, reader.fieldnames[1:-1] if reader.fieldnames else None
+
+        done, colors = set(), None
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                done.add(result["key"])
+                if colors is None and result["empty_holes"] is not None:
+                    colors = list(result["empty_holes"])
+        return done, colors
+
+
+def main():
+    """Reprocess the images of a directory or of the localstore index, writing a result per image as soon as it is ready.
+
+    Returns:
+        int: process exit code.
+    """
+    parser = argparse.ArgumentParser(description="Reprocess stored frames on all the cores, streaming the results to csv or jsonl.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--directory", help="images directory, walked recursively")
+    source.add_argument("--index", action="store_true", help="localstore index requests")
+    parser.add_argument("--output", required=True, help="results path, .csv or .jsonl")
+    parser.add_argument("--colors", default="green", help="comma separated colors to detect")
+    parser.add_argument("--scale", type=int, default=1, choices=sorted(PYRAMID_SCALES), help="fast mode downscale factor")
+    parser.add_argument("--profile", help="calibration profile name, defaults to the profile of every index request camera")
+    parser.add_argument("--save", action="store_true", help="also write the localstore artifacts")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--kind", default="original", help="stored image reprocessed from the index")
+    parser.add_argument("--camera-id", help="only reprocess this camera requests from the index")
+    parser.add_argument("--since", type=float, help="only reprocess the index requests since this timestamp")
+    parser.add_argument("--until", type=float, help="only reprocess the index requests until this timestamp")
+    parser.add_argument("--store-path", default=STORE_PATH, help="localstore path")
+    parser.add_argument("--index-path", default=STORE_INDEX_PATH, help="localstore index path")
+    parser.add_argument("--no-resume", action="store_true", help="overwrite the output instead of resuming it")
+    args = parser.parse_args()
+
+    format = "csv" if args.output.lower().endswith(".csv") else "jsonl"
+    colors = args.colors.split(",")
+    profiles, _ = load_profiles(PROFILES_PATH)
+    profile = profiles.get(args.profile or "default")
+    if profile is None or any(color not in profile.colors for color in colors):
+        parser.error("unknown profile or colors")
+    if args.scale > 1 and any(color not in PYRAMID_COLORS for color in colors):
+        parser.error("fast mode scales are {0} and only apply to the {1} colors".format(sorted(PYRAMID_SCALES), sorted(PYRAMID_COLORS)))
+    if args.no_resume and os.path.exists(args.output):
+        os.remove(args.output)
+    done, written = read_done(args.output, format)
+    if written is not None and sorted(written) != sorted(colors):
+        parser.error("the output {0} has the {1} colors, resume it with the same --colors or use --no-resume".format(args.output, ",".join(written)))
+
+    if args.directory:
+        items = walk_directory(args.directory)
+    else:
+        items = walk_index(args.index_path, args.store_path, args.kind, args.camera_id, args.since, args.until)
+        first = next(items, None)
+        if first is None:
+            # Nothing to reprocess is a misconfiguration, e.g. the originals are only stored with SAVE_ORIGINAL
+            hint = " (the originals are only stored when SAVE_ORIGINAL is enabled)" if args.kind == "original" else ""
+            parser.exit(1, "{0}: error: no {1} images in the index {2} for the given filters{3}\n".format(parser.prog, args.kind, args.index_path, hint))
+        items = itertools.chain([first], items)
+    items = (item for item in items if item[0] not in done)
+
+    start = time.perf_counter()
+    counts = { "skipped" : len(done), "processed" : 0, "errors" : 0 }
+    fields = ["key"] + (written or colors) + ["error"] # A resumed csv keeps its columns order
+    chunks = iter(lambda: list(itertools.islice(items, CHUNK_SIZE)), [])
+    with open(args.output, "a", newline="") as f, ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=(colors, args.scale, args.profile, args.save, args.store_path)) as executor:
+        writer = csv.DictWriter(f, fields) if format == "csv" else None
+        if writer is not None and written is None:
+            writer.writeheader()
+
+        # Keep a bounded number of chunks in flight, the results are written in the items order
+        futures = deque()
+        while True:
+            for chunk in itertools.islice(chunks, args.workers * CHUNKS_AHEAD - len(futures)):
+                futures.append(executor.submit(detect_chunk, chunk))
+            if not futures:
+                break
+
+            for result in futures.popleft().result():
+                if format == "csv":
+                    writer.writerow(dict(result["empty_holes"] or {}, key=result["key"], error=result["error"] or ""))
+                else:
+                    f.write(json.dumps(result) + "\n")
+                f.flush() # Every written result survives an interruption
+                counts["processed"] += 1
+                counts["errors"] += result["error"] is not None
+
+    counts["seconds"] = time.perf_counter() - start
+    counts["fps"] = counts["processed"] / counts["seconds"] if counts["seconds"] > 0 else None
+    print(json.dumps(counts), file=sys.stderr)
+
+    return 1 if counts["errors"] else 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
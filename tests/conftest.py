@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+
+# Repository root, the classes are imported by their bare module name as the scripts do
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(ROOT_PATH, "scripts", "classes"))
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_configure(config):
+    """Point COLORDETECTOR_MAIN_PATH at a temporary directory with its logs and localstore, before the test
+    modules import module, so the tests never depend on nor write into the deployment paths.
+    The directory comes from the session tmp_path_factory, set up by pytest before this hook.
+
+    Args:
+        config (pytest.Config): pytest configuration.
+    """
+    main_path = config._tmp_path_factory.mktemp("colordetector")
+    for directory in ("logs", "localstore"):
+        (main_path / directory).mkdir()
+    os.environ["COLORDETECTOR_MAIN_PATH"] = str(main_path)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
+import time
+
+from AlertDispatcher import AlertDispatcher, FileSink, WebhookSink
+from HoleTracker import HoleTracker
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Record the posted alerts batches with their arrival time."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.batches.append((time.monotonic(), json.loads(body)["alerts"]))
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FailingWebhookHandler(WebhookHandler):
+    """Fail the first server.failures posts, as a webhook outage, then record them."""
+
+    def do_POST(self):
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(503)
+            self.end_headers()
+            return
+        super().do_POST()
+
+
+def get_tracking(empty_holes, previous=0):
+    """Build a single color HoleTracker result.
+
+    Args:
+        empty_holes (int): confirmed empty holes.
+        previous (int, optional): previous confirmed empty holes. Defaults to 0.
+
+    Returns:
+        dictionary: color to tracking result.
+    """
+    return { "green" : { "empty_holes" : empty_holes, "appeared" : max(empty_holes - previous, 0), "cleared" : max(previous - empty_holes, 0) } }
+
+
+def test_webhook_batches_and_interval():
+    """The alerts are posted in batches of up to batch_size, at most once per interval, merged by camera and color."""
+    server = HTTPServer(("127.0.0.1", 0), WebhookHandler)
+    server.batches = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    interval = 0.5
+    alerts = AlertDispatcher([WebhookSink("http://127.0.0.1:{0}/".format(server.server_port))], batch_size=2, interval=interval)
+    try:
+        alerts.update("camera_1", get_tracking(1)) # Nothing sent yet, posted right away
+        time.sleep(0.1)
+        alerts.update("camera_2", get_tracking(1))
+        alerts.update("camera_2", get_tracking(3, 1)) # Merged with the pending camera_2 alert
+        alerts.update("camera_3", get_tracking(1))
+        alerts.update("camera_4", get_tracking(2))
+        alerts.update("camera_4", get_tracking(2)) # Same count, not raised
+        deadline = time.monotonic() + 5
+        while len(server.batches) < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        alerts.stop()
+        server.shutdown()
+
+    assert [[alert["camera_id"] for alert in batch] for _, batch in server.batches] == [["camera_1"], ["camera_2", "camera_3"], ["camera_4"]]
+    times = [sent for sent, _ in server.batches]
+    assert all(later - earlier >= interval * 0.95 for earlier, later in zip(times, times[1:]))
+    merged = server.batches[1][1][0]
+    assert (merged["previous"], merged["empty_holes"], merged["event"], merged["appeared"]) == (0, 3, "out_of_stock", 3)
+    assert alerts.stats()["merged"] == 1 and alerts.stats()["sent"] == 4
+
+
+def test_evicted_cameras_are_forgotten(tmp_path):
+    """A camera evicted by the tracker starts again from no empty holes, so its next holes are notified."""
+    path = str(tmp_path / "alerts.jsonl")
+    alerts = AlertDispatcher([FileSink(path)], interval=0)
+    tracker = HoleTracker(min_frames=1, max_cameras=1, on_evict=alerts.forget)
+    hole = { "green" : [(0, 0, 10, 10)] }
+    assert alerts.update("camera_1", tracker.update("camera_1", hole, now=0)) == 1
+    tracker.update("camera_2", { "green" : [] }, now=1) # camera_1 is evicted
+    assert ("camera_1", "green") not in alerts.states
+    assert alerts.update("camera_1", tracker.update("camera_1", hole, now=2)) == 1
+    alerts.stop()
+    with open(path) as f:
+        assert [json.loads(line)["event"] for line in f] == ["out_of_stock", "out_of_stock"]
+
+
+def test_dropped_alerts_are_raised_again(tmp_path):
+    """An alert dropped because the queue is full doesn't move the notified count, the next frame raises it again."""
+    alerts = AlertDispatcher([FileSink(str(tmp_path / "alerts.jsonl"))], maxsize=1, interval=3600)
+    alerts.stop() # Nothing drains the queue anymore
+    assert alerts.update("camera_1", get_tracking(1)) == 1
+    assert alerts.update("camera_2", get_tracking(2)) == 0 # Queue full, dropped
+    assert ("camera_2", "green") not in alerts.states and alerts.stats()["dropped"] == 1
+
+    alerts.queue.get_nowait()
+    assert alerts.update("camera_2", { "green" : { "empty_holes" : 2, "appeared" : 0, "cleared" : 0 } }) == 1
+    assert alerts.states[("camera_2", "green")] == 2
+
+
+def test_failed_batches_are_retried(tmp_path):
+    """A batch the webhook fails to receive is retried with backoff, only to the failed sink, before the newer alerts."""
+    server = HTTPServer(("127.0.0.1", 0), FailingWebhookHandler)
+    server.batches = []
+    server.failures = 2
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    path = str(tmp_path / "alerts.jsonl")
+    alerts = AlertDispatcher([WebhookSink("http://127.0.0.1:{0}/".format(server.server_port)), FileSink(path)], interval=0, retry_delay=0.2)
+    try:
+        alerts.update("camera_1", get_tracking(1))
+        time.sleep(0.1) # camera_1 failed once, camera_2 waits for its retry
+        alerts.update("camera_2", get_tracking(2))
+        deadline = time.monotonic() + 5
+        while len(server.batches) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        alerts.stop()
+        server.shutdown()
+
+    assert [[alert["camera_id"] for alert in batch] for _, batch in server.batches] == [["camera_1"], ["camera_2"]]
+    with open(path) as f:
+        assert [json.loads(line)["camera_id"] for line in f] == ["camera_1", "camera_2"] # Not sent again to the file
+    stats = alerts.stats()
+    assert (stats["sent"], stats["errors"], stats["retries"]) == (2, 2, 2)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+
+import numpy as np
+
+from module import STORE_PATH, get_shard
+from ArtifactStore import ArtifactStore
+from ArtifactWriter import ArtifactWriter
+
+
+def get_totals(index_path):
+    """Count the index requests and bytes with a full scan.
+
+    Args:
+        index_path (string): SQLite index path.
+
+    Returns:
+        dictionary: requests and bytes.
+    """
+    with sqlite3.connect(index_path) as connection:
+        requests, size = connection.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM artifacts").fetchone()
+    return { "requests" : requests, "bytes" : size }
+
+
+def test_running_totals(tmp_path):
+    """The stats running totals follow the inserts, updates and removals, also of an index created without them."""
+    index_path = str(tmp_path / "index.db")
+    store = ArtifactStore(str(tmp_path), index_path, ttl=100, max_bytes=250, start=False)
+    store.add_files("1_a", { "frame" : "frame.jpg" }, 100, now=1)
+    store.record("1_a", "camera", 2, now=1)
+    store.record("2_b", None, { "green" : 0 }, now=2)
+    store.add_files("2_b", { "mask" : "mask.jpg" }, 50)
+    store.add_files("2_b", { "frame" : "frame.jpg" }, 120)
+    assert store.stats() == get_totals(index_path) == { "requests" : 2, "bytes" : 270 }
+
+    store.prune(now=50) # Over max_bytes, the oldest request is removed
+    assert store.stats() == get_totals(index_path) == { "requests" : 1, "bytes" : 170 }
+
+    with sqlite3.connect(index_path) as connection:
+        connection.executescript("DROP TRIGGER artifacts_insert; DROP TRIGGER artifacts_update; DROP TRIGGER artifacts_delete; DROP TABLE totals;")
+    store = ArtifactStore(str(tmp_path), index_path, start=False)
+    assert store.stats() == { "requests" : 1, "bytes" : 170 }
+
+
+def test_writer_records_results(tmp_path):
+    """The detection results are indexed from the writer thread."""
+    store = ArtifactStore(str(tmp_path), str(tmp_path / "index.db"), start=False)
+    writer = ArtifactWriter(store=store)
+    assert writer.record("1_a", "camera", { "green" : 3 })
+    writer.join()
+    assert store.get("1_a")["empty_holes"] == { "green" : 3 } and writer.stats()["recorded"] == 1
+    writer.stop()
+    assert not ArtifactWriter().record("1_b", None, 0)
+
+
+def test_writer_links_cached_artifacts(tmp_path):
+    """A duplicated frame request gets hard links to the written artifacts of the first request, and only to them."""
+    store = ArtifactStore(str(tmp_path), str(tmp_path / "index.db"), start=False)
+    writer = ArtifactWriter(store=store)
+    image = np.zeros((8, 8, 3), dtype=np.uint8)
+    assert writer.submit("1_a", { "frame" : image, "mask" : image[:, :, 0] })
+    assert writer.link("1_b", "1_a") and writer.link("1_c", "1_missing")
+    writer.join()
+
+    assert store.get("1_b")["files"] == { "frame" : "frame.jpg", "mask" : "mask.jpg" }
+    assert os.path.samefile(os.path.join(STORE_PATH, get_shard("1_a"), "1_a", "frame.jpg"), os.path.join(STORE_PATH, get_shard("1_b"), "1_b", "frame.jpg"))
+    assert store.get("1_c") is None and writer.stats()["linked"] == 2
+    writer.stop()
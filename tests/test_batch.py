@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import base64
+import glob
+import os
+
+import cv2
+import pytest
+
+from conftest import ROOT_PATH
+from module import AUTHENTICATION_TOKENS, IMAGE_NONE, REQUEST_OK, ERROR_INVALID_REQUEST, ERROR_INVALID_CONTENT
+from ColorDetector import ColorDetector
+import app
+
+
+PATHS = sorted(glob.glob(os.path.join(ROOT_PATH, "dataset", "*.jpg")))[:4]
+
+
+@pytest.fixture(scope="module")
+def client():
+    """Flask test client of the application, without the warm up.
+
+    Returns:
+        flask.testing.FlaskClient: test client.
+    """
+    return app.create_app({ "WARMUP" : False }).test_client()
+
+
+@pytest.fixture(scope="module")
+def frames():
+    """Base64 encode the dataset frames and detect their blue empty holes one by one.
+
+    Returns:
+        list: (base64 frame, blue empty holes) pairs.
+    """
+    detector = ColorDetector()
+    frames = []
+    for path in PATHS:
+        with open(path, "rb") as f:
+            frame = base64.b64encode(f.read()).decode()
+        empty_holes = detector.identify_colors_contours("batch", cv2.imread(path), ["blue"], image_mode=IMAGE_NONE, save=False)["empty_holes"]
+        frames.append((frame, empty_holes))
+    return frames
+
+
+def post_batch(client, body):
+    """Post a batch request.
+
+    Returns:
+        dictionary: json response.
+    """
+    headers = { "Authorization" : "Bearer {0}".format(next(iter(AUTHENTICATION_TOKENS))) }
+    return client.post("/detect/batch", json=dict(body, image=IMAGE_NONE, colors=["blue"]), headers=headers).get_json()
+
+
+def test_results_keep_the_frames_order(client, frames):
+    """Every frame result is in the position of its frame, whatever frame finishes first."""
+    body = { "frames" : [{ "id" : "frame_{0}".format(index), "frame" : frame } for index, (frame, _) in enumerate(frames)] }
+    response = post_batch(client, body)
+    assert response["code"] == REQUEST_OK
+    results = response["attributes"]["results"]
+    assert [result["id"] for result in results] == ["frame_{0}".format(index) for index in range(len(frames))]
+    assert [result["attributes"]["empty_holes"] for result in results] == [empty_holes for _, empty_holes in frames]
+
+
+def test_invalid_frames_only_fail_themselves(client, frames):
+    """Invalid frames and non object entries get their own error result, the valid frames are still detected."""
+    frame, empty_holes = frames[0]
+    body = { "frames" : [
+        { "id" : "valid", "frame" : frame },
+        { "id" : "not_an_image", "frame" : base64.b64encode(b"not an image").decode() },
+        { "id" : "missing_frame" },
+        { "frame" : frame }, # Missing id
+        "frame",
+        42,
+        None,
+        [frame],
+        { "id" : "valid_again", "frame" : frame },
+    ] }
+    response = post_batch(client, body)
+    assert response["code"] == REQUEST_OK
+    results = response["attributes"]["results"]
+    assert [(result["id"], result["code"]) for result in results] == [
+        ("valid", REQUEST_OK),
+        ("not_an_image", ERROR_INVALID_CONTENT),
+        ("missing_frame", ERROR_INVALID_REQUEST),
+        (None, ERROR_INVALID_REQUEST),
+        (None, ERROR_INVALID_REQUEST),
+        (None, ERROR_INVALID_REQUEST),
+        (None, ERROR_INVALID_REQUEST),
+        (None, ERROR_INVALID_REQUEST),
+        ("valid_again", REQUEST_OK),
+    ]
+    assert results[0]["attributes"]["empty_holes"] == results[-1]["attributes"]["empty_holes"] == empty_holes
+    assert all("attributes" not in result for result in results[1:-1])
+
+
+def test_frames_are_tracked_with_the_request_camera(client, frames):
+    """Frames without their own camera_id are tracked as the request camera_id, the others as their own."""
+    frame, _ = frames[0]
+    body = { "camera_id" : "batch_camera", "frames" : [{ "id" : "request_camera", "frame" : frame }, { "id" : "own_camera", "frame" : frame, "camera_id" : "batch_own" }] }
+    results = post_batch(client, body)["attributes"]["results"]
+    assert all("tracking" in result["attributes"] for result in results)
+    assert ("batch_camera", "blue") in app.tracker.cameras and ("batch_own", "blue") in app.tracker.cameras
+
+    # Without any camera_id nothing is tracked
+    results = post_batch(client, { "frames" : [{ "id" : "no_camera", "frame" : frame }] })["attributes"]["results"]
+    assert "tracking" not in results[0]["attributes"]
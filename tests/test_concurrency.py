@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import os
+
+import cv2
+
+from conftest import ROOT_PATH
+from ColorDetector import ColorDetector
+
+
+# More frame sizes than cached regions of interest, so the cache also evicts under contention
+SIZES = [(1080, 1920), (720, 1280), (540, 960), (1200, 1600), (900, 1600), (768, 1024), (600, 800), (480, 854), (1440, 2560), (360, 640)]
+COLORS = ["green", "blue"]
+
+
+def load_frames():
+    """Read some dataset frames resized to every test size.
+
+    Returns:
+        list: (frame, color) items.
+    """
+    paths = sorted(glob.glob(os.path.join(ROOT_PATH, "dataset", "*.jpg")))[:4] + [os.path.join(ROOT_PATH, "images", "tests", "green_noise2.jpg")]
+    frames = []
+    for index, path in enumerate(paths):
+        image = cv2.imread(path)
+        for height, width in SIZES:
+            frames.append((cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA), COLORS[index % len(COLORS)]))
+
+    return frames
+
+
+def test_shared_detector_mixed_resolutions():
+    """A detector shared by many threads detecting frames of mixed sizes gets the single threaded counts."""
+    detector = ColorDetector()
+    frames = load_frames()
+    expected = [detector.identify_color_contours("stress_{0}".format(index), frame.copy(), color, save=False, image_mode="none")["empty_holes"] for index, (frame, color) in enumerate(frames)]
+
+    items = list(enumerate(frames)) * 3
+    def detect(item):
+        index, (frame, color) = item
+        return detector.identify_color_contours("stress_{0}".format(index), frame.copy(), color, save=False, image_mode="none")["empty_holes"]
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(detect, items))
+
+    assert results == expected * 3
+    assert any(expected)
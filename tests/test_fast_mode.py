@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+
+import cv2
+
+from conftest import ROOT_PATH
+from module import PYRAMID_SCALES
+from ColorDetector import ColorDetector
+
+
+# Frame sizes that aren't a multiple of the downscale factors, so the masks are padded
+SIZES = [(1080, 1920), (721, 1279), (563, 997)]
+
+
+def test_fast_mode_matches_full_resolution():
+    """Every fast mode scale finds the full resolution empty holes, for a single color and for all the colors at once."""
+    detector = ColorDetector()
+    options = { "image_mode" : "none", "save" : False }
+    for path in sorted(glob.glob(os.path.join(ROOT_PATH, "dataset", "*.jpg")))[:8]:
+        image = cv2.imread(path)
+        for height, width in SIZES:
+            frame = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+            expected = detector.identify_colors_contours("fast", frame.copy(), **options)["empty_holes"]
+            for scale in sorted(PYRAMID_SCALES):
+                assert detector.identify_colors_contours("fast", frame.copy(), scale=scale, **options)["empty_holes"] == expected
+                for color, empty_holes in expected.items():
+                    assert detector.identify_color_contours("fast", frame.copy(), color, ext="jpg", scale=scale, **options)["empty_holes"] == empty_holes
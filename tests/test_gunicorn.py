@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import ROOT_PATH
+from module import AUTHENTICATION_TOKENS
+from ColorDetector import ColorDetector
+
+
+pytest.importorskip("gunicorn")
+
+IMAGE_PATH = os.path.join(ROOT_PATH, "images", "tests", "green_noise2.jpg")
+
+
+def get_free_port():
+    """Obtain a free localhost port.
+
+    Returns:
+        int: port number.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers):
+    """Start the shipped Gunicorn configuration on a free localhost port.
+
+    Args:
+        workers (int): worker processes.
+
+    Returns:
+        tuple: (server process, base url).
+    """
+    port = get_free_port()
+    env = dict(os.environ, COLORDETECTOR_WARMUP="0", WEB_CONCURRENCY=str(workers))
+    env.pop("COLORDETECTOR_METRICS_DIR", None)
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", "127.0.0.1:{0}".format(port)],
+                              cwd=os.path.join(ROOT_PATH, "scripts", "classes"), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return server, "http://127.0.0.1:{0}".format(port)
+
+
+def open_json(server, url, body=None, content_type=None):
+    """Send a request to the server, waiting up to a minute for it to start.
+
+    Args:
+        server (subprocess.Popen): server process.
+        url (string): request url.
+        body (bytes, optional): POST body. Defaults to None, a GET request.
+        content_type (string, optional): body content type. Defaults to None.
+
+    Returns:
+        dictionary: json response.
+    """
+    headers = { "Authorization" : "Bearer {0}".format(next(iter(AUTHENTICATION_TOKENS))) }
+    if content_type is not None:
+        headers["Content-Type"] = content_type
+    request = urllib.request.Request(url, data=body, method="POST" if body is not None else "GET", headers=headers)
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return json.loads(response.read())
+        except urllib.error.URLError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def test_raw_body_upload_under_gunicorn():
+    """A raw image body is read from the Gunicorn request stream, which has no readinto()."""
+    server, url = start_server(1)
+    try:
+        with open(IMAGE_PATH, "rb") as f:
+            content = open_json(server, url + "/detect?image=none", f.read(), "image/jpeg")
+
+        expected = ColorDetector().identify_color_contours("gunicorn", IMAGE_PATH, save=False, image_mode="none")["empty_holes"]
+        assert content["code"] == "200" and content["attributes"]["empty_holes"] == expected
+    finally:
+        server.terminate()
+        server.wait(30)
+
+
+def test_jobs_polled_from_every_worker():
+    """With several workers an asynchronous job is fetched whichever worker answers the poll."""
+    server, url = start_server(4)
+    try:
+        with open(IMAGE_PATH, "rb") as f:
+            body = f.read()
+        ids = [open_json(server, url + "/detect/async?image=none", body, "image/jpeg")["id"] for _ in range(3)]
+        polls = [open_json(server, url + "/jobs/{0}?wait=10".format(id)) for id in ids for _ in range(4)]
+        assert [poll["code"] for poll in polls] == ["200"] * 12
+        assert all(poll["attributes"]["state"] == "done" for poll in polls)
+    finally:
+        server.terminate()
+        server.wait(30)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from HoleTracker import CameraTracks, HoleTracker
+
+
+HOLE = (100, 100, 50, 50)
+OTHER = (300, 100, 50, 50)
+THIRD = (500, 100, 50, 50)
+
+
+def get_tracks(window=8, min_frames=3, min_seconds=3600.0, iou=0.3, max_holes=64):
+    """Build a CameraTracks that only confirms and clears by frames unless min_seconds is given.
+
+    Returns:
+        CameraTracks: empty tracks.
+    """
+    return CameraTracks(window, min_frames, min_seconds, iou, max_holes)
+
+
+def run(tracks, frames, start=0):
+    """Update the tracks with a frame per second.
+
+    Args:
+        tracks (CameraTracks): tracks to update.
+        frames (list): list of boxes lists.
+        start (int, optional): first frame timestamp. Defaults to 0.
+
+    Returns:
+        list: CameraTracks.update results.
+    """
+    return [tracks.update(boxes, now) for now, boxes in enumerate(frames, start)]
+
+
+def test_confirmed_after_min_frames():
+    """A hole is pending until it is seen in min_frames frames, and only then appears."""
+    results = run(get_tracks(), [[HOLE], [HOLE], [HOLE], [HOLE]])
+    assert [result["empty_holes"] for result in results] == [0, 0, 1, 1]
+    assert [result["appeared"] for result in results] == [0, 0, 1, 0]
+    assert [result["pending"] for result in results] == [1, 1, 0, 0]
+
+
+def test_confirmed_after_min_seconds():
+    """A hole seen in two frames min_seconds apart is confirmed before min_frames frames."""
+    tracks = get_tracks(min_frames=10, min_seconds=30.0)
+    assert tracks.update([HOLE], 0)["empty_holes"] == 0
+    assert tracks.update([HOLE], 10)["empty_holes"] == 0
+    assert tracks.update([HOLE], 31)["appeared"] == 1
+
+    # A single frame is never enough, whatever the time
+    tracks = get_tracks(min_frames=10, min_seconds=30.0)
+    assert tracks.update([HOLE], 100)["empty_holes"] == 0
+
+
+def test_single_occluded_frame_changes_nothing():
+    """A single frame without the hole doesn't clear a confirmed hole, nor reset the count of a pending one."""
+    results = run(get_tracks(), [[HOLE], [HOLE], [HOLE], [], [HOLE], [], [HOLE]])
+    assert [result["empty_holes"] for result in results] == [0, 0, 1, 1, 1, 1, 1]
+    assert sum(result["cleared"] for result in results) == 0
+    assert results[3]["pending"] == 1 # Confirmed but missed, may still clear
+
+    # Seen, occluded, seen again: the occluded frame neither confirms it nor forgets the hits
+    results = run(get_tracks(), [[HOLE], [], [HOLE], [HOLE]])
+    assert [result["empty_holes"] for result in results] == [0, 0, 0, 1]
+
+    # A single reflective frame with a hole is never confirmed and is forgotten once missed min_frames frames
+    tracks = get_tracks()
+    results = run(tracks, [[HOLE], [], [], []])
+    assert [result["empty_holes"] for result in results] == [0, 0, 0, 0]
+    assert results[-1]["pending"] == 0 and not tracks.used.any()
+
+
+def test_cleared_after_min_frames_missed():
+    """A confirmed hole is cleared once it is missed in min_frames consecutive frames."""
+    results = run(get_tracks(), [[HOLE], [HOLE], [HOLE], [], [], []])
+    assert [result["empty_holes"] for result in results] == [0, 0, 1, 1, 1, 0]
+    assert [result["cleared"] for result in results] == [0, 0, 0, 0, 0, 1]
+
+
+def test_jittered_boxes_follow_the_track():
+    """A hole whose rectangle jitters between frames is matched with its track by intersection over union."""
+    tracks = get_tracks()
+    jittered = [(100, 100, 50, 50), (106, 97, 52, 50), (111, 104, 48, 53), (104, 99, 50, 50)]
+    results = run(tracks, [[box] for box in jittered])
+    assert [result["empty_holes"] for result in results] == [0, 0, 1, 1]
+    assert tracks.used.sum() == 1
+    assert tuple(tracks.boxes[tracks.used][0]) == jittered[-1] # The track follows the last rectangle
+
+    # Two holes swapping their order in the list keep their own tracks, a far away box starts a new one
+    tracks = get_tracks()
+    results = run(tracks, [[HOLE, OTHER], [OTHER, HOLE], [(103, 102, 50, 50), (297, 98, 50, 50)], [THIRD]])
+    assert [result["empty_holes"] for result in results] == [0, 0, 2, 2]
+    assert tracks.used.sum() == 3
+
+
+def test_max_holes_saturation():
+    """Holes beyond max_holes are ignored until a slot is freed."""
+    tracks = get_tracks(max_holes=2)
+    results = run(tracks, [[HOLE, OTHER, THIRD]] * 3)
+    assert results[-1]["empty_holes"] == 2 and results[-1]["pending"] == 0
+    assert tracks.used.all()
+
+    # HOLE and OTHER are cleared at the third missed frame, THIRD takes a slot at the next one
+    results = run(tracks, [[THIRD]] * 6, start=3)
+    assert [result["empty_holes"] for result in results] == [2, 2, 0, 0, 0, 1]
+    assert [result["cleared"] for result in results] == [0, 0, 2, 0, 0, 0]
+    assert tracks.used.sum() == 1
+
+
+def test_least_recently_updated_cameras_are_evicted():
+    """Beyond max_cameras, the least recently updated camera color is evicted and on_evict called with it."""
+    evicted = []
+    tracker = HoleTracker(min_frames=1, max_cameras=2, on_evict=evicted.extend)
+    tracker.update("camera_1", { "green" : [HOLE] }, now=0)
+    tracker.update("camera_2", { "green" : [HOLE] }, now=1)
+    tracker.update("camera_1", { "green" : [HOLE] }, now=2) # camera_2 is now the least recently updated
+    tracker.update("camera_3", { "green" : [HOLE] }, now=3)
+    assert evicted == [("camera_2", "green")]
+    assert list(tracker.cameras) == [("camera_1", "green"), ("camera_3", "green")]
+
+    # An evicted camera starts again from no holes
+    tracker = HoleTracker(min_frames=3, max_cameras=1)
+    for now in range(3):
+        assert tracker.update("camera_1", { "green" : [HOLE] }, now=now)["green"]["empty_holes"] == (1 if now == 2 else 0)
+    tracker.update("camera_2", { "green" : [] }, now=3)
+    assert tracker.update("camera_1", { "green" : [HOLE] }, now=4)["green"]["empty_holes"] == 0
+
+
+def test_idle_cameras_are_evicted():
+    """A camera without frames for idle_seconds is evicted on the next update of any camera, and reset forgets all its colors."""
+    evicted = []
+    tracker = HoleTracker(idle_seconds=10, on_evict=evicted.extend)
+    tracker.update("camera_1", { "green" : [HOLE] }, now=0)
+    tracker.update("camera_2", { "green" : [HOLE], "red" : [] }, now=5)
+    assert evicted == []
+    tracker.update("camera_2", { "green" : [HOLE] }, now=12)
+    assert evicted == [("camera_1", "green")]
+
+    tracker.reset("camera_2")
+    assert evicted[1:] == [("camera_2", "red"), ("camera_2", "green")] and not tracker.cameras
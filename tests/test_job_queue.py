@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os
+import threading
+
+from ArtifactStore import ArtifactStore
+from JobQueue import JobQueue
+
+
+def test_finished_jobs_expire_behind_a_running_job():
+    """Jobs finished after an older running job still expire, by ttl and by results size."""
+    release = threading.Event()
+    jobs = JobQueue(2, 64, ttl=3600, max_results=100, max_bytes=1000)
+    jobs.submit("running", release.wait)
+    for index in range(20):
+        jobs.submit("job_{0}".format(index), lambda: { "base64image" : "x" * 300, "empty_holes" : 1 })
+    while jobs.stats()["done"] < 20:
+        jobs.get("job_19", wait=0.1)
+
+    stats = jobs.stats()
+    assert stats["bytes"] <= 1000 and stats["expired"] == 17
+    assert jobs.get("running")["state"] == "running" and jobs.get("job_19")["result"]["empty_holes"] == 1
+
+    jobs.ttl = 0
+    release.set()
+    jobs.join()
+    assert jobs.stats()["jobs"] == 0 and jobs.stats()["bytes"] == 0
+    jobs.stop()
+
+
+def run_jobs(index_path, submitted, release):
+    """Accept a job in another process and finish it once released."""
+    store = ArtifactStore(os.path.dirname(index_path), index_path, start=False)
+    jobs = JobQueue(1, 4, store=store)
+    jobs.submit("shared", lambda: { "base64image" : "", "empty_holes" : 3 })
+    jobs.submit("blocked", release.wait)
+    submitted.set()
+    jobs.join()
+    jobs.stop()
+
+
+def test_jobs_are_read_from_another_process(tmp_path):
+    """A job accepted by another process sharing the index is fetched, and long-polled, by this one."""
+    index_path = str(tmp_path / "index.db")
+    context = multiprocessing.get_context("spawn")
+    submitted, release = context.Event(), context.Event()
+    process = context.Process(target=run_jobs, args=(index_path, submitted, release))
+    process.start()
+    try:
+        assert submitted.wait(60)
+        jobs = JobQueue(1, 4, store=ArtifactStore(str(tmp_path), index_path, start=False), poll=0.01)
+        assert jobs.get("shared", wait=10)["result"] == { "base64image" : "", "empty_holes" : 3 }
+        assert jobs.get("blocked")["state"] in ("queued", "running") and jobs.get("unknown") is None
+
+        release.set()
+        job = jobs.get("blocked", wait=10)
+        assert job["state"] == "done" and job["finished"] is not None
+        jobs.stop()
+    finally:
+        release.set()
+        process.join(60)
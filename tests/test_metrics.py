@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os
+
+from Metrics import Metrics
+
+
+def create_metrics(directory, depth):
+    """Declare a counter, a histogram and a collected gauge.
+
+    Args:
+        directory (string): multiprocess mode shared directory.
+        depth (int): collected gauge value.
+
+    Returns:
+        Metrics: metrics object.
+    """
+    metrics = Metrics(directory=directory, interval=3600)
+    metrics.counter("requests_total", "Requests.")
+    metrics.histogram("request_seconds", "Latency.", (0.1, 1.0))
+    metrics.collect("queue_depth", "gauge", "Depth.", lambda: depth)
+    return metrics
+
+
+def run_worker(directory):
+    """Record some metrics in another process and exit, writing its last snapshot."""
+    metrics = create_metrics(directory, 5)
+    metrics.inc("requests_total", 2, code="200")
+    metrics.observe("request_seconds", 0.5)
+    metrics.stop()
+
+
+def test_multiprocess_metrics_add_up(tmp_path):
+    """Any process renders the counters and histograms of every process added up, and their collected values by worker."""
+    directory = str(tmp_path)
+    worker = multiprocessing.get_context("fork").Process(target=run_worker, args=(directory,))
+    worker.start()
+    worker.join()
+
+    metrics = create_metrics(directory, 1)
+    metrics.inc("requests_total", code="200")
+    metrics.observe("request_seconds", 0.05)
+    lines = metrics.render().splitlines()
+    assert 'colordetector_requests_total{code="200"} 3' in lines
+    assert 'colordetector_request_seconds_bucket{le="0.1"} 1' in lines and 'colordetector_request_seconds_count 2' in lines
+    assert 'colordetector_queue_depth{{worker="{0}"}} 5'.format(worker.pid) in lines
+    assert 'colordetector_queue_depth{{worker="{0}"}} 1'.format(os.getpid()) in lines
+
+    Metrics.mark_process_dead(directory, worker.pid)
+    lines = metrics.render().splitlines()
+    assert 'colordetector_requests_total{code="200"} 3' in lines
+    assert not any(line.startswith('colordetector_queue_depth{{worker="{0}"}}'.format(worker.pid)) for line in lines)
+    metrics.stop()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+
+import cv2
+
+from conftest import ROOT_PATH
+from module import PROFILES_PATH
+from CalibrationProfile import DEFAULT_PROFILE, CalibrationProfile, load_profiles
+from ColorDetector import ColorDetector
+
+
+def test_default_profile_has_a_single_source():
+    """The bundled profiles don't redefine the default profile, it is DEFAULT_PROFILE."""
+    profiles, cameras = load_profiles(PROFILES_PATH)
+    default = CalibrationProfile.from_dict("default", {})
+    assert (profiles["default"].colors, profiles["default"].min_area, profiles["default"].exclude) == (default.colors, DEFAULT_PROFILE["min_area"], default.exclude)
+    assert cameras["t485"] == "default"
+
+
+def test_720p_profile_scales_the_minimum_area():
+    """The 720p profile minimum area is the 1080p one scaled by the pixel area, so the downscaled frames find
+    fewer spurious or missing holes than with the 1080p minimum area."""
+    profiles, _ = load_profiles(PROFILES_PATH)
+    profile = profiles["t485_720p"]
+    assert profile.min_area == round(DEFAULT_PROFILE["min_area"] * (720 / 1080) ** 2)
+    assert profile.resolutions == [(720, 1280)]
+
+    unscaled = CalibrationProfile.from_dict("unscaled", { "resolutions" : [[720, 1280]] })
+    detector = ColorDetector(profiles=(profiles, {}))
+    options = { "image_mode" : "none", "save" : False }
+    errors = { profile.name : 0, unscaled.name : 0 }
+    for path in sorted(glob.glob(os.path.join(ROOT_PATH, "dataset", "*.jpg")))[:8]:
+        image = cv2.imread(path)
+        expected = detector.identify_colors_contours("profile", image.copy(), **options)["empty_holes"]
+        frame = cv2.resize(image, (1280, 720), interpolation=cv2.INTER_AREA)
+        for candidate in (profile, unscaled):
+            empty_holes = detector.identify_colors_contours("profile", frame.copy(), profile=candidate, **options)["empty_holes"]
+            errors[candidate.name] += sum(abs(empty_holes[color] - expected[color]) for color in expected)
+
+    assert errors[profile.name] < errors[unscaled.name]
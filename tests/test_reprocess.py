@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import csv
+import glob
+import os
+import shutil
+import sys
+
+import pytest
+
+from conftest import ROOT_PATH
+from module import get_shard
+import reprocess
+
+
+@pytest.fixture
+def images(tmp_path):
+    """Copy some dataset frames into an images directory.
+
+    Returns:
+        string: images directory.
+    """
+    directory = tmp_path / "images"
+    directory.mkdir()
+    for path in sorted(glob.glob(os.path.join(ROOT_PATH, "dataset", "*.jpg")))[:3]:
+        shutil.copy(path, str(directory))
+    return str(directory)
+
+
+def run(monkeypatch, *args):
+    """Run reprocess.py with a single worker process.
+
+    Returns:
+        int: process exit code.
+    """
+    monkeypatch.setattr(sys, "argv", ["reprocess.py", "--workers", "1"] + list(args))
+    return reprocess.main()
+
+
+def read_rows(output):
+    """Read the csv output rows, header included.
+
+    Returns:
+        list: rows.
+    """
+    with open(output, newline="") as f:
+        return list(csv.reader(f))
+
+
+def test_resume_after_header_only_csv(monkeypatch, tmp_path, images):
+    """A csv interrupted right after its header is resumed without a second header."""
+    output = str(tmp_path / "results.csv")
+    with open(output, "w") as f:
+        f.write("key,blue,green,error\r\n")
+    assert run(monkeypatch, "--directory", images, "--output", output, "--colors", "green,blue") == 0
+
+    rows = read_rows(output)
+    assert rows[0] == ["key", "blue", "green", "error"] and len(rows) == 4 # The existing columns order is kept
+    assert sorted(row[0] for row in rows[1:]) == sorted(os.listdir(images))
+
+    # Everything is done, a new run writes nothing
+    assert run(monkeypatch, "--directory", images, "--output", output, "--colors", "blue,green") == 0
+    assert read_rows(output) == rows
+
+
+def test_resume_with_other_colors_is_rejected(monkeypatch, tmp_path, images):
+    """Resuming an output with other colors fails instead of writing rows under a mismatched header."""
+    for name in ("results.csv", "results.jsonl"):
+        output = str(tmp_path / name)
+        assert run(monkeypatch, "--directory", images, "--output", output, "--colors", "green") == 0
+        with open(output) as f:
+            written = f.read()
+        with pytest.raises(SystemExit) as error:
+            run(monkeypatch, "--directory", images, "--output", output, "--colors", "green,red")
+        assert error.value.code == 2
+        with open(output) as f:
+            assert f.read() == written
+
+        assert run(monkeypatch, "--directory", images, "--output", output, "--colors", "green,red", "--no-resume") == 0
+
+
+def test_resume_truncates_partial_line(tmp_path):
+    """A partially written last jsonl line is removed and its image reprocessed."""
+    output = str(tmp_path / "results.jsonl")
+    with open(output, "w") as f:
+        f.write('{"key": "a.jpg", "empty_holes": {"green": 1}, "error": null}\n{"key": "b.jpg", "empty_h')
+    assert reprocess.read_done(output, "jsonl") == ({ "a.jpg" }, ["green"])
+    with open(output) as f:
+        assert f.read().count("\n") == 1
+
+
+def test_save_honors_store_path(monkeypatch, tmp_path, images):
+    """The artifacts saved with --save go to the --store-path localstore."""
+    store_path = str(tmp_path / "store")
+    assert run(monkeypatch, "--directory", images, "--output", str(tmp_path / "results.jsonl"), "--save", "--store-path", store_path) == 0
+    for name in os.listdir(images):
+        id = "reprocess_" + os.path.splitext(name)[0]
+        assert os.path.isfile(os.path.join(store_path, get_shard(id), id, "frame.jpg"))
@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ResultCache import ResultCache
+
+
+def test_cache_bounded_by_bytes():
+    """The least recently used results are evicted once the cached results exceed max_bytes."""
+    cache = ResultCache(maxsize=100, ttl=3600, max_bytes=1000)
+    keys = [cache.key("frame_{0}".format(index).encode(), ("full",)) for index in range(5)]
+    for index, key in enumerate(keys[:3]):
+        cache.put(key, index, 400)
+    assert cache.stats()["size"] == 2 and cache.stats()["bytes"] == 800
+    assert cache.get(keys[0]) is None and cache.get(keys[1]) == 1
+
+    cache.put(keys[3], 3, 400) # keys[1] was just used, keys[2] is evicted
+    assert cache.get(keys[2]) is None and cache.get(keys[1]) == 1
+    cache.put(keys[1], 1, 100) # Replacing a result updates its size
+    cache.put(keys[4], 4, 2000) # Larger than max_bytes, not cached
+    assert cache.get(keys[4]) is None and cache.stats()["bytes"] == 500
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+
+import cv2
+import pytest
+
+from conftest import ROOT_PATH
+from module import IMAGE_NONE
+from ColorDetector import ColorDetector
+from HoleTracker import HoleTracker
+from StreamProcessor import StreamProcessor
+
+
+# Frames of each shelf state in the video, and frames skipped between the checked ones
+STATE_FRAMES = 15
+FRAME_SKIP = 4
+
+# 720p video and its calibration profile, smaller frames keep the test fast
+SIZE = (1280, 720)
+PROFILE = "t485_720p"
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    """Write a 720p video of a shelf state followed by another one with other blue empty holes.
+
+    Returns:
+        tuple: video path and the empty holes of each state, detected on the decoded video frames.
+    """
+    paths = sorted(glob.glob(os.path.join(ROOT_PATH, "dataset", "*.jpg")))
+    images = [cv2.resize(cv2.imread(paths[index]), SIZE, interpolation=cv2.INTER_AREA) for index in (0, 3)]
+    path = str(tmp_path_factory.mktemp("stream") / "shelf.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"HFYU"), 10, SIZE) # Lossless, the frames of a state are identical
+    if not writer.isOpened():
+        pytest.skip("OpenCV can't write HFYU videos")
+    for image in images:
+        for _ in range(STATE_FRAMES):
+            writer.write(image)
+    writer.release()
+
+    capture = cv2.VideoCapture(path)
+    detector = ColorDetector()
+    empty_holes = []
+    for index in range(2 * STATE_FRAMES):
+        ok, frame = capture.read()
+        assert ok
+        if index % STATE_FRAMES == 0:
+            empty_holes.append(detector.identify_color_contours("stream", frame, "blue", ext="jpg", image_mode=IMAGE_NONE, save=False, profile=PROFILE)["empty_holes"])
+    capture.release()
+    assert empty_holes[0] != empty_holes[1]
+
+    return path, empty_holes
+
+
+def test_skips_unchanged_frames_and_emits_changes(video):
+    """Only one of every frame_skip + 1 frames is read, only the changed ones are detected and an event is emitted per change."""
+    path, empty_holes = video
+    events = []
+    processor = StreamProcessor(ColorDetector(), path, "blue", frame_skip=FRAME_SKIP, profile=PROFILE, on_event=events.append)
+    stats = processor.run()
+
+    checked = 2 * STATE_FRAMES // (FRAME_SKIP + 1)
+    assert stats == { "frames" : 2 * STATE_FRAMES, "skipped" : 2 * STATE_FRAMES - checked, "unchanged" : checked - 2, "detected" : 2, "events" : 2 }
+    assert [(event["frame"], event["empty_holes"], event["previous_empty_holes"]) for event in events] == [(0, empty_holes[0], None), (STATE_FRAMES, empty_holes[1], empty_holes[0])]
+
+
+def test_max_frames(video):
+    """The stream stops after max_frames frames."""
+    path, _ = video
+    processor = StreamProcessor(ColorDetector(), path, "blue", frame_skip=FRAME_SKIP, profile=PROFILE, on_event=lambda event: None)
+    assert processor.run(max_frames=7)["frames"] == 7
+
+
+def test_tracked_events_wait_for_the_warm_up(video):
+    """With a tracker the first event waits for the holes to be confirmed instead of reporting 0 holes."""
+    path, empty_holes = video
+    events = []
+    processor = StreamProcessor(ColorDetector(), path, "blue", frame_skip=FRAME_SKIP, profile=PROFILE, on_event=events.append, tracker=HoleTracker(min_frames=3))
+    stats = processor.run()
+
+    # Every checked frame is detected while holes are pending
+    assert stats["unchanged"] < 2 * STATE_FRAMES // (FRAME_SKIP + 1) - 2
+    first = events[0]
+    assert (first["frame"], first["empty_holes"], first["previous_empty_holes"]) == (2 * (FRAME_SKIP + 1), empty_holes[0], None)
+    assert events[-1]["empty_holes"] == empty_holes[1]
+    assert all(event["empty_holes"] > 0 for event in events)
+
+
+def test_unknown_color():
+    """A color missing from the profile is rejected."""
+    with pytest.raises(ValueError):
+        StreamProcessor(ColorDetector(), "unused.avi", "purple")